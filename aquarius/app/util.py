@@ -44,6 +44,18 @@ def get_bool_env_value(envvar_name, default_value=0):
         return bool(default_value)
 
 
+def get_int_env_value(envvar_name, default_value=0, min_value=None):
+    try:
+        value = int(os.getenv(envvar_name, default_value))
+    except (ValueError, TypeError):
+        value = int(default_value)
+
+    if min_value is not None:
+        value = max(value, min_value)
+
+    return value
+
+
 def get_request_data(request, url_params_only=False):
     if url_params_only:
         return request.args
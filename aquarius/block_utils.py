@@ -1,14 +1,175 @@
+import json
+import logging
 import os
 from abc import ABC
 
-from aquarius.app.util import get_bool_env_value
+import elasticsearch
+
+from aquarius.app.util import get_bool_env_value, get_int_env_value
+
+logger = logging.getLogger(__name__)
 
 
 class BlockProcessingClass(ABC):
+    """Base of the event processors that keep track of the last processed block.
+
+    The checkpoint (last block, its hash and the per event type cursors) is saved in
+    the `_plus` index under the `checkpoint_id` document, without waiting for an
+    index refresh. When the `CHECKPOINTS_DIR` envvar is set, it is first written to
+    a local file in that folder. On restart, the newest of the file and the index
+    checkpoints is used, as either one is left behind when its write fails.
+
+    Only blocks that are `EVENTS_CONFIRMATIONS` blocks deep are processed. The hashes
+    of the last `EVENTS_REORG_HASHES` checkpointed blocks are kept in the checkpoint,
+    `get_resume_block` compares them with the chain to detect a reorg and returns the
+    last block that is still canonical.
+    """
+
     @property
     def block_envvar(self):
         return ""
 
+    @property
+    def checkpoint_id(self):
+        return ""
+
+    def _checkpoint_file(self):
+        checkpoints_dir = os.getenv("CHECKPOINTS_DIR")
+        if not checkpoints_dir:
+            return None
+
+        return os.path.join(
+            checkpoints_dir, f"{self._other_db_index}.{self.checkpoint_id}.json"
+        )
+
+    def get_checkpoint(self):
+        checkpoint = None
+        checkpoint_file = self._checkpoint_file()
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            try:
+                with open(checkpoint_file) as f:
+                    checkpoint = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"reading checkpoint file {checkpoint_file} failed: {e}")
+
+        try:
+            stored = self._oceandb.driver.es.get(
+                index=self._other_db_index, id=self.checkpoint_id, doc_type="_doc"
+            )["_source"]
+        except Exception as e:
+            if checkpoint is None:
+                raise
+
+            logger.warning(
+                f"reading checkpoint {self.checkpoint_id} from the index failed: {e}"
+            )
+            stored = None
+
+        if checkpoint is None or (
+            stored is not None
+            and (stored.get("last_block") or 0) > (checkpoint.get("last_block") or 0)
+        ):
+            checkpoint = stored
+
+        self._recent_hashes = checkpoint.get("recent_hashes") or []
+        return checkpoint
+
+    def get_last_processed_block(self):
+        return self.get_checkpoint()["last_block"]
+
+    def store_last_processed_block(self, block, block_hash=None, cursors=None):
+        recent_hashes = [
+            entry for entry in getattr(self, "_recent_hashes", []) if entry[0] < block
+        ]
+        if block_hash:
+            recent_hashes.append([block, block_hash])
+        self._recent_hashes = recent_hashes[
+            -get_int_env_value("EVENTS_REORG_HASHES", 32, min_value=1) :
+        ]
+
+        record = {
+            "last_block": block,
+            "block_hash": block_hash,
+            "cursors": cursors or {},
+            "recent_hashes": self._recent_hashes,
+        }
+        checkpoint_file = self._checkpoint_file()
+        if checkpoint_file:
+            try:
+                tmp_file = f"{checkpoint_file}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(record, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, checkpoint_file)
+            except OSError as e:
+                logger.error(f"writing checkpoint file {checkpoint_file} failed: {e}")
+
+        try:
+            self._oceandb.driver.es.index(
+                index=self._other_db_index,
+                id=self.checkpoint_id,
+                body=record,
+                doc_type="_doc",
+            )["_id"]
+
+        except elasticsearch.exceptions.RequestError as e:
+            logger.error(
+                f"store_last_processed_block: block={block} type={type(block)}, error={e}"
+            )
+
+    def get_block_hash(self, block):
+        try:
+            return self._web3.eth.getBlock(block)["hash"].hex()
+        except Exception as e:
+            logger.warning(f"reading the hash of block {block} failed: {e}")
+            return None
+
+    def get_confirmed_block(self):
+        """Return the latest block that has `EVENTS_CONFIRMATIONS` confirmations."""
+        block = self._web3.eth.blockNumber
+        if not block or not isinstance(block, int):
+            return block
+
+        return max(block - get_int_env_value("EVENTS_CONFIRMATIONS", 0), 0)
+
+    def get_resume_block(self, last_block):
+        """Return the block to resume processing from.
+
+        This is `last_block` unless the chain was reorganised since it was stored,
+        in which case it is the newest checkpointed block that is still canonical
+        (or the block before the oldest known one if none is).
+        """
+        recent_hashes = getattr(self, "_recent_hashes", [])
+        for i in range(len(recent_hashes) - 1, -1, -1):
+            block, block_hash = recent_hashes[i]
+            chain_hash = self.get_block_hash(block)
+            if chain_hash is None:
+                # the node can not tell, keep going from the checkpoint
+                return last_block
+
+            if chain_hash == block_hash:
+                if i == len(recent_hashes) - 1:
+                    return last_block
+
+                self._recent_hashes = recent_hashes[: i + 1]
+                logger.warning(
+                    f"chain reorg detected after block {block}, reprocessing "
+                    f"blocks {block + 1}-{last_block}."
+                )
+                return block
+
+        if not recent_hashes:
+            return last_block
+
+        self._recent_hashes = []
+        block = max(recent_hashes[0][0] - 1, 0)
+        logger.warning(
+            f"chain reorg detected deeper than the {len(recent_hashes)} known blocks, "
+            f"reprocessing blocks {block + 1}-{last_block}."
+        )
+        return block
+
     def get_or_set_last_block(self):
         ignore_last_block = get_bool_env_value("IGNORE_LAST_BLOCK", 0)
         _block = int(os.getenv(self.block_envvar, 0))
@@ -23,3 +184,38 @@ class BlockProcessingClass(ABC):
             self.store_last_processed_block(_block)
 
             return _block
+
+
+class BlockRangeChunker:
+    """Split a block range into chunks whose size adapts to the RPC responses.
+
+    The chunk size doubles (up to `max_size`) after a request that was answered
+    quickly with few results and halves (down to `min_size`) when the RPC
+    rejects or times out on a request.
+    """
+
+    def __init__(
+        self, size, min_size=1, max_size=100000, target_seconds=5, max_results=1000
+    ):
+        self.min_size = max(min_size, 1)
+        self.max_size = max(max_size, self.min_size)
+        self.size = min(max(size, self.min_size), self.max_size)
+        self.target_seconds = target_seconds
+        self.max_results = max_results
+
+    def next_range(self, from_block, last_block):
+        return from_block, min(from_block + self.size - 1, last_block)
+
+    def adjust(self, elapsed, num_results):
+        if elapsed < self.target_seconds and num_results < self.max_results:
+            self.size = min(self.size * 2, self.max_size)
+        elif num_results >= self.max_results:
+            self.size = max(self.size // 2, self.min_size)
+
+    def shrink(self):
+        """Halve the chunk size, return False if it is already at the minimum."""
+        if self.size <= self.min_size:
+            return False
+
+        self.size = max(self.size // 2, self.min_size)
+        return True
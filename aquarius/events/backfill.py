@@ -0,0 +1,219 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from aquarius.block_utils import BlockRangeChunker
+from aquarius.events.bulk_writer import BulkWriter
+from aquarius.events.events_monitor import (
+    decode_and_validate_ddo_in_worker,
+    get_metadata_event_logs,
+    init_decode_worker,
+)
+from aquarius.events.util import get_blocks_timestamps, setup_web3
+
+logger = logging.getLogger(__name__)
+
+_worker_web3 = None
+
+
+class BackfillError(Exception):
+    pass
+
+
+def split_block_range(from_block, to_block, shard_size):
+    """Return the list of (start, end) shards covering `from_block`-`to_block`."""
+    return [
+        (start, min(start + shard_size - 1, to_block))
+        for start in range(from_block, to_block + 1, shard_size)
+    ]
+
+
+def _init_worker(config_file, ecies_private_key):
+    global _worker_web3
+    _worker_web3 = setup_web3(config_file)
+    init_decode_worker(ecies_private_key)
+
+
+def fetch_shard(
+    from_block, to_block, contract_address, event_abis, decode_args, chunk_size=1000
+):
+    """Read and decode the metadata events of a block range, runs in a worker
+    process.
+
+    :return: tuple (events, decoded, timestamps) with `events` in chain order,
+        `decoded` the dict of (blockNumber, logIndex) -> (record, error) and
+        `timestamps` the dict of block number -> timestamp of the event blocks.
+    """
+    web3 = _worker_web3
+    chunker = BlockRangeChunker(chunk_size)
+    events = []
+    start_block = from_block
+    while start_block <= to_block:
+        start, end = chunker.next_range(start_block, to_block)
+        start_time = time.time()
+        try:
+            logs = get_metadata_event_logs(
+                web3, contract_address, event_abis, start, end
+            )
+        except (ValueError, requests.exceptions.Timeout):
+            if chunker.shrink():
+                continue
+            raise
+
+        chunker.adjust(time.time() - start_time, len(logs))
+        events.extend(logs)
+        start_block = end + 1
+
+    timestamps = get_blocks_timestamps(web3, sorted({e.blockNumber for e in events}))
+    decoded = {
+        (event.blockNumber, event.logIndex): decode_and_validate_ddo_in_worker(
+            event.args.get("data", None),
+            event.args.get("flags", None),
+            timestamps[event.blockNumber],
+            f"event {event.event}",
+            *decode_args,
+        )
+        for event in events
+    }
+    logger.info(f"fetched {len(events)} events in blocks {from_block}-{to_block}.")
+    return events, decoded, timestamps
+
+
+class Backfill:
+    """Rebuild the metadata catalog from the chain history.
+
+    The block range from the events monitor checkpoint to the latest confirmed
+    block is split in shards of `shard_size` blocks whose events are read and
+    decoded by `workers` processes. The shards are then applied in chain order
+    with the events monitor, so the last event of each did wins, and saved with
+    bulk requests while the index refresh is disabled, and appended to the events
+    journal if there is one. The checkpoint is finally set to the last block so the
+    events monitor continues from there.
+    """
+
+    def __init__(self, monitor, config_file, workers=4, shard_size=100000):
+        self._monitor = monitor
+        self._config_file = config_file
+        self._workers = workers
+        self._shard_size = shard_size
+        self._es = monitor._oceandb.driver.es
+        self._index = monitor._oceandb.driver.db_index
+
+    def run(self):
+        monitor = self._monitor
+        try:
+            checkpoint = monitor.get_checkpoint()
+            from_block = checkpoint["last_block"]
+            monitor._cursors = checkpoint.get("cursors") or dict()
+        except Exception:
+            from_block = monitor.get_or_set_last_block()
+            monitor._cursors = dict()
+
+        to_block = monitor.get_confirmed_block()
+        if not isinstance(to_block, int) or to_block <= from_block:
+            logger.info(f"nothing to backfill, last processed block is {from_block}.")
+            return from_block
+
+        shards = split_block_range(from_block, to_block, self._shard_size)
+        logger.info(
+            f"backfilling blocks {from_block}-{to_block} in {len(shards)} shards "
+            f"with {self._workers} workers."
+        )
+        decode_args = (monitor._only_encrypted_ddo, monitor._max_ddo_size)
+        bulk_writer = monitor._bulk_writer
+        monitor._bulk_writer = BulkWriter(
+            self._es,
+            self._index,
+            max_actions=bulk_writer._max_actions,
+            max_bytes=bulk_writer._max_bytes,
+            refresh=False,
+        )
+        refresh_interval = self._disable_refresh()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self._workers,
+                initializer=_init_worker,
+                initargs=(self._config_file, monitor._ecies_private_key),
+            ) as pool:
+                for (start, end), result in self._fetch_shards(
+                    pool, shards, decode_args
+                ):
+                    self._apply_shard(start, end, *result)
+        finally:
+            monitor._bulk_writer = bulk_writer
+            self._restore_refresh(refresh_interval)
+
+        logger.info(f"backfill done up to block {to_block}.")
+        return to_block
+
+    def _fetch_shards(self, pool, shards, decode_args):
+        """Yield the (shard, result) of `fetch_shard` in the order of `shards`,
+        with at most two shards per worker fetched ahead, so the results of the
+        whole range are never held at once."""
+        monitor = self._monitor
+        shards = iter(shards)
+        pending = deque()
+
+        def submit():
+            for start, end in shards:
+                future = pool.submit(
+                    fetch_shard,
+                    start,
+                    end,
+                    monitor._contract_address,
+                    monitor._event_abis,
+                    decode_args,
+                )
+                pending.append(((start, end), future))
+                return
+
+        for _ in range(2 * self._workers):
+            submit()
+
+        while pending:
+            shard, future = pending.popleft()
+            result = future.result()
+            submit()
+            yield shard, result
+
+    def _apply_shard(self, start, end, events, decoded, timestamps):
+        monitor = self._monitor
+        for block, timestamp in timestamps.items():
+            monitor._block_timestamps[block] = timestamp
+
+        monitor.process_block_range_events(events, decoded)
+        if not monitor._bulk_writer.flush():
+            raise BackfillError(f"saving the ddos of blocks {start}-{end} failed.")
+
+        if monitor._journal:
+            monitor._append_to_journal(events, start)
+        monitor.store_last_processed_block(
+            end, monitor.get_block_hash(end), monitor._cursors
+        )
+        logger.info(f"applied {len(events)} events of blocks {start}-{end}.")
+
+    def _disable_refresh(self):
+        settings = self._es.indices.get_settings(index=self._index)
+        refresh_interval = (
+            settings.get(self._index, {})
+            .get("settings", {})
+            .get("index", {})
+            .get("refresh_interval")
+        )
+        self._es.indices.put_settings(
+            index=self._index, body={"index": {"refresh_interval": "-1"}}
+        )
+        return refresh_interval
+
+    def _restore_refresh(self, refresh_interval):
+        self._es.indices.put_settings(
+            index=self._index, body={"index": {"refresh_interval": refresh_interval}}
+        )
+        self._es.indices.refresh(index=self._index)
@@ -0,0 +1,111 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+"""Fixed-point math of the Balancer pools, see `BNum.sol` and `BMath.sol`.
+
+All the values are integers in base 18, as in the contracts, and the results are
+the same as those of the contracts' `calcSpotPrice` and `calcInGivenOut`. A call
+that the contracts would revert raises a `ValueError`.
+"""
+
+BONE = 10**18
+MIN_BPOW_BASE = 1
+MAX_BPOW_BASE = 2 * BONE - 1
+BPOW_PRECISION = BONE // 10**10
+
+
+def bsub(a, b):
+    if b > a:
+        raise ValueError("ERR_SUB_UNDERFLOW")
+    return a - b
+
+
+def bsub_sign(a, b):
+    return (a - b, False) if a >= b else (b - a, True)
+
+
+def bmul(a, b):
+    return (a * b + BONE // 2) // BONE
+
+
+def bdiv(a, b):
+    if b == 0:
+        raise ValueError("ERR_DIV_ZERO")
+    return (a * BONE + b // 2) // b
+
+
+def bpowi(a, n):
+    z = a if n % 2 != 0 else BONE
+    n //= 2
+    while n != 0:
+        a = bmul(a, a)
+        if n % 2 != 0:
+            z = bmul(z, a)
+        n //= 2
+
+    return z
+
+
+def bpow_approx(base, exp, precision):
+    a = exp
+    x, xneg = bsub_sign(base, BONE)
+    term = BONE
+    total = term
+    negative = False
+    i = 1
+    while term >= precision:
+        big_k = i * BONE
+        c, cneg = bsub_sign(a, bsub(big_k, BONE))
+        term = bdiv(bmul(term, bmul(c, x)), big_k)
+        if term == 0:
+            break
+
+        if xneg:
+            negative = not negative
+        if cneg:
+            negative = not negative
+        total = bsub(total, term) if negative else total + term
+        i += 1
+
+    return total
+
+
+def bpow(base, exp):
+    if base < MIN_BPOW_BASE:
+        raise ValueError("ERR_BPOW_BASE_TOO_LOW")
+    if base > MAX_BPOW_BASE:
+        raise ValueError("ERR_BPOW_BASE_TOO_HIGH")
+
+    whole = (exp // BONE) * BONE
+    remain = exp - whole
+    whole_pow = bpowi(base, whole // BONE)
+    if remain == 0:
+        return whole_pow
+
+    return bmul(whole_pow, bpow_approx(base, remain, BPOW_PRECISION))
+
+
+def calc_spot_price(
+    token_balance_in, token_weight_in, token_balance_out, token_weight_out, swap_fee
+):
+    numer = bdiv(token_balance_in, token_weight_in)
+    denom = bdiv(token_balance_out, token_weight_out)
+    ratio = bdiv(numer, denom)
+    scale = bdiv(BONE, bsub(BONE, swap_fee))
+    return bmul(ratio, scale)
+
+
+def calc_in_given_out(
+    token_balance_in,
+    token_weight_in,
+    token_balance_out,
+    token_weight_out,
+    token_amount_out,
+    swap_fee,
+):
+    weight_ratio = bdiv(token_weight_out, token_weight_in)
+    diff = bsub(token_balance_out, token_amount_out)
+    y = bdiv(token_balance_out, diff)
+    foo = bsub(bpow(y, weight_ratio), BONE)
+    return bdiv(bmul(token_balance_in, foo), bsub(BONE, swap_fee))
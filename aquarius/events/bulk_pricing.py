@@ -0,0 +1,73 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import numpy as np
+
+
+def select_pools_prices(
+    groups,
+    ocn_balances,
+    ocn_weights,
+    dt_balances,
+    dt_weights,
+    swap_fees,
+    price_too_large,
+):
+    """Price all the pools at once and select the cheapest pool of each datatoken.
+
+    Each array has one entry per pool, `groups` is the index of the pool's datatoken
+    and the balances and swap fees are in token units (not base 18). The spot price
+    and the price of buying one datatoken are computed with the Balancer formulas in
+    floating point. The pool of a datatoken is the one with the lowest spot price in
+    ]0, `price_too_large`], the first one in case of a tie. Its price is set to 0 if
+    it has 1 datatoken or less, if it is above `price_too_large` or if the pool
+    contract would not sell one datatoken.
+
+    :return: dict of group -> (dt reserve, ocean reserve, price, pool index)
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    ocn_balances = np.asarray(ocn_balances, dtype=np.float64)
+    ocn_weights = np.asarray(ocn_weights, dtype=np.float64)
+    dt_balances = np.asarray(dt_balances, dtype=np.float64)
+    dt_weights = np.asarray(dt_weights, dtype=np.float64)
+    swap_fees = np.asarray(swap_fees, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        spot_prices = (
+            (ocn_balances / ocn_weights)
+            / (dt_balances / dt_weights)
+            / (1.0 - swap_fees)
+        )
+        # bpow only accepts a base below 2, i.e. more than 2 datatokens in the pool
+        base = dt_balances / (dt_balances - 1.0)
+        prices = (
+            ocn_balances
+            * (base ** (dt_weights / ocn_weights) - 1.0)
+            / (1.0 - swap_fees)
+        )
+
+    valid = np.isfinite(spot_prices) & (spot_prices > 0.0)
+    valid &= spot_prices <= price_too_large
+    candidates = np.flatnonzero(valid)
+    # sort by datatoken, then spot price, then pool order and keep the first pool
+    order = candidates[
+        np.lexsort((candidates, spot_prices[candidates], groups[candidates]))
+    ]
+    _, first = np.unique(groups[order], return_index=True)
+    best = order[first]
+
+    best_prices = prices[best]
+    best_prices[~np.isfinite(best_prices) | (base[best] >= 2.0)] = 0.0
+    best_prices[dt_balances[best] <= 1.0] = 0.0
+    best_prices[best_prices > price_too_large] = 0.0
+
+    return {
+        int(groups[i]): (
+            float(dt_balances[i]),
+            float(ocn_balances[i]),
+            float(price),
+            int(i),
+        )
+        for i, price in zip(best, best_prices)
+    }
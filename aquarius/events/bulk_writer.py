@@ -0,0 +1,174 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from elasticsearch.helpers import streaming_bulk
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter:
+    """Buffer document writes to an Elasticsearch index and send them with the
+    bulk API.
+
+    Only the last operation per document id is kept, partial updates are merged in
+    the pending operation of their document. `flush` sends the buffered
+    operations in requests of at most `max_actions` operations and `max_bytes`
+    bytes. Items rejected with a retryable status (429, 5xx or a connection error)
+    are retried up to `max_retries` times, other failures are logged and dropped.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        es,
+        index,
+        max_actions=500,
+        max_bytes=10 * 1024 * 1024,
+        max_retries=3,
+        refresh="wait_for",
+    ):
+        self._es = es
+        self._index = index
+        self._max_actions = max_actions
+        self._max_bytes = max_bytes
+        self._max_retries = max_retries
+        self._refresh = refresh
+        self._actions = OrderedDict()
+
+    def __len__(self):
+        return len(self._actions)
+
+    def index(self, doc_id, doc):
+        self._actions.pop(doc_id, None)
+        self._actions[doc_id] = {
+            "_op_type": "index",
+            "_index": self._index,
+            "_type": "_doc",
+            "_id": doc_id,
+            "_source": doc,
+        }
+
+    def update(self, doc_id, partial_doc):
+        """Buffer a partial update of the fields in `partial_doc`, it is merged in a
+        pending operation of the same document if there is one. Like Elasticsearch,
+        the objects of `partial_doc` are merged in the existing ones. An update of a
+        document pending deletion is dropped, as Elasticsearch would reject it."""
+        action = self._actions.get(doc_id)
+        if action and action["_op_type"] == "delete":
+            return
+
+        if action and action["_op_type"] == "index":
+            _merge(action["_source"], partial_doc)
+            return
+
+        if action and action["_op_type"] == "update":
+            _merge(action["doc"], partial_doc)
+            return
+
+        self._actions[doc_id] = {
+            "_op_type": "update",
+            "_index": self._index,
+            "_type": "_doc",
+            "_id": doc_id,
+            "doc": _merge(dict(), partial_doc),
+        }
+
+    def delete(self, doc_id):
+        self._actions.pop(doc_id, None)
+        self._actions[doc_id] = {
+            "_op_type": "delete",
+            "_index": self._index,
+            "_type": "_doc",
+            "_id": doc_id,
+        }
+
+    def discard(self, doc_id):
+        """Drop the pending operation of `doc_id`, if any."""
+        self._actions.pop(doc_id, None)
+
+    def get(self, doc_id):
+        """Return the buffered document for `doc_id` or None if there is no
+        pending `index` operation for it."""
+        action = self._actions.get(doc_id)
+        if action and action["_op_type"] == "index":
+            return action["_source"]
+
+        return None
+
+    def flush(self):
+        """Send all buffered operations.
+
+        :return: True if no operation is left to retry.
+        """
+        retries = 0
+        while self._actions:
+            failed = self._send(list(self._actions.values()))
+            self._actions = OrderedDict(
+                (doc_id, action)
+                for doc_id, action in self._actions.items()
+                if doc_id in failed
+            )
+            if not self._actions:
+                break
+
+            if retries >= self._max_retries:
+                logger.error(
+                    f"bulk write to {self._index} failed for {len(self._actions)} "
+                    f"documents after {retries} retries."
+                )
+                return False
+
+            retries += 1
+            time.sleep(min(2**retries, 30))
+
+        return True
+
+    def _send(self, actions):
+        """Return the ids of the documents that should be sent again."""
+        failed = set()
+        try:
+            for ok, item in streaming_bulk(
+                self._es,
+                actions,
+                chunk_size=self._max_actions,
+                max_chunk_bytes=self._max_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+                refresh=self._refresh,
+            ):
+                if ok:
+                    continue
+
+                result = list(item.values())[0]
+                doc_id = result.get("_id")
+                status = result.get("status")
+                if status in self.RETRY_STATUSES or not isinstance(status, int):
+                    failed.add(doc_id)
+
+                logger.error(
+                    f"bulk write of document {doc_id} to {self._index} failed: "
+                    f"status={result.get('status')}, "
+                    f"error={json.dumps(result.get('error'))}"
+                )
+        except Exception as e:
+            logger.error(f"bulk write to {self._index} failed: {e}")
+            failed = {action["_id"] for action in actions}
+
+        return failed
+
+
+def _merge(doc, partial_doc):
+    for field, value in partial_doc.items():
+        if isinstance(value, dict) and isinstance(doc.get(field), dict):
+            _merge(doc[field], value)
+        else:
+            doc[field] = copy.deepcopy(value) if isinstance(value, dict) else value
+    return doc
@@ -0,0 +1,216 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+from threading import Lock
+
+from elasticsearch.helpers import scan
+from eth_utils import add_0x_prefix, event_signature_to_log_topic
+from web3 import Web3
+
+from aquarius.events.bulk_writer import BulkWriter
+from aquarius.events.util import get_datatokens_info
+
+logger = logging.getLogger(__name__)
+
+# fields of the datatoken info, see `get_datatokens_info`
+IMMUTABLE_FIELDS = ("address", "name", "symbol", "decimals", "cap")
+MUTABLE_FIELDS = ("totalSupply", "minter", "minterBalance")
+FIELDS = (
+    "address",
+    "name",
+    "symbol",
+    "decimals",
+    "totalSupply",
+    "cap",
+    "minter",
+    "minterBalance",
+)
+
+TRANSFER_TOPIC = add_0x_prefix(
+    event_signature_to_log_topic("Transfer(address,address,uint256)").hex()
+)
+
+
+class DatatokenInfoCache:
+    """Persistent cache of the datatoken info, see `get_datatokens_info`.
+
+    The immutable fields (name, symbol, decimals, cap) are kept forever. The
+    mutable ones (totalSupply, minter and minterBalance) are marked stale when a
+    `Transfer` of the token is seen, which includes mints, and read again on the
+    next access. A field that cannot be read keeps its previous value.
+
+    The datatoken contract emits no event when its minter changes (`approveMinter`),
+    so `minter`, and `minterBalance` with it, can be stale until the next `Transfer`
+    of the token and should not be relied upon.
+
+    The entries are saved in the `index` Elasticsearch index, if `es` is set, and
+    loaded from it at startup.
+    """
+
+    def __init__(self, web3, es=None, index=None, addresses_per_query=100):
+        self._web3 = web3
+        self._es = es
+        self._index = index
+        self._addresses_per_query = addresses_per_query
+        self._lock = Lock()
+        # guards the bulk writer, taken after `_lock` when both are held
+        self._save_lock = Lock()
+        self._entries = dict()
+        self._bulk_writer = None
+        if es is not None:
+            es.indices.create(index=index, ignore=400)
+            self._bulk_writer = BulkWriter(es, index, refresh=False)
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, address, read=True):
+        """Return the info of a datatoken. With `read` False, the cached info is
+        returned as is, without any call, None if the datatoken is not cached."""
+        address = Web3.toChecksumAddress(address)
+        if not read:
+            with self._lock:
+                return self._info(address) if address in self._entries else None
+
+        return self.get_many([address])[address]
+
+    def get_many(self, addresses):
+        """Return the dict of checksum address -> datatoken info, only the missing
+        fields are read from the chain."""
+        addresses = [Web3.toChecksumAddress(a) for a in addresses]
+        with self._lock:
+            missing = [a for a in set(addresses) if not self._is_complete(a)]
+
+        if missing:
+            with self._lock:
+                known = [
+                    a
+                    for a in missing
+                    if a in self._entries
+                    and _is_complete(self._entries[a]["immutable"], IMMUTABLE_FIELDS)
+                ]
+            # only the mutable fields of the known datatokens are read again
+            unknown = [a for a in missing if a not in known]
+            fetched = get_datatokens_info(self._web3, unknown) if unknown else {}
+            if known:
+                fetched.update(
+                    get_datatokens_info(self._web3, known, fields=MUTABLE_FIELDS)
+                )
+            with self._lock:
+                for address, info in fetched.items():
+                    entry = self._entries.get(address) or {
+                        "immutable": None,
+                        "mutable": None,
+                        "stale": False,
+                    }
+                    if not _is_complete(entry["immutable"], IMMUTABLE_FIELDS):
+                        entry["immutable"] = _merge_fields(
+                            entry["immutable"], info, IMMUTABLE_FIELDS
+                        )
+                    entry["mutable"] = _merge_fields(
+                        entry["mutable"], info, MUTABLE_FIELDS
+                    )
+                    # read again on the next access if a field could not be read
+                    entry["stale"] = not _is_complete(info, MUTABLE_FIELDS)
+                    self._entries[address] = entry
+                self._queue_save(fetched.keys())
+            self._flush()
+
+        with self._lock:
+            return {a: self._info(a) for a in addresses}
+
+    def invalidate(self, addresses):
+        """Mark the mutable fields of the datatokens `addresses` stale."""
+        with self._lock:
+            invalidated = []
+            for address in addresses:
+                entry = self._entries.get(Web3.toChecksumAddress(address))
+                if entry and not entry["stale"]:
+                    entry["stale"] = True
+                    invalidated.append(Web3.toChecksumAddress(address))
+            self._queue_save(invalidated)
+        self._flush()
+
+        return invalidated
+
+    def process_transfer_logs(self, from_block, to_block):
+        """Invalidate the cached datatokens with a `Transfer` event in the block range."""
+        with self._lock:
+            addresses = sorted(a for a, e in self._entries.items() if not e["stale"])
+
+        transferred = set()
+        for i in range(0, len(addresses), self._addresses_per_query):
+            logs = self._web3.eth.getLogs(
+                {
+                    "fromBlock": from_block,
+                    "toBlock": to_block,
+                    "address": addresses[i : i + self._addresses_per_query],
+                    "topics": [TRANSFER_TOPIC],
+                }
+            )
+            transferred.update(log["address"] for log in logs)
+
+        return self.invalidate(transferred)
+
+    def _is_complete(self, address):
+        entry = self._entries.get(address)
+        return bool(
+            entry
+            and not entry["stale"]
+            and _is_complete(entry["immutable"], IMMUTABLE_FIELDS)
+            and _is_complete(entry["mutable"], MUTABLE_FIELDS)
+        )
+
+    def _info(self, address):
+        entry = self._entries[address]
+        values = dict(entry["immutable"] or {})
+        values.update(entry["mutable"] or {})
+        return {f: values.get(f) for f in FIELDS}
+
+    def _load(self):
+        try:
+            for hit in scan(
+                self._es, index=self._index, query={"query": {"match_all": {}}}
+            ):
+                self._entries[hit["_id"]] = {
+                    "immutable": hit["_source"].get("immutable"),
+                    "mutable": hit["_source"].get("mutable"),
+                    "stale": hit["_source"].get("stale", False),
+                }
+        except Exception as e:
+            logger.warning(f"loading the datatoken info cache failed: {e}")
+
+        logger.info(f"loaded the info of {len(self._entries)} datatokens.")
+
+    def _queue_save(self, addresses):
+        """Buffer the entries of `addresses`, called with `_lock` held so they are
+        buffered in the order they are changed."""
+        if self._bulk_writer is None:
+            return
+
+        with self._save_lock:
+            for address in addresses:
+                self._bulk_writer.index(address, dict(self._entries[address]))
+
+    def _flush(self):
+        """Send the buffered entries, without holding `_lock` so the cache can be
+        read during the request."""
+        if self._bulk_writer is None:
+            return
+
+        with self._save_lock:
+            self._bulk_writer.flush()
+
+
+def _is_complete(values, fields):
+    return values is not None and all(values.get(f) is not None for f in fields)
+
+
+def _merge_fields(values, info, fields):
+    """Return the `fields` of `info`, keeping the previous `values` of the fields
+    that could not be read."""
+    values = values or {}
+    return {f: info[f] if info.get(f) is not None else values.get(f) for f in fields}
@@ -0,0 +1,122 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import bisect
+import logging
+
+from elasticsearch.helpers import scan
+from eth_utils import remove_0x_prefix
+
+logger = logging.getLogger(__name__)
+
+DID_PREFIX = "did:op:"
+KEY_SIZE = 20
+
+
+def did_to_key(did_or_address):
+    """Return the packed 20 bytes datatoken address of a `did:op:` did or an
+    address, None if it is not a valid address."""
+    if did_or_address.startswith(DID_PREFIX):
+        did_or_address = did_or_address[len(DID_PREFIX) :]
+
+    try:
+        key = bytes.fromhex(remove_0x_prefix(did_or_address))
+    except ValueError:
+        return None
+
+    return key if len(key) == KEY_SIZE else None
+
+
+class _PackedKeys:
+    """Read-only sequence view over a blob of sorted fixed size keys."""
+
+    def __init__(self, blob):
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._blob) // KEY_SIZE
+
+    def __getitem__(self, i):
+        return self._blob[i * KEY_SIZE : (i + 1) * KEY_SIZE]
+
+
+class DidIndex:
+    """Compact in-memory set of the datatoken addresses of known assets.
+
+    The addresses are kept as sorted 20 bytes keys in a single `bytes` blob and
+    looked up by bisection. New addresses go to a small set that is merged into
+    the blob once it holds `merge_size` keys.
+    """
+
+    def __init__(self, dids=(), merge_size=1024):
+        self._blob = b""
+        self._recent = set()
+        self._merge_size = merge_size
+        for did in dids:
+            key = did_to_key(did)
+            if key:
+                self._recent.add(key)
+        self._merge()
+
+    @classmethod
+    def from_elasticsearch(cls, es, index):
+        """Load the dids of all documents in `index` without reading their
+        `_source`."""
+        return cls(
+            hit["_id"]
+            for hit in scan(
+                es,
+                index=index,
+                query={"query": {"match_all": {}}},
+                _source=False,
+                ignore_unavailable=True,
+            )
+        )
+
+    def __len__(self):
+        return len(self._blob) // KEY_SIZE + len(self._recent)
+
+    def __contains__(self, did):
+        key = did_to_key(did)
+        if key is None:
+            return False
+
+        if key in self._recent:
+            return True
+
+        keys = _PackedKeys(self._blob)
+        i = bisect.bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def add(self, did):
+        key = did_to_key(did)
+        if key is None or did in self:
+            return
+
+        self._recent.add(key)
+        if len(self._recent) >= self._merge_size:
+            self._merge()
+
+    def remove(self, did):
+        key = did_to_key(did)
+        if key is None:
+            return
+
+        if key in self._recent:
+            self._recent.discard(key)
+            return
+
+        keys = _PackedKeys(self._blob)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            self._blob = self._blob[: i * KEY_SIZE] + self._blob[(i + 1) * KEY_SIZE :]
+
+    def _merge(self):
+        if not self._recent:
+            return
+
+        keys = _PackedKeys(self._blob)
+        all_keys = {keys[i] for i in range(len(keys))} | self._recent
+        self._blob = b"".join(sorted(all_keys))
+        self._recent = set()
@@ -7,39 +7,285 @@ import logging
 import lzma as Lzma
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from json import JSONDecodeError
 from threading import Thread
 
 import ecies
-import elasticsearch
 import eth_keys
+import lru
 import requests
+from elasticsearch.helpers import scan
 from eth_account import Account
-from eth_utils import add_0x_prefix, remove_0x_prefix
+from eth_utils import add_0x_prefix, event_abi_to_log_topic, remove_0x_prefix
 from ocean_lib.config_provider import ConfigProvider
 from oceandb_driver_interface import OceanDb
 from plecos.plecos import is_valid_dict_remote, list_errors_dict_remote
+from web3.utils.events import get_event_data
 
 from aquarius.app.auth_util import compare_eth_addresses, sanitize_addresses
 from aquarius.app.util import (
     DATETIME_FORMAT,
     format_timestamp,
     get_bool_env_value,
+    get_int_env_value,
     get_metadata_from_services,
     init_new_ddo,
     list_errors,
     validate_data,
 )
-from aquarius.block_utils import BlockProcessingClass
+from aquarius.block_utils import BlockProcessingClass, BlockRangeChunker
+from aquarius.events.bulk_writer import BulkWriter
 from aquarius.events.constants import EVENT_METADATA_CREATED, EVENT_METADATA_UPDATED
+from aquarius.events.datatoken_info import DatatokenInfoCache
+from aquarius.events.did_index import DidIndex
+from aquarius.events.journal import EventJournal
 from aquarius.events.metadata_updater import MetadataUpdater
-from aquarius.events.util import get_datatoken_info, get_metadata_contract
+from aquarius.events.purgatory import (
+    PURGATORY_LIST_URL,
+    Purgatory,
+    PurgatoryListFetcher,
+)
+from aquarius.events.subscription import NewBlocksSubscription
+from aquarius.events.util import (
+    get_blocks_timestamps,
+    get_metadata_contract,
+)
 
 logger = logging.getLogger(__name__)
 
 debug_log = logger.debug
 
+DEFAULT_MAX_DDO_SIZE = 10 * 1024 * 1024
+
+
+# ecies key of a decoding worker process, set by `init_decode_worker`
+_worker_ecies_key = ""
+
+
+def get_ecies_key(ecies_private_key):
+    """Return the hex ecies key derived from `ecies_private_key`, or an empty
+    string if there is no private key."""
+    if not ecies_private_key:
+        return ""
+
+    account = Account.privateKeyToAccount(ecies_private_key)
+    return eth_keys.KeyAPI.PrivateKey(account.privateKey).to_hex()
+
+
+def ecies_decrypt(rawddo, ecies_key):
+    if ecies_key:
+        rawddo = ecies.decrypt(ecies_key, rawddo)
+    return rawddo
+
+
+class DdoTooLargeError(ValueError):
+    pass
+
+
+def lzma_decompress(data, max_size):
+    """Decompress `data` incrementally, raise `DdoTooLargeError` as soon as the
+    output exceeds `max_size` bytes and `LZMAError` if `data` is truncated."""
+    decompressor = Lzma.LZMADecompressor()
+    output = decompressor.decompress(data, max_length=max_size + 1)
+    if len(output) > max_size or (
+        not decompressor.eof and not decompressor.needs_input
+    ):
+        raise DdoTooLargeError(
+            f"decompressed ddo is larger than the maximum of {max_size} bytes"
+        )
+
+    if not decompressor.eof:
+        raise Lzma.LZMAError(
+            "Compressed data ended before the end-of-stream marker was reached"
+        )
+
+    return output
+
+
+def decode_ddo(
+    rawddo,
+    flags,
+    ecies_key="",
+    only_encrypted_ddo=False,
+    max_ddo_size=DEFAULT_MAX_DDO_SIZE,
+):
+    is_debug = logger.isEnabledFor(logging.DEBUG)
+    if is_debug:
+        debug_log(f"flags: {flags}")
+    if len(flags) < 1:
+        debug_log("Set check_flags to 0!")
+        check_flags = 0
+    else:
+        check_flags = flags[0]
+    if only_encrypted_ddo and (not check_flags & 2):
+        logger.error("This aquarius can cache only encrypted ddos")
+        return None
+    if len(rawddo) > max_ddo_size:
+        logger.error(
+            f"ddo of {len(rawddo)} bytes is larger than the maximum of {max_ddo_size} bytes"
+        )
+        return None
+    # always start with MSB -> LSB
+    if is_debug:
+        debug_log(f"checkflags: {check_flags}")
+    # bit 2:  check if ddo is ecies encrypted
+    if check_flags & 2:
+        try:
+            rawddo = ecies_decrypt(rawddo, ecies_key)
+            if is_debug:
+                debug_log(f"Decrypted to {rawddo}")
+        except (KeyError, Exception) as err:
+            logger.error(f"Failed to decrypt: {str(err)}")
+
+    # bit 1:  check if ddo is lzma compressed
+    if check_flags & 1:
+        try:
+            rawddo = lzma_decompress(rawddo, max_ddo_size)
+            if is_debug:
+                debug_log(f"Decompressed to {rawddo}")
+        except DdoTooLargeError as err:
+            logger.error(str(err))
+            return None
+        except (KeyError, Exception) as err:
+            logger.error(f"Failed to decompress: {str(err)}")
+
+    if is_debug:
+        debug_log(f"After unpack rawddo:{rawddo}")
+    try:
+        ddo = json.loads(rawddo)
+        return ddo
+    except (KeyError, Exception) as err:
+        logger.error(f"encountered an error while decoding the ddo: {str(err)}")
+        return None
+
+
+def decode_and_validate_ddo(
+    rawddo,
+    flags,
+    timestamp,
+    context,
+    ecies_key="",
+    only_encrypted_ddo=False,
+    max_ddo_size=DEFAULT_MAX_DDO_SIZE,
+):
+    """Decode the raw ddo from an event log and validate it.
+
+    :param ecies_key: hex ecies key, see `get_ecies_key`
+    :return: tuple (record, error), `record` is the ddo initialised with
+        `init_new_ddo` or None if decoding or validation failed.
+    """
+    data = decode_ddo(rawddo, flags, ecies_key, only_encrypted_ddo, max_ddo_size)
+    if data is None:
+        return None, f"Could not decode ddo using flags {flags}"
+
+    msg, _ = validate_data(data, context)
+    if msg:
+        return None, msg
+
+    _record = init_new_ddo(data, timestamp)
+    metadata = get_metadata_from_services(_record["service"])
+    if not is_valid_dict_remote(metadata):
+        errors = list_errors(list_errors_dict_remote, metadata)
+        return None, f"{context} ddo has validation errors: {errors}"
+
+    return _record, None
+
+
+def init_decode_worker(ecies_private_key):
+    """Initializer of the decoding worker processes, derives the ecies key once."""
+    global _worker_ecies_key
+    _worker_ecies_key = get_ecies_key(ecies_private_key)
+
+
+def decode_and_validate_ddo_in_worker(
+    rawddo,
+    flags,
+    timestamp,
+    context,
+    only_encrypted_ddo=False,
+    max_ddo_size=DEFAULT_MAX_DDO_SIZE,
+):
+    """`decode_and_validate_ddo` with the ecies key of the worker process, see
+    `init_decode_worker`."""
+    return decode_and_validate_ddo(
+        rawddo,
+        flags,
+        timestamp,
+        context,
+        _worker_ecies_key,
+        only_encrypted_ddo,
+        max_ddo_size,
+    )
+
+
+def get_metadata_event_logs(
+    web3, contract_address, event_abis, from_block, to_block, data_tokens=None
+):
+    """Return the events of `event_abis` (topic -> abi) emitted by `contract_address`
+    in the block range, optionally only those of the datatokens `data_tokens`,
+    decoded and sorted in chain order."""
+    _filter = {
+        "fromBlock": from_block,
+        "toBlock": to_block,
+        "address": contract_address,
+        "topics": [list(event_abis.keys())],
+    }
+    if data_tokens:
+        _filter["topics"].append(
+            ["0x" + remove_0x_prefix(dt).lower().rjust(64, "0") for dt in data_tokens]
+        )
+
+    def _get_logs():
+        debug_log(f"get_event_logs ({from_block}, {to_block})..")
+        return web3.eth.getLogs(_filter)
+
+    try:
+        logs = _get_logs()
+    except (ValueError, requests.exceptions.Timeout) as e:
+        logger.error(
+            f"get_event_logs ({from_block}, {to_block}) failed: {e}.\n Retrying once more."
+        )
+        logs = _get_logs()
+
+    logs = sorted(logs, key=lambda l: (l["blockNumber"], l["logIndex"]))
+    return [
+        get_event_data(event_abis[add_0x_prefix(log["topics"][0].hex())], log)
+        for log in logs
+    ]
+
+
+def _event_sender(event):
+    return event.args.get("createdBy", event.args.get("updatedBy"))
+
+
+def _keeps_owner(updates, decoded):
+    """Whether the `updates` of a did, in chain order, are all sent by the same
+    account and the decoded ddos of all but the last one keep it as the owner."""
+    sender = (_event_sender(updates[-1]) or "").lower()
+    if not sender or any((_event_sender(u) or "").lower() != sender for u in updates):
+        return False
+
+    for update in updates[:-1]:
+        result = decoded.get((update.blockNumber, update.logIndex))
+        if result is None:
+            return False
+
+        record, error = result
+        if error:
+            # rejected in any order
+            continue
+
+        try:
+            owner = record["publicKey"][0]["owner"]
+        except (KeyError, IndexError, TypeError):
+            return False
+        if not owner or owner.lower() != sender:
+            return False
+
+    return True
+
 
 class EventsMonitor(BlockProcessingClass):
     """Detect on-chain published Metadata and cache it in the database for
@@ -49,6 +295,9 @@ class EventsMonitor(BlockProcessingClass):
     event log from the `Metadata` smartcontract. Metadata updates are also detected using
     the `MetadataUpdated` event.
 
+    Both events are read with a single `getLogs` request per block range and are
+    processed in chain order, i.e. by (blockNumber, logIndex).
+
     The Metadata json object is expected to be
     in an `lzma` compressed form. If desired the metadata can also be encrypted for specific
     use cases. When using encrypted Metadata, the EventsMonitor requires the private key of
@@ -57,6 +306,46 @@ class EventsMonitor(BlockProcessingClass):
 
     The events monitor pauses for 25 seconds between updates.
 
+    Block ranges are scanned in chunks, starting with `EVENTS_BLOCKS_CHUNK_SIZE` blocks.
+    The chunk size grows while the RPC answers quickly and halves when a request fails
+    or times out, never exceeding `EVENTS_MAX_BLOCKS_CHUNK_SIZE`. The last processed
+    block is stored after each chunk, together with its hash and the position of
+    the last processed event of each type.
+
+    Only the last `MetadataUpdated` event of each did in a chunk is applied, or the
+    latest earlier one if it is not valid, when the earlier updates do not change
+    the owner of the asset. The other updates are not kept in the asset's history,
+    their txids are only logged.
+
+    Set `EVENTS_DECODE_WORKERS` to decode and validate the ddos of each chunk in
+    that many worker processes, the results are still saved in chain order.
+
+    New and updated ddos of a chunk are saved with the Elasticsearch bulk API in
+    requests of at most `EVENTS_BULK_MAX_ACTIONS` documents and `EVENTS_BULK_MAX_BYTES`
+    bytes. The last processed block is only stored once the bulk writes succeeded.
+
+    The datatoken info of the assets is read through a `DatatokenInfoCache`, shared
+    with the MetadataUpdater, whose mutable fields are invalidated by the `Transfer`
+    events of each chunk.
+
+    The dids of the cached assets are kept in memory as packed datatoken addresses,
+    loaded at startup, so that checking if an asset exists does not read the database.
+
+    Block timestamps are kept in an LRU cache of `EVENTS_BLOCK_TIMESTAMP_CACHE_SIZE`
+    entries, all the block headers needed for a chunk are prefetched in one batch.
+
+    Events are only processed once their block has `EVENTS_CONFIRMATIONS` confirmations.
+    When a reorg is detected the blocks after the last canonical checkpointed block are
+    processed again, updates saved from the reorged blocks can then be overwritten.
+
+    When `EVENTS_JOURNAL_DIR` is set, the processed event logs are also appended to a
+    local compressed journal in that folder, see `reindex-main.py`.
+
+    When `EVENTS_SUBSCRIPTION_RPC` is set to a websocket url, new blocks are received
+    through a `newHeads` subscription and their events are processed right away.
+    The monitor falls back to polling while the subscription is down, including when
+    no block is received for `EVENTS_SUBSCRIPTION_TIMEOUT` seconds.
+
     The cached Metadata can be restricted to only those published by specific ethereum accounts.
     To do this set the `ALLOWED_PUBLISHERS` envvar to the list of ethereum addresses of known publishers.
 
@@ -71,8 +360,22 @@ class EventsMonitor(BlockProcessingClass):
 
         self._other_db_index = f"{self._oceandb.driver.db_index}_plus"
         self._oceandb.driver.es.indices.create(index=self._other_db_index, ignore=400)
+        self._bulk_writer = BulkWriter(
+            self._oceandb.driver.es,
+            self._oceandb.driver.db_index,
+            max_actions=get_int_env_value("EVENTS_BULK_MAX_ACTIONS", 500, min_value=1),
+            max_bytes=get_int_env_value(
+                "EVENTS_BULK_MAX_BYTES", 10 * 1024 * 1024, min_value=1
+            ),
+        )
+        self._did_index = self._load_did_index()
 
         self._web3 = web3
+        self._dt_info_cache = DatatokenInfoCache(
+            self._web3,
+            self._oceandb.driver.es,
+            f"{self._oceandb.driver.db_index}_datatokens",
+        )
         self._pool_monitor = None
         if get_bool_env_value("PROCESS_POOL_EVENTS", 1):
             self._pool_monitor = MetadataUpdater(
@@ -80,6 +383,7 @@ class EventsMonitor(BlockProcessingClass):
                 self._other_db_index,
                 self._web3,
                 ConfigProvider.get_config(),
+                dt_info_cache=self._dt_info_cache,
             )
 
         if not metadata_contract:
@@ -87,12 +391,24 @@ class EventsMonitor(BlockProcessingClass):
 
         self._contract = metadata_contract
         self._contract_address = self._contract.address
+        self._event_abis = dict()
+        for event_name in (EVENT_METADATA_CREATED, EVENT_METADATA_UPDATED):
+            abi = getattr(self._contract.events, event_name)().abi
+            self._event_abis[add_0x_prefix(event_abi_to_log_topic(abi).hex())] = abi
 
         self._ecies_private_key = os.getenv("EVENTS_ECIES_PRIVATE_KEY", "")
         self._ecies_account = None
         if self._ecies_private_key:
             self._ecies_account = Account.privateKeyToAccount(self._ecies_private_key)
+        self._ecies_key = get_ecies_key(self._ecies_private_key)
         self._only_encrypted_ddo = get_bool_env_value("ONLY_ENCRYPTED_DDO", 0)
+        self._max_ddo_size = get_int_env_value(
+            "MAX_DDO_SIZE", DEFAULT_MAX_DDO_SIZE, min_value=1
+        )
+        self._decode_workers = get_int_env_value(
+            "EVENTS_DECODE_WORKERS", 1, min_value=1
+        )
+        self._decode_pool = None
 
         self.get_or_set_last_block()
         allowed_publishers = set()
@@ -123,19 +439,74 @@ class EventsMonitor(BlockProcessingClass):
             self._monitor_sleep_time = default_sleep_time
 
         self._monitor_sleep_time = max(self._monitor_sleep_time, default_sleep_time)
+        self._subscription_url = os.getenv("EVENTS_SUBSCRIPTION_RPC", "")
+        self._subscription_timeout = get_int_env_value(
+            "EVENTS_SUBSCRIPTION_TIMEOUT", 120, min_value=1
+        )
+        self._subscription = None
+        self._reorg_range = None
+        journal_dir = os.getenv("EVENTS_JOURNAL_DIR")
+        self._journal = EventJournal(journal_dir) if journal_dir else None
+        self._periodic_update_time = 0
+        self._cursors = dict()
+        self._blocks_chunker = BlockRangeChunker(
+            get_int_env_value("EVENTS_BLOCKS_CHUNK_SIZE", 1000, min_value=1),
+            max_size=get_int_env_value(
+                "EVENTS_MAX_BLOCKS_CHUNK_SIZE", 100000, min_value=1
+            ),
+        )
         if not self._contract or not self._web3.isAddress(self._contract_address):
             logger.error(
                 f"Contract address {self._contract_address} is not a valid address. Events thread not starting"
             )
             self._contract = None
+        self._block_timestamps = lru.LRU(
+            get_int_env_value("EVENTS_BLOCK_TIMESTAMP_CACHE_SIZE", 10000, min_value=1)
+        )
         self._purgatory_enabled = get_bool_env_value("PROCESS_PURGATORY", 1)
-        self._purgatory_list = set()
+        # None until the first purgatory list is applied
+        self._purgatory_list = None
+        self._purgatory_dids = set()
+        self._purgatory = Purgatory(
+            self._oceandb.driver.es, self._oceandb.driver.db_index
+        )
+        self._purgatory_fetcher = PurgatoryListFetcher(
+            os.getenv("PURGATORY_LIST_URL", PURGATORY_LIST_URL),
+            os.getenv("PURGATORY_CACHE_FILE"),
+        )
         self._purgatory_update_time = None
 
     @property
     def block_envvar(self):
         return "METADATA_CONTRACT_BLOCK"
 
+    @property
+    def checkpoint_id(self):
+        return "events_last_block"
+
+    def _load_did_index(self):
+        try:
+            did_index = DidIndex.from_elasticsearch(
+                self._oceandb.driver.es, self._oceandb.driver.db_index
+            )
+            logger.info(f"EventsMonitor: loaded {len(did_index)} dids.")
+            return did_index
+        except Exception as e:
+            logger.error(
+                f"Loading the dids index failed, assets will be read from the db: {e}"
+            )
+            return None
+
+    def is_known_asset(self, did):
+        if self._did_index is not None:
+            return did in self._did_index
+
+        try:
+            self.read_asset(did)
+            return True
+        except Exception:
+            return False
+
     @property
     def is_monitor_running(self):
         return self._monitor_is_on
@@ -161,6 +532,11 @@ class EventsMonitor(BlockProcessingClass):
 
     def stop_monitor(self):
         self._monitor_is_on = False
+        if self._subscription:
+            self._subscription.stop()
+        if self._decode_pool:
+            self._decode_pool.shutdown(wait=False)
+            self._decode_pool = None
         if self._pool_monitor and self._pool_monitor.is_running():
             self._pool_monitor.stop()
 
@@ -177,18 +553,49 @@ class EventsMonitor(BlockProcessingClass):
                     return
 
                 self.process_current_blocks()
-                self._process_pool_events(first_update)
+                self._process_periodic_updates(first_update)
                 first_update = False
 
-                if self._purgatory_enabled:
-                    self._update_purgatory_list()
-
             except (KeyError, Exception) as e:
                 logger.error("Error processing event:")
                 logger.error(e)
 
+            if self._subscription_url and self._monitor_is_on:
+                self._subscription = NewBlocksSubscription(
+                    self._subscription_url,
+                    self._on_new_block,
+                    lambda: self._monitor_is_on,
+                    timeout=self._subscription_timeout,
+                )
+                try:
+                    self._subscription.run()
+                except Exception as e:
+                    logger.warning(
+                        f"new blocks subscription dropped: {e}, falling back to polling."
+                    )
+                finally:
+                    self._subscription = None
+
             time.sleep(self._monitor_sleep_time)
 
+    def _process_periodic_updates(self, first_update=False):
+        self._process_pool_events(first_update)
+
+        if self._purgatory_enabled:
+            self._update_purgatory_list()
+
+        self._periodic_update_time = time.time()
+
+    def _on_new_block(self, block):
+        debug_log(f"new block {block}")
+        try:
+            self.process_current_blocks()
+            if time.time() - self._periodic_update_time >= self._monitor_sleep_time:
+                self._process_periodic_updates()
+
+        except (KeyError, Exception) as e:
+            logger.error(f"Error processing events of new block {block}: {e}")
+
     def _process_pool_events(self, first_update=False):
         if not self._pool_monitor:
             return
@@ -199,32 +606,11 @@ class EventsMonitor(BlockProcessingClass):
         self._pool_monitor.process_pool_events()
 
     def _update_existing_assets_purgatory_data(self):
-        for asset in self._oceandb.list():
-            did = asset.get("id", None)
-            if not did or not did.startswith("did:op:"):
-                continue
-
-            purgatory = asset.get("isInPurgatory", "false")
-            if not isinstance(purgatory, str):
-                purgatory = "true" if purgatory is True else "false"
-
-            asset["isInPurgatory"] = purgatory
-            if "purgatoryData" in asset:
-                asset.pop("purgatoryData")
-            try:
-                self._oceandb.update(json.dumps(asset), did)
-            except Exception as e:
-                logger.warning(f"updating ddo {did} purgatory attribute failed: {e}")
-
-    @staticmethod
-    def _get_reference_purgatory_list():
-        response = requests.get(
-            "https://raw.githubusercontent.com/oceanprotocol/list-purgatory/main/list-assets.json"
-        )
-        if response.status_code != requests.codes.ok:
-            return set()
-
-        return {(a["did"], a["reason"]) for a in response.json() if a and "did" in a}
+        try:
+            updated = self._purgatory.normalize_assets()
+            logger.info(f"normalised the purgatory attribute of {updated} assets.")
+        except Exception as e:
+            logger.warning(f"updating the assets purgatory attribute failed: {e}")
 
     def _update_purgatory_list(self):
         now = int(datetime.now().timestamp())
@@ -232,35 +618,57 @@ class EventsMonitor(BlockProcessingClass):
             return
 
         self._purgatory_update_time = now
-        bad_list = self._get_reference_purgatory_list()
-        if not bad_list:
+        bad_list = self._purgatory_fetcher.fetch()
+        if bad_list is None:
+            # not modified since the last update
             return
 
         if self._purgatory_list == bad_list:
             return
 
-        new_ids = bad_list.difference(self._purgatory_list)
-        self._purgatory_list = bad_list
-        for _id, reason in new_ids:
-            try:
-                asset = self._oceandb.read(_id)
-                asset["isInPurgatory"] = "true"
-                if "purgatoryData" in asset:
-                    asset.pop("purgatoryData")
-
-                self._oceandb.update(json.dumps(asset), _id)
+        bad_dids = {did for did, _ in bad_list}
+        try:
+            if self._purgatory_list is None:
+                # first sync, reconcile with the flags saved in the database
+                added = self._purgatory.add(bad_dids)
+                removed = self._purgatory.remove_all_except(bad_dids)
+            else:
+                old_dids = {did for did, _ in self._purgatory_list}
+                added = self._purgatory.add(bad_dids - old_dids)
+                removed = self._purgatory.remove(old_dids - bad_dids)
+        except Exception as e:
+            logger.error(f"updating the assets in purgatory failed: {e}")
+            # apply the same list again on the next update
+            self._purgatory_fetcher.rearm()
+            self._purgatory_update_time = None
+            return
 
-            except Exception:
-                pass
+        self._purgatory_list = bad_list
+        self._purgatory_dids = bad_dids
+        logger.info(
+            f"purgatory updated: {added} assets added, {removed} assets released."
+        )
 
     def process_current_blocks(self):
         try:
-            last_block = self.get_last_processed_block()
+            checkpoint = self.get_checkpoint()
+            last_block = checkpoint["last_block"]
+            self._cursors = checkpoint.get("cursors") or dict()
         except Exception as e:
             debug_log(e)
             last_block = 0
-
-        current_block = self._web3.eth.blockNumber
+            self._cursors = dict()
+
+        resume_block = self.get_resume_block(last_block)
+        if resume_block < last_block:
+            self._rewind_cursors(resume_block)
+            self._rebuild_reorged_assets(resume_block, last_block)
+            if self._journal:
+                self._journal.truncate(resume_block)
+            self._reorg_range = (resume_block, last_block)
+            last_block = resume_block
+
+        current_block = self.get_confirmed_block()
         if (
             not current_block
             or not isinstance(current_block, int)
@@ -272,75 +680,348 @@ class EventsMonitor(BlockProcessingClass):
         debug_log(
             f"Metadata monitor >>>> from_block:{from_block}, current_block:{current_block} <<<<"
         )
-        for event in self.get_event_logs(
-            EVENT_METADATA_CREATED, from_block, current_block
-        ):
+        chunker = self._blocks_chunker
+        while from_block <= current_block:
+            start_block, end_block = chunker.next_range(from_block, current_block)
+            start_time = time.time()
             try:
-                self.processNewDDO(event)
-            except Exception as e:
+                events = self.get_event_logs(start_block, end_block)
+            except (ValueError, requests.exceptions.Timeout) as e:
+                if chunker.shrink():
+                    logger.warning(
+                        f"Reading events in blocks {start_block}-{end_block} failed: {e}. "
+                        f"Retrying with a chunk size of {chunker.size} blocks."
+                    )
+                    continue
+
                 logger.error(
-                    f"Error processing new metadata event: {e}\n" f"event={event}"
+                    f"Reading events in blocks {start_block}-{end_block} failed: {e}."
                 )
+                return
 
-        for event in self.get_event_logs(
-            EVENT_METADATA_UPDATED, from_block, current_block
-        ):
-            try:
-                self.processUpdateDDO(event)
-            except Exception as e:
+            chunker.adjust(time.time() - start_time, len(events))
+            self.prefetch_block_timestamps({event.blockNumber for event in events})
+            if not self.invalidate_datatokens_info(start_block, end_block):
+                # the transfers would be lost with the checkpoint of the range
                 logger.error(
-                    f"Error processing update metadata event: {e}\n" f"event={event}"
+                    f"Reading the datatoken transfers of blocks {start_block}-"
+                    f"{end_block} failed, the range will be processed again."
                 )
+                return
 
-        self.store_last_processed_block(current_block)
+            self.process_block_range_events(events, checkpoint_block=last_block)
+            if not self._bulk_writer.flush():
+                logger.error(
+                    f"Saving the ddos of blocks {start_block}-{end_block} failed, "
+                    f"the range will be processed again."
+                )
+                return
 
-    def get_last_processed_block(self):
-        last_block_record = self._oceandb.driver.es.get(
-            index=self._other_db_index, id="events_last_block", doc_type="_doc"
-        )["_source"]
-        return last_block_record["last_block"]
+            if self._journal:
+                self._append_to_journal(events, start_block)
 
-    def store_last_processed_block(self, block):
-        record = {"last_block": block}
+            self.store_last_processed_block(
+                end_block, self.get_block_hash(end_block), self._cursors
+            )
+            if self._reorg_range and end_block >= self._reorg_range[1]:
+                self._reorg_range = None
+            last_block = end_block
+            from_block = end_block + 1
+
+    def invalidate_datatokens_info(self, from_block, to_block):
+        """Invalidate the cached info of the datatokens transferred in the block
+        range, return False if the transfers could not be read."""
         try:
-            self._oceandb.driver.es.index(
-                index=self._other_db_index,
-                id="events_last_block",
-                body=record,
-                doc_type="_doc",
-                refresh="wait_for",
-            )["_id"]
-
-        except elasticsearch.exceptions.RequestError as e:
-            logger.error(
-                f"store_last_processed_block: block={block} type={type(block)}, error={e}"
+            invalidated = self._dt_info_cache.process_transfer_logs(
+                from_block, to_block
+            )
+            if invalidated:
+                debug_log(f"datatoken info invalidated for {invalidated}")
+        except (ValueError, requests.exceptions.RequestException) as e:
+            logger.warning(
+                f"reading the datatoken transfers of blocks {from_block}-{to_block} "
+                f"failed: {e}"
             )
+            return False
 
-    def get_event_logs(self, event_name, from_block, to_block):
-        def _get_logs(event, _from_block, _to_block):
-            debug_log(f"get_event_logs ({event_name}, {from_block}, {to_block})..")
-            _filter = event().createFilter(fromBlock=_from_block, toBlock=_to_block)
-            return _filter.get_all_entries()
+        return True
 
+    def _append_to_journal(self, events, from_block):
         try:
-            logs = _get_logs(
-                getattr(self._contract.events, event_name), from_block, to_block
+            self._journal.append(
+                events,
+                {
+                    e.blockNumber: self._block_timestamps.get(e.blockNumber)
+                    for e in events
+                },
+                from_block,
             )
-            return logs
-        except ValueError as e:
-            logger.error(
-                f"get_event_logs ({event_name}, {from_block}, {to_block}) failed: {e}.\n Retrying once more."
+        except (OSError, ValueError) as e:
+            logger.error(f"appending {len(events)} events to the journal failed: {e}")
+
+    def _rewind_cursors(self, block):
+        """Mark the events after `block` as not processed."""
+        for event_name, cursor in self._cursors.items():
+            if cursor[0] > block:
+                self._cursors[event_name] = [block, 2**31]
+
+    def _rebuild_reorged_assets(self, resume_block, last_block):
+        """Delete the assets whose last event is in the reorged blocks after
+        `resume_block`. Those with events up to `resume_block` are rebuilt from
+        them, the events of the new chain are applied when the range is processed
+        again."""
+        try:
+            dids = [
+                hit["_id"]
+                for hit in scan(
+                    self._oceandb.driver.es,
+                    index=self._oceandb.driver.db_index,
+                    query={
+                        "query": {
+                            "range": {
+                                "event.blockNo": {"gt": resume_block, "lte": last_block}
+                            }
+                        }
+                    },
+                    _source=False,
+                )
+            ]
+        except Exception as e:
+            logger.error(f"reading the assets of the reorged blocks failed: {e}")
+            return
+
+        for did in dids:
+            self.delete_asset(did)
+
+        for i in range(0, len(dids), 100):
+            data_tokens = [
+                add_0x_prefix(did[len("did:op:") :]) for did in dids[i : i + 100]
+            ]
+            for event in self._get_data_tokens_event_logs(data_tokens, resume_block):
+                if event.event == EVENT_METADATA_CREATED:
+                    self.processNewDDO(event)
+                else:
+                    self.processUpdateDDO(event)
+
+        self._bulk_writer.flush()
+        if dids:
+            logger.warning(
+                f"deleted {len(dids)} assets saved from the reorged blocks "
+                f"{resume_block + 1}-{last_block}, rebuilt "
+                f"{sum(1 for did in dids if self.is_known_asset(did))} of them from "
+                f"the earlier blocks."
             )
 
-        try:
-            logs = _get_logs(
-                getattr(self._contract.events, event_name), from_block, to_block
+    def _get_data_tokens_event_logs(self, data_tokens, to_block):
+        """Return the metadata events of `data_tokens` up to `to_block`."""
+        chunker = BlockRangeChunker(
+            self._blocks_chunker.max_size, max_size=self._blocks_chunker.max_size
+        )
+        events = []
+        from_block = int(os.getenv(self.block_envvar, 0))
+        while from_block <= to_block:
+            start_block, end_block = chunker.next_range(from_block, to_block)
+            try:
+                events.extend(
+                    get_metadata_event_logs(
+                        self._web3,
+                        self._contract_address,
+                        self._event_abis,
+                        start_block,
+                        end_block,
+                        data_tokens,
+                    )
+                )
+            except (ValueError, requests.exceptions.Timeout):
+                if chunker.shrink():
+                    continue
+                raise
+
+            from_block = end_block + 1
+
+        return events
+
+    def _is_reorged_block(self, block):
+        return bool(
+            self._reorg_range
+            and self._reorg_range[0] < int(block) <= self._reorg_range[1]
+        )
+
+    def process_block_range_events(self, events, decoded=None, checkpoint_block=None):
+        """Apply `events` in order, `decoded` is the optional dict of already
+        decoded ddos, see `decode_events`.
+
+        When `checkpoint_block` is set, the ddos are saved as soon as they fill a
+        bulk request and the checkpoint is stored at `checkpoint_block` with the
+        cursors of the events applied so far, so the range is resumed after them.
+        """
+        # skip the events applied before the last checkpoint
+        events = [
+            e
+            for e in events
+            if (e.blockNumber, e.logIndex) > tuple(self._cursors.get(e.event, (-1, -1)))
+        ]
+        if decoded is None:
+            # the skipped updates too, see `apply_latest_update`
+            decoded = self.decode_events(events)
+        events, earlier_updates = self.coalesce_updates(events)
+        self.prefetch_datatokens_info(
+            {
+                e.args.dataToken
+                for e in events
+                if self.is_publisher_allowed(_event_sender(e))
+            }
+        )
+        for event in events:
+            self._cursors[event.event] = [event.blockNumber, event.logIndex]
+            try:
+                if event.event == EVENT_METADATA_CREATED:
+                    self.processNewDDO(
+                        event, decoded.get((event.blockNumber, event.logIndex))
+                    )
+                else:
+                    self.apply_latest_update(
+                        event, decoded, earlier_updates.get(event.args.dataToken, [])
+                    )
+            except Exception as e:
+                event_type = (
+                    "new" if event.event == EVENT_METADATA_CREATED else "update"
+                )
+                logger.error(
+                    f"Error processing {event_type} metadata event: {e}\n"
+                    f"event={event}"
+                )
+
+            if (
+                checkpoint_block is not None
+                and len(self._bulk_writer) >= self._bulk_writer._max_actions
+                and self._bulk_writer.flush()
+            ):
+                self.store_last_processed_block(
+                    checkpoint_block,
+                    self.get_block_hash(checkpoint_block),
+                    self._cursors,
+                )
+
+    @staticmethod
+    def coalesce_updates(events):
+        """Keep only the last `MetadataUpdated` event of each did.
+
+        :return: tuple (events, earlier_updates), `earlier_updates` is the dict of
+            datatoken address -> the updates left out, latest first.
+        """
+        last_updates = dict()
+        for event in events:
+            if event.event == EVENT_METADATA_UPDATED:
+                last_updates[event.args.dataToken] = event
+
+        kept = []
+        earlier_updates = dict()
+        for event in events:
+            if event.event != EVENT_METADATA_UPDATED:
+                kept.append(event)
+                continue
+
+            dt_address = event.args.dataToken
+            if last_updates[dt_address] is event:
+                kept.append(event)
+            else:
+                earlier_updates.setdefault(dt_address, []).insert(0, event)
+
+        return kept, earlier_updates
+
+    def apply_latest_update(self, event, decoded, earlier_updates):
+        """Apply `event`, falling back to the earlier updates of the same did (latest
+        first) until one is valid.
+
+        This is only the same as applying the updates in order if the earlier ones
+        do not change the owner the later ones are checked against, otherwise, or if
+        their ddos are not decoded yet, all the updates are applied in order.
+        """
+        if earlier_updates and not _keeps_owner(
+            list(reversed(earlier_updates)) + [event], decoded
+        ):
+            for update in reversed(earlier_updates):
+                self.processUpdateDDO(
+                    update, decoded.get((update.blockNumber, update.logIndex))
+                )
+            self.processUpdateDDO(
+                event, decoded.get((event.blockNumber, event.logIndex))
             )
-            return logs
-        except ValueError as e:
-            logger.error(
-                f"get_event_logs ({event_name}, {from_block}, {to_block}) failed: {e}."
+            return
+
+        applied = None
+        skipped = []
+        for update in [event] + earlier_updates:
+            if applied:
+                skipped.append(update.transactionHash.hex())
+                continue
+
+            result = self.processUpdateDDO(
+                update, decoded.get((update.blockNumber, update.logIndex))
             )
+            if result:
+                applied = update
+            else:
+                skipped.append(update.transactionHash.hex())
+
+        if earlier_updates:
+            logger.info(
+                f"coalesced {len(earlier_updates) + 1} updates of "
+                f"did:op:{remove_0x_prefix(event.args.dataToken)}, "
+                f"applied txid="
+                f"{applied.transactionHash.hex() if applied else None}, "
+                f"skipped txids={skipped}"
+            )
+
+    def decode_events(self, events):
+        """Decode and validate the ddos of `events` in the worker processes.
+
+        :return: dict of (blockNumber, logIndex) -> (record, error), empty if the
+            ddos are to be decoded one by one while processing the events.
+        """
+        events = [e for e in events if self.is_publisher_allowed(_event_sender(e))]
+        if self._decode_workers < 2 or len(events) < 2:
+            return dict()
+
+        if self._decode_pool is None:
+            self._decode_pool = ProcessPoolExecutor(
+                max_workers=self._decode_workers,
+                initializer=init_decode_worker,
+                initargs=(self._ecies_private_key,),
+            )
+
+        args = [
+            (
+                event.args.get("data", None),
+                event.args.get("flags", None),
+                self.get_block_timestamp(event.blockNumber),
+                f"event {event.event}",
+                self._only_encrypted_ddo,
+                self._max_ddo_size,
+            )
+            for event in events
+        ]
+        try:
+            results = self._decode_pool.map(
+                decode_and_validate_ddo_in_worker, *zip(*args)
+            )
+            return {
+                (event.blockNumber, event.logIndex): result
+                for event, result in zip(events, results)
+            }
+        except Exception as e:
+            logger.error(f"decoding {len(events)} ddos in worker processes failed: {e}")
+            self._decode_pool.shutdown(wait=False)
+            self._decode_pool = None
+            return dict()
+
+    def get_event_logs(self, from_block, to_block):
+        """Return the `MetadataCreated` and `MetadataUpdated` events in the block
+        range, decoded and sorted in chain order."""
+        return get_metadata_event_logs(
+            self._web3, self._contract_address, self._event_abis, from_block, to_block
+        )
 
     def is_publisher_allowed(self, publisher_address):
         logger.debug(f"checking allowed publishers: {publisher_address}")
@@ -350,7 +1031,12 @@ class EventsMonitor(BlockProcessingClass):
         publisher_address = self._web3.toChecksumAddress(publisher_address)
         return publisher_address in self._allowed_publishers
 
-    def processNewDDO(self, event):
+    def processNewDDO(self, event, decoded=None):
+        """Save the ddo of a `MetadataCreated` event.
+
+        :return: True if the asset is saved or already registered, False if the
+            event is rejected or saving it failed.
+        """
         (
             did,
             block,
@@ -366,14 +1052,11 @@ class EventsMonitor(BlockProcessingClass):
         )
         if not self.is_publisher_allowed(sender_address):
             logger.warning(f"Sender {sender_address} is not in ALLOWED_PUBLISHERS.")
-            return
+            return False
 
-        try:
-            self._oceandb.read(did)
+        if self.is_known_asset(did):
             logger.warning(f"{did} is already registered")
-            return
-        except Exception:
-            pass
+            return True
 
         logger.info(f"Start processing {EVENT_METADATA_CREATED} event: did={did}")
         debug_log(
@@ -381,17 +1064,21 @@ class EventsMonitor(BlockProcessingClass):
         )
 
         logger.debug(f"decoding with did {did} and flags {flags}")
-        data = self.decode_ddo(rawddo, flags)
-        if data is None:
-            logger.warning(f"Could not decode ddo using flags {flags}")
-            return
-
-        msg, _ = validate_data(data, f"event {EVENT_METADATA_CREATED}")
-        if msg:
-            logger.warning(msg)
-            return
+        if decoded is None:
+            decoded = decode_and_validate_ddo(
+                rawddo,
+                flags,
+                timestamp,
+                f"event {EVENT_METADATA_CREATED}",
+                self._ecies_key,
+                self._only_encrypted_ddo,
+                self._max_ddo_size,
+            )
+        _record, error = decoded
+        if error:
+            logger.warning(error)
+            return False
 
-        _record = init_new_ddo(data, timestamp)
         # this will be used when updating the doo
         _record["event"] = dict()
         _record["event"]["txid"] = txid
@@ -411,25 +1098,20 @@ class EventsMonitor(BlockProcessingClass):
         dt_address = _record.get("dataToken")
         assert dt_address == add_0x_prefix(did[len("did:op:") :])
         if dt_address:
-            _record["dataTokenInfo"] = get_datatoken_info(dt_address)
+            _record["dataTokenInfo"] = self._get_datatoken_info(dt_address)
 
-        if not is_valid_dict_remote(get_metadata_from_services(_record["service"])):
-            errors = list_errors(
-                list_errors_dict_remote, get_metadata_from_services(_record["service"])
-            )
-            logger.error(f"New ddo has validation errors: {errors}")
-            return False
-
-        _record["isInPurgatory"] = "false"
+        _record["isInPurgatory"] = "true" if did in self._purgatory_dids else "false"
 
         try:
             record_str = json.dumps(_record)
-            self._oceandb.write(record_str, did)
             _record = json.loads(record_str)
+            self._bulk_writer.index(did, _record)
+            if self._did_index is not None:
+                self._did_index.add(did)
             name = _record["service"][0]["attributes"]["main"]["name"]
             debug_log(f"DDO saved: did={did}, name={name}, publisher={sender_address}")
             logger.info(
-                f"Done processing {EVENT_METADATA_CREATED} event: did={did}. DDO SAVED TO DB"
+                f"Done processing {EVENT_METADATA_CREATED} event: did={did}. DDO QUEUED FOR SAVING TO DB"
             )
             return True
         except (KeyError, Exception) as err:
@@ -438,7 +1120,13 @@ class EventsMonitor(BlockProcessingClass):
             )
             return False
 
-    def processUpdateDDO(self, event):
+    def processUpdateDDO(self, event, decoded=None):
+        """Save the ddo of a `MetadataUpdated` event, as a new asset if the did is
+        not registered.
+
+        :return: True if the asset is saved or already up to date with the event,
+            False if the event is rejected or saving it failed.
+        """
         (
             did,
             block,
@@ -450,14 +1138,20 @@ class EventsMonitor(BlockProcessingClass):
             timestamp,
         ) = self.get_event_data(event)
         debug_log(f"Process update DDO, did from event log:{did}")
-        try:
-            asset = self._oceandb.read(did)
-        except Exception:
+        asset = None
+        if self._did_index is None or did in self._did_index:
+            try:
+                asset = self.read_asset(did)
+            except Exception:
+                # deleted from the database since the index was loaded
+                if self._did_index is not None:
+                    self._did_index.remove(did)
+
+        if asset is None:
             # TODO: check if this asset was deleted/hidden due to some violation issues
             # if so, don't add it again
             logger.warning(f"{did} is not registered, will add it as a new DDO.")
-            self.processNewDDO(event)
-            return
+            return self.processNewDDO(event, decoded)
 
         debug_log(
             f"block {block}, contract: {contract_address}, Sender: {sender_address} , txid: {txid}"
@@ -469,35 +1163,40 @@ class EventsMonitor(BlockProcessingClass):
             logger.warning(
                 f'asset has the same txid, no need to update: event-txid={txid} <> asset-event-txid={asset["event"]["txid"]}'
             )
-            return
+            return True
 
         # check block
         ddo_block = asset["event"]["blockNo"]
-        if int(block) <= int(ddo_block):
+        # an asset updated in a block that was reorged away can be overwritten
+        if int(block) <= int(ddo_block) and not self._is_reorged_block(ddo_block):
             logger.warning(
                 f"asset was updated later (block: {ddo_block}) vs transaction block: {block}"
             )
-            return
+            return True
 
         # check owner
         if not compare_eth_addresses(
             asset["publicKey"][0]["owner"], sender_address, logger
         ):
             logger.warning("Transaction sender must mach ddo owner")
-            return
+            return False
 
         debug_log(f"decoding with did {did} and flags {flags}")
-        data = self.decode_ddo(rawddo, flags)
-        if data is None:
-            logger.warning("Cound not decode ddo")
-            return
-
-        msg, _ = validate_data(data, "event update")
-        if msg:
-            logger.error(msg)
-            return
+        if decoded is None:
+            decoded = decode_and_validate_ddo(
+                rawddo,
+                flags,
+                timestamp,
+                "event update",
+                self._ecies_key,
+                self._only_encrypted_ddo,
+                self._max_ddo_size,
+            )
+        _record, error = decoded
+        if error:
+            logger.error(error)
+            return False
 
-        _record = init_new_ddo(data, timestamp)
         # make sure that we do not alter created flag
         _record["created"] = asset["created"]
         # but we update 'updated'
@@ -510,36 +1209,90 @@ class EventsMonitor(BlockProcessingClass):
         _record["event"]["from"] = sender_address
         _record["event"]["contract"] = contract_address
 
-        if not is_valid_dict_remote(get_metadata_from_services(_record["service"])):
-            errors = list_errors(
-                list_errors_dict_remote, get_metadata_from_services(_record["service"])
-            )
-            logger.error(f"ddo update has validation errors: {errors}")
-            return
-
         _record["price"] = asset.get("price", {})
         dt_address = _record.get("dataToken")
         assert dt_address == add_0x_prefix(did[len("did:op:") :])
         if dt_address:
-            _record["dataTokenInfo"] = get_datatoken_info(dt_address)
+            _record["dataTokenInfo"] = self._get_datatoken_info(dt_address)
 
         _record["isInPurgatory"] = asset.get("isInPurgatory", "false")
 
         try:
-            self._oceandb.update(json.dumps(_record), did)
-            logger.info(f"updated DDO saved to db successfully (did={did}).")
+            self._bulk_writer.index(did, json.loads(json.dumps(_record)))
+            logger.info(f"updated DDO queued for saving to db (did={did}).")
             return True
         except (KeyError, Exception) as err:
             logger.error(
                 f"encountered an error while updating the asset data to OceanDB: {str(err)}"
             )
+            return False
+
+    def prefetch_datatokens_info(self, dt_addresses):
+        """Read the missing info of the datatokens in one batch, before their ddos
+        are processed."""
+        if not dt_addresses:
+            return
+
+        try:
+            self._dt_info_cache.get_many(list(dt_addresses))
+        except Exception as e:
+            logger.warning(
+                f"prefetching the info of {len(dt_addresses)} datatokens failed: {e}"
+            )
+
+    def _get_datatoken_info(self, dt_address):
+        """Return the cached info of a datatoken, see `prefetch_datatokens_info`,
+        it is only read if the datatoken is not cached."""
+        info = self._dt_info_cache.get(dt_address, read=False)
+        return info if info is not None else self._dt_info_cache.get(dt_address)
+
+    def prefetch_block_timestamps(self, block_numbers):
+        missing = [b for b in block_numbers if b not in self._block_timestamps]
+        if not missing:
+            return
+
+        try:
+            timestamps = get_blocks_timestamps(self._web3, sorted(missing))
+        except Exception as e:
+            logger.warning(
+                f"prefetching timestamps of {len(missing)} blocks failed: {e}"
+            )
             return
 
+        for block, timestamp in timestamps.items():
+            self._block_timestamps[block] = timestamp
+
+    def get_block_timestamp(self, block_number):
+        if block_number not in self._block_timestamps:
+            self._block_timestamps[block_number] = self._web3.eth.getBlock(
+                block_number
+            )["timestamp"]
+
+        return self._block_timestamps[block_number]
+
+    def read_asset(self, did):
+        """Read an asset, including one that is waiting in the bulk writer."""
+        asset = self._bulk_writer.get(did)
+        if asset is not None:
+            return asset
+
+        return self._oceandb.read(did)
+
+    def delete_asset(self, did):
+        """Delete an asset, including one that is waiting in the bulk writer."""
+        self._bulk_writer.discard(did)
+        if self._did_index is not None:
+            self._did_index.remove(did)
+
+        try:
+            self._oceandb.delete(did)
+        except Exception as e:
+            debug_log(f"deleting {did} failed: {e}")
+
     def get_event_data(self, event):
         tx_id = event.transactionHash.hex()
-        sender = event.args.get("createdBy", event.args.get("updatedBy"))
-        blockInfo = self._web3.eth.getBlock(event.blockNumber)
-        timestamp = blockInfo["timestamp"]
+        sender = _event_sender(event)
+        timestamp = self.get_block_timestamp(event.blockNumber)
         return (
             f"did:op:{remove_0x_prefix(event.args.dataToken)}",
             event.blockNumber,
@@ -552,44 +1305,13 @@ class EventsMonitor(BlockProcessingClass):
         )
 
     def decode_ddo(self, rawddo, flags):
-        debug_log(f"flags: {flags}")
-        # debug_log(f'Before unpack rawddo:{rawddo}')
-        if len(flags) < 1:
-            debug_log("Set check_flags to 0!")
-            check_flags = 0
-        else:
-            check_flags = flags[0]
-        if self._only_encrypted_ddo and (not check_flags & 2):
-            logger.error("This aquarius can cache only encrypted ddos")
-            return None
-        # always start with MSB -> LSB
-        debug_log(f"checkflags: {check_flags}")
-        # bit 2:  check if ddo is ecies encrypted
-        if check_flags & 2:
-            try:
-                rawddo = self.ecies_decrypt(rawddo)
-                logger.debug(f"Decrypted to {rawddo}")
-            except (KeyError, Exception) as err:
-                logger.error(f"Failed to decrypt: {str(err)}")
-
-        # bit 1:  check if ddo is lzma compressed
-        if check_flags & 1:
-            try:
-                rawddo = Lzma.decompress(rawddo)
-                logger.debug(f"Decompressed to {rawddo}")
-            except (KeyError, Exception) as err:
-                logger.error(f"Failed to decompress: {str(err)}")
-
-        logger.debug(f"After unpack rawddo:{rawddo}")
-        try:
-            ddo = json.loads(rawddo)
-            return ddo
-        except (KeyError, Exception) as err:
-            logger.error(f"encountered an error while decoding the ddo: {str(err)}")
-            return None
+        return decode_ddo(
+            rawddo,
+            flags,
+            self._ecies_key,
+            self._only_encrypted_ddo,
+            self._max_ddo_size,
+        )
 
     def ecies_decrypt(self, rawddo):
-        if self._ecies_account is not None:
-            key = eth_keys.KeyAPI.PrivateKey(self._ecies_account.privateKey)
-            rawddo = ecies.decrypt(key.to_hex(), rawddo)
-        return rawddo
+        return ecies_decrypt(rawddo, self._ecies_key)
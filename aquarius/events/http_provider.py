@@ -2,16 +2,29 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+from eth_utils import to_bytes
 from web3 import HTTPProvider
+from web3.utils.encoding import FriendlyJsonSerde
 
+from aquarius.app.util import get_int_env_value
 from aquarius.events.request import make_post_request
 
 
 class CustomHTTPProvider(HTTPProvider):
     """
     Override requests to control the connection pool to make it blocking.
+
+    Also supports sending many calls as JSON-RPC batch requests, see
+    `make_batch_request`. The number of calls per batch is `batch_size` or
+    the `EVENTS_RPC_BATCH_SIZE` envvar.
     """
 
+    def __init__(self, endpoint_uri=None, request_kwargs=None, batch_size=None):
+        super().__init__(endpoint_uri, request_kwargs)
+        self.batch_size = batch_size or get_int_env_value(
+            "EVENTS_RPC_BATCH_SIZE", 100, min_value=1
+        )
+
     def make_request(self, method, params):
         self.logger.debug(
             "Making request HTTP. URI: %s, Method: %s", self.endpoint_uri, method
@@ -28,3 +41,66 @@ class CustomHTTPProvider(HTTPProvider):
             response,
         )
         return response
+
+    def make_batch_request(self, calls):
+        """Send a list of `(method, params)` calls in JSON-RPC batches.
+
+        :return: list of JSON-RPC responses in the same order as `calls`. A batch
+            that fails as a whole is sent again one call at a time.
+        """
+        responses = []
+        for i in range(0, len(calls), self.batch_size):
+            batch = calls[i : i + self.batch_size]
+            try:
+                responses.extend(self._make_batch_request(batch))
+            except Exception as e:
+                self.logger.warning(
+                    "Batch request of %d calls failed, falling back to single "
+                    "requests. URI: %s, Error: %s",
+                    len(batch),
+                    self.endpoint_uri,
+                    e,
+                )
+                responses.extend(self._make_single_requests(batch))
+
+        return responses
+
+    def _make_batch_request(self, calls):
+        rpc_calls = [
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params or [],
+                "id": next(self.request_counter),
+            }
+            for method, params in calls
+        ]
+        self.logger.debug(
+            "Making batch request HTTP. URI: %s, Calls: %d",
+            self.endpoint_uri,
+            len(rpc_calls),
+        )
+        request_data = to_bytes(text=FriendlyJsonSerde().json_encode(rpc_calls))
+        raw_response = make_post_request(
+            self.endpoint_uri, request_data, **self.get_request_kwargs()
+        )
+        response = self.decode_rpc_response(raw_response)
+        if not isinstance(response, list):
+            raise ValueError(f"unexpected batch response: {response}")
+
+        id_to_response = {r.get("id"): r for r in response}
+        missing = [c["id"] for c in rpc_calls if c["id"] not in id_to_response]
+        if missing:
+            raise ValueError(f"batch response is missing ids {missing}")
+
+        return [id_to_response[c["id"]] for c in rpc_calls]
+
+    def _make_single_requests(self, calls):
+        responses = []
+        for method, params in calls:
+            try:
+                responses.append(self.make_request(method, params))
+            except Exception as e:
+                responses.append({"jsonrpc": "2.0", "error": {"message": str(e)}})
+
+        return responses
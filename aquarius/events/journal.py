@@ -0,0 +1,302 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import gzip
+import json
+import logging
+import os
+
+from hexbytes import HexBytes
+from oceandb_elasticsearch_driver.mapping import mapping
+from web3.datastructures import AttributeDict
+
+from aquarius.events.did_index import DidIndex
+
+logger = logging.getLogger(__name__)
+
+BINARY_ARGS = ("flags", "data")
+
+
+def event_to_record(event, timestamp):
+    """Return the json serialisable journal record of a decoded metadata event."""
+    return {
+        "event": event.event,
+        "blockNumber": event.blockNumber,
+        "blockHash": event.blockHash.hex(),
+        "logIndex": event.logIndex,
+        "transactionHash": event.transactionHash.hex(),
+        "address": event.address,
+        "timestamp": timestamp,
+        "args": {
+            name: value.hex() if name in BINARY_ARGS else value
+            for name, value in event.args.items()
+        },
+    }
+
+
+def record_to_event(record):
+    """Return the event of a journal record, as returned by `get_event_data`."""
+    args = {
+        name: (
+            bytes.fromhex(value[2:] if value.startswith("0x") else value)
+            if name in BINARY_ARGS
+            else value
+        )
+        for name, value in record["args"].items()
+    }
+    return AttributeDict(
+        {
+            "event": record["event"],
+            "blockNumber": record["blockNumber"],
+            "blockHash": HexBytes(record["blockHash"]),
+            "logIndex": record["logIndex"],
+            "transactionHash": HexBytes(record["transactionHash"]),
+            "address": record["address"],
+            "args": AttributeDict(args),
+        }
+    )
+
+
+class EventJournal:
+    """Append-only local journal of the metadata event logs.
+
+    Records are appended as gzip compressed json lines to segment files of at most
+    `max_segment_size` bytes. `index.json` lists the segments with their first and
+    last block, so a replay from a given block only opens the segments it needs,
+    and the block from which the journal holds all the events, see `start_block`.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory, max_segment_size=64 * 1024 * 1024):
+        self._directory = directory
+        self._max_segment_size = max_segment_size
+        os.makedirs(directory, exist_ok=True)
+        self._segments, self._start_block = self._load_index()
+
+    @property
+    def last_position(self):
+        """(blockNumber, logIndex) of the last journaled event."""
+        if not self._segments:
+            return -1, -1
+
+        segment = self._segments[-1]
+        return segment["last_block"], segment["last_log_index"]
+
+    @property
+    def last_block(self):
+        return self.last_position[0]
+
+    @property
+    def start_block(self):
+        """First block of the range of the first append, the journal holds all the
+        events from there. For a journal written before it was recorded, this is
+        the block of its first event, which is only a lower bound."""
+        if self._start_block is not None:
+            return self._start_block
+
+        return self._segments[0]["first_block"] if self._segments else None
+
+    def last_block_hash(self):
+        return self._segments[-1].get("last_block_hash") if self._segments else None
+
+    def append(self, events, timestamps, from_block=None):
+        """Append the events (in chain order) that are after the last journaled one.
+
+        :param from_block: first block of the range of `events`, recorded as the
+            `start_block` of an empty journal.
+        """
+        if not self._segments and self._start_block is None and from_block is not None:
+            self._start_block = from_block
+            self._save_index()
+
+        last_position = self.last_position
+        records = [
+            event_to_record(event, timestamps.get(event.blockNumber))
+            for event in events
+            if (event.blockNumber, event.logIndex) > last_position
+        ]
+        if not records:
+            return 0
+
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or self._segment_size(segment) >= self._max_segment_size:
+            segment = {
+                "file": f"segment-{len(self._segments):06d}.jsonl.gz",
+                "first_block": records[0]["blockNumber"],
+            }
+            self._segments.append(segment)
+
+        # each append adds a gzip member, a segment is a valid multi-member gzip file
+        with gzip.open(self._segment_path(segment), "at") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+        segment["last_block"] = records[-1]["blockNumber"]
+        segment["last_log_index"] = records[-1]["logIndex"]
+        segment["last_block_hash"] = records[-1]["blockHash"]
+        self._save_index()
+        return len(records)
+
+    def read(self, from_block=0):
+        """Yield the journaled records of the blocks from `from_block`, in order."""
+        for segment in self._segments:
+            if segment["last_block"] < from_block:
+                continue
+
+            with gzip.open(self._segment_path(segment), "rt") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["blockNumber"] >= from_block:
+                        yield record
+
+    def truncate(self, block):
+        """Drop the records of the blocks after `block`, e.g. after a chain reorg."""
+        kept = []
+        for segment in self._segments:
+            if segment["first_block"] > block:
+                os.remove(self._segment_path(segment))
+                continue
+
+            if segment["last_block"] > block:
+                records = [
+                    r for r in self._read_segment(segment) if r["blockNumber"] <= block
+                ]
+                tmp_path = f"{self._segment_path(segment)}.tmp"
+                with gzip.open(tmp_path, "wt") as f:
+                    for record in records:
+                        f.write(json.dumps(record) + "\n")
+                os.replace(tmp_path, self._segment_path(segment))
+                if not records:
+                    os.remove(self._segment_path(segment))
+                    continue
+
+                segment["last_block"] = records[-1]["blockNumber"]
+                segment["last_log_index"] = records[-1]["logIndex"]
+                segment["last_block_hash"] = records[-1]["blockHash"]
+
+            kept.append(segment)
+
+        self._segments = kept
+        self._save_index()
+
+    def _read_segment(self, segment):
+        with gzip.open(self._segment_path(segment), "rt") as f:
+            return [json.loads(line) for line in f]
+
+    def _segment_path(self, segment):
+        return os.path.join(self._directory, segment["file"])
+
+    def _segment_size(self, segment):
+        try:
+            return os.path.getsize(self._segment_path(segment))
+        except OSError:
+            return 0
+
+    def _load_index(self):
+        index_file = os.path.join(self._directory, self.INDEX_FILE)
+        if not os.path.exists(index_file):
+            return [], None
+
+        with open(index_file) as f:
+            index = json.load(f)
+        return index["segments"], index.get("start_block")
+
+    def _save_index(self):
+        index_file = os.path.join(self._directory, self.INDEX_FILE)
+        tmp_file = f"{index_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"segments": self._segments, "start_block": self._start_block}, f)
+        os.replace(tmp_file, index_file)
+
+
+def replay_journal(
+    monitor, journal, from_block=0, batch_size=1000, recreate_index=False
+):
+    """Rebuild the catalog of `monitor` from the events in `journal`, without
+    reading any log from the RPC node.
+
+    With `recreate_index`, the assets index is dropped and created again (e.g.
+    after a mapping change) before the replay, otherwise the events are applied on
+    top of the existing assets. The checkpoint is only moved forward.
+
+    :return: the last replayed block
+    :raise AssertionError: with `recreate_index`, if the journal does not start at
+        the metadata contract block, the older assets would be lost.
+    """
+    if recreate_index:
+        contract_block = int(os.getenv(monitor.block_envvar, 0))
+        start_block = journal.start_block
+        if start_block is None or start_block > contract_block:
+            raise AssertionError(
+                f"the journal starts at block {start_block}, after the metadata "
+                f"contract block {contract_block}: recreating the index would drop "
+                f"the assets of the blocks in between, set REINDEX_FROM_BLOCK to "
+                f"replay the journal on top of the existing index."
+            )
+
+        _recreate_index(monitor)
+
+    monitor._cursors = dict()
+    batch = []
+    last_block = None
+    for record in journal.read(from_block):
+        # only end a batch at a block boundary
+        if len(batch) >= batch_size and record["blockNumber"] != last_block:
+            _apply_records(monitor, batch)
+            batch = []
+
+        batch.append(record)
+        last_block = record["blockNumber"]
+
+    if batch:
+        _apply_records(monitor, batch)
+
+    try:
+        checkpoint_block = monitor.get_last_processed_block()
+    except Exception:
+        checkpoint_block = None
+
+    if last_block is not None and (
+        checkpoint_block is None or last_block > checkpoint_block
+    ):
+        monitor.store_last_processed_block(
+            last_block, journal.last_block_hash(), monitor._cursors
+        )
+    elif recreate_index and checkpoint_block is not None:
+        if last_block is None or last_block < checkpoint_block:
+            logger.warning(
+                f"the journal ends at block {last_block}, before the checkpoint "
+                f"{checkpoint_block}: the assets of the blocks in between are missing."
+            )
+
+    return last_block
+
+
+def _recreate_index(monitor):
+    es = monitor._oceandb.driver.es
+    index = monitor._oceandb.driver.db_index
+    es.indices.delete(index=index, ignore=404)
+    es.indices.create(index=index, body=mapping)
+    if monitor._did_index is not None:
+        monitor._did_index = DidIndex()
+    logger.info(f"recreated the index {index}.")
+
+
+def _apply_records(monitor, records):
+    for record in records:
+        if record["timestamp"] is not None:
+            monitor._block_timestamps[record["blockNumber"]] = record["timestamp"]
+
+    monitor.process_block_range_events([record_to_event(r) for r in records])
+    if not monitor._bulk_writer.flush():
+        raise AssertionError(
+            f"saving the ddos of blocks {records[0]['blockNumber']}-"
+            f"{records[-1]['blockNumber']} failed."
+        )
+
+    logger.info(
+        f"replayed {len(records)} events of blocks {records[0]['blockNumber']}-"
+        f"{records[-1]['blockNumber']}."
+    )
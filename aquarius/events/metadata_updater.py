@@ -5,23 +5,29 @@
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from threading import Thread
 
-import elasticsearch
+import requests
 from eth_utils import add_0x_prefix, remove_0x_prefix
 from ocean_lib.models.bfactory import BFactory
 from ocean_lib.models.bpool import BPool
 from ocean_lib.models.fixed_rate_exchange import FixedRateExchange
 from ocean_lib.ocean.util import from_base_18, to_base_18
-from ocean_lib.web3_internal.event_filter import EventFilter
 from web3.utils.events import get_event_data
 
 from aquarius.app.dao import Dao
-from aquarius.app.util import get_bool_env_value
-from aquarius.block_utils import BlockProcessingClass
+from aquarius.app.util import get_bool_env_value, get_int_env_value
+from aquarius.block_utils import BlockProcessingClass, BlockRangeChunker
+from aquarius.events.balancer_math import calc_in_given_out, calc_spot_price
+from aquarius.events.bulk_pricing import select_pools_prices
+from aquarius.events.bulk_writer import BulkWriter
+from aquarius.events.datatoken_info import DatatokenInfoCache
+from aquarius.events.pool_registry import PoolRegistry, find_pools
+from aquarius.events.pool_reserves import PoolReserves
 from aquarius.events.util import (
-    get_datatoken_info,
     get_exchange_contract,
+    get_pools_snapshots,
     prepare_contracts,
 )
 
@@ -33,20 +39,40 @@ class MetadataUpdater(BlockProcessingClass):
 
     The update happens in two stages:
      1. Initial update is performed if this is ran for the first time. This is determined by
-        checking for a cached block number from a previous run. The initial update extracts all
-        Datatoken Ocean balancer pools by looking at the BFactory `BPoolRegistered` event. Then
-        each Asset in the database is updated with the liquidity/price information from the
-        corresponding pool.
+        checking for a cached block number from a previous run. The initial update takes all
+        Datatoken Ocean balancer pools from the `PoolRegistry`, which follows the BFactory
+        `BPoolRegistered` event. Then each Asset in the database is updated with the
+        liquidity/price information from the corresponding pool.
      2. Periodic update is continuously running to detect liquidity updates by looking at the
-        `LOG_JOIN`, `LOG_EXIT`, and `LOG_SWAP` event logs. The events are detected regardless of
-        the pool contract, i.e. it looks at all matching events from all BPool contracts or
-        even any smartcontract event that has the same signature.
-        See `get_dt_addresses_from_pool_logs`
+        `LOG_JOIN`, `LOG_EXIT`, and `LOG_SWAP` event logs. Only the events of the pools in the
+        `PoolRegistry` are read, with one `getLogs` request per batch of pool addresses.
+        See `get_dt_addresses_from_pool_logs`. The token amounts of these events keep the
+        reserves of the known pools current (see `PoolReserves`), so the prices are updated
+        without reading the pools again.
 
     Notes:
         - Set the `BFACTORY_BLOCK` envvar to tell the updater which `fromBlock` to start processing
           events. This should be set to the blockNumber in which the BFactory was created/deployed
         - The continuous updater runs every N seconds (initially set to 20s)
+        - Pool events are processed in block chunks, see `EVENTS_BLOCKS_CHUNK_SIZE`, and the
+          last processed block is stored after each chunk
+        - Only blocks with `EVENTS_CONFIRMATIONS` confirmations are processed, the range after
+          a reorg is processed again (see `BlockProcessingClass.get_resume_block`)
+        - The pools, with their datatoken and base token, are kept in the persistent
+          `PoolRegistry`, so the pools of a datatoken are found without reading any log
+        - The tokens of the new pools are read by `POOL_TOKENS_CONCURRENCY` threads when the
+          registry is updated and reused while updating the prices
+        - The pool prices are computed locally with the Balancer fixed-point math (see
+          `balancer_math`) from the balances, weights and swap fees of all the candidate
+          pools, read in one batch of calls
+        - The tracked pool reserves are compared with the chain every
+          `POOL_RESERVES_RECONCILE_INTERVAL` seconds and the drifted pools are logged
+        - The full update prices all the pools at once with vectorized floating point
+          math, unless `METADATA_BULK_REPRICE` is 0
+        - The datatoken info of the updated assets is read through a `DatatokenInfoCache`,
+          missing entries are read with batched JSON-RPC calls
+        - Only the `price` and `dataTokenInfo` of the assets are saved, with partial
+          updates sent in bulk requests
         - The price/liquidity info is added to the Asset's json object under the `price` key, e.g.:
                 asset['price'] = {
                     'datatoken': 90,
@@ -62,12 +88,22 @@ class MetadataUpdater(BlockProcessingClass):
 
     DID_PREFIX = "did:op:"
     PRICE_TOO_LARGE = 1000000000
+    DT_INFO_BATCH_SIZE = 100
 
-    def __init__(self, oceandb, other_db_index, web3, config):
+    def __init__(self, oceandb, other_db_index, web3, config, dt_info_cache=None):
         self._oceandb = oceandb
         self._other_db_index = other_db_index
         self._web3 = web3
         self._config = config
+        # without a shared cache, invalidated by the events monitor, the transfers
+        # are read along with the pool events
+        self._own_dt_info_cache = dt_info_cache is None
+        self._dt_info_cache = dt_info_cache or DatatokenInfoCache(web3)
+        self._bulk_writer = BulkWriter(
+            self._oceandb.driver.es,
+            self._oceandb.driver.db_index,
+            max_actions=get_int_env_value("EVENTS_BULK_MAX_ACTIONS", 500, min_value=1),
+        )
 
         self._addresses = prepare_contracts(self._web3, self._config)
         self._checksum_ocean = self._addresses.get("Ocean")
@@ -90,8 +126,35 @@ class MetadataUpdater(BlockProcessingClass):
             self.ex_contract and self.ex_contract.address
         ), "Failed to load FixedRateExchange contract."
 
+        self._blocks_chunker = BlockRangeChunker(
+            get_int_env_value("EVENTS_BLOCKS_CHUNK_SIZE", 1000, min_value=1),
+            max_size=get_int_env_value(
+                "EVENTS_MAX_BLOCKS_CHUNK_SIZE", 100000, min_value=1
+            ),
+        )
         self._do_first_update = get_bool_env_value("METADATA_UPDATE_ALL", 1)
+        self._bulk_reprice = get_bool_env_value("METADATA_BULK_REPRICE", 1)
+        self._pool_tokens_concurrency = get_int_env_value(
+            "POOL_TOKENS_CONCURRENCY", 8, min_value=1
+        )
+        self._pool_tokens_timeout = get_int_env_value(
+            "POOL_TOKENS_TIMEOUT", 30, min_value=1
+        )
         self.bfactory_block = self.get_or_set_last_block()
+        self._pool_logs_addresses_per_query = get_int_env_value(
+            "POOL_LOGS_ADDRESSES_PER_QUERY", 500, min_value=1
+        )
+        self._pool_reserves = PoolReserves(
+            web3,
+            reconcile_interval=get_int_env_value(
+                "POOL_RESERVES_RECONCILE_INTERVAL", 3600, min_value=0
+            ),
+            state_blocks=get_int_env_value(
+                "POOL_RESERVES_STATE_BLOCKS", 128, min_value=0
+            ),
+        )
+        # loaded on first use, a single update only reads the pools of its datatoken
+        self._pool_registry = None
 
         self._is_on = False
         default_quiet_time = 10
@@ -106,10 +169,28 @@ class MetadataUpdater(BlockProcessingClass):
     def is_running(self):
         return self._is_on
 
+    @property
+    def pool_registry(self):
+        if self._pool_registry is None:
+            self._pool_registry = PoolRegistry(
+                self._oceandb,
+                self._other_db_index,
+                self._web3,
+                self._addresses.get(BFactory.CONTRACT_NAME),
+                self.get_pools_tokens,
+                ocean_address=self._OCEAN,
+            )
+
+        return self._pool_registry
+
     @property
     def block_envvar(self):
         return "BFACTORY_BLOCK"
 
+    @property
+    def checkpoint_id(self):
+        return "pool_events_last_block"
+
     def start(self):
         if self._is_on:
             return
@@ -170,28 +251,6 @@ class MetadataUpdater(BlockProcessingClass):
         sig_str = f'{event_name}({",".join(types)})'
         return self._web3.sha3(text=sig_str).hex()
 
-    def get_last_processed_block(self):
-        last_block_record = self._oceandb.driver.es.get(
-            index=self._other_db_index, id="pool_events_last_block", doc_type="_doc"
-        )["_source"]
-        return last_block_record["last_block"]
-
-    def store_last_processed_block(self, block):
-        record = {"last_block": block}
-        try:
-            self._oceandb.driver.es.index(
-                index=self._other_db_index,
-                id="pool_events_last_block",
-                body=record,
-                doc_type="_doc",
-                refresh="wait_for",
-            )["_id"]
-
-        except elasticsearch.exceptions.RequestError as e:
-            logger.error(
-                f"store_last_processed_block: block={block} type={type(block)}, error={e}"
-            )
-
     def get_dt_addresses_from_exchange_logs(self, from_block, to_block=None):
         contract = FixedRateExchange(None)
         event_names = ["ExchangeCreated"]  # , 'ExchangeRateChanged']
@@ -238,47 +297,64 @@ class MetadataUpdater(BlockProcessingClass):
 
         return address_exid
 
-    def get_dt_addresses_from_pool_logs(self, from_block, to_block=None):
+    def get_pool_logs(self, from_block, to_block=None):
+        """Return the parsed `LOG_JOIN`, `LOG_EXIT` and `LOG_SWAP` events of the
+        registered pools in the block range, in chain order.
+
+        The pools are queried in batches of `POOL_LOGS_ADDRESSES_PER_QUERY`
+        addresses, with one request for the three events per batch.
+        """
         contract = BPool(None)
-        event_names = ["LOG_JOIN", "LOG_EXIT", "LOG_SWAP"]
-        topic0_list = [self._get_event_signature(contract, en) for en in event_names]
-        args_list = [("tokenIn",), ("tokenOut",), ("tokenIn", "tokenOut")]
-        filters = []
-        to_block = to_block or "latest"
-        for i, event_name in enumerate(event_names):
-            filters.append(
-                {
-                    "fromBlock": from_block,
-                    "toBlock": to_block,
-                    "topics": [topic0_list[i]],
-                }
-            )
+        event_abis = dict()
+        for event_name in ("LOG_JOIN", "LOG_EXIT", "LOG_SWAP"):
+            topic0 = self._get_event_signature(contract, event_name)
+            event_abis[add_0x_prefix(topic0)] = getattr(
+                contract.events, event_name
+            )().abi
 
-        events = [getattr(contract.events, en) for en in event_names]
-        event_abis = [e().abi for e in events]
-        # all_logs = []
-        addresses = []
-        for i, _filter in enumerate(filters):
+        to_block = to_block or "latest"
+        pools = self.pool_registry.pools()
+        all_logs = []
+        for i in range(0, len(pools), self._pool_logs_addresses_per_query):
+            _filter = {
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "address": pools[i : i + self._pool_logs_addresses_per_query],
+                "topics": [list(event_abis.keys())],
+            }
             try:
                 logs = self._web3.eth.getLogs(_filter)
             except ValueError as e:
                 logger.error(
-                    f"get_dt_addresses_from_pool_logs -> web3.eth.getLogs "
-                    f"(filter={_filter}) failed: {e}.."
+                    f"get_pool_logs -> web3.eth.getLogs ({from_block}, {to_block}, "
+                    f"{len(_filter['address'])} pools) failed: {e}.."
                 )
-                logs = []
+                raise
 
-            if logs:
-                args = args_list[i]
-                for log in logs:
-                    parsed_log = get_event_data(event_abis[i], log)
-                    addresses.extend(
-                        [
-                            (parsed_log.args.get(arg, ""), parsed_log.address)
-                            for arg in args
-                        ]
-                    )
-                    # all_logs.append(parsed_log)
+            all_logs.extend(
+                get_event_data(event_abis[add_0x_prefix(log["topics"][0].hex())], log)
+                for log in logs
+            )
+
+        return sorted(all_logs, key=lambda l: (l.blockNumber, l.logIndex))
+
+    def get_dt_addresses_from_pool_logs(self, from_block, to_block=None, logs=None):
+        """Return the (token address, pool address) of the pool events of the block
+        range, or of the parsed pool events `logs` if given. The address is empty
+        for the OCEAN token."""
+        if logs is None:
+            logs = self.get_pool_logs(from_block, to_block)
+
+        args_list = {
+            "LOG_JOIN": ("tokenIn",),
+            "LOG_EXIT": ("tokenOut",),
+            "LOG_SWAP": ("tokenIn", "tokenOut"),
+        }
+        addresses = []
+        for log in logs:
+            addresses.extend(
+                [(log.args.get(arg, ""), log.address) for arg in args_list[log.event]]
+            )
 
         addresses_and_pools = [
             (a, pool) if a and a.lower() != self._OCEAN else ("", pool)
@@ -287,45 +363,51 @@ class MetadataUpdater(BlockProcessingClass):
         return addresses_and_pools
 
     def get_datatoken_pools(self, dt_address, from_block=0, to_block="latest"):
-        contract = BPool(None)
-        topic0 = self._get_event_signature(contract, "LOG_JOIN")
-        topic2 = f"0x000000000000000000000000{remove_0x_prefix(dt_address).lower()}"
-        filter_params = {
-            "fromBlock": from_block,
-            "toBlock": to_block,
-            "topics": [topic0, None, topic2],
-        }
-
-        e = getattr(contract.events, "LOG_JOIN")
-        event_abi = e().abi
-        logs = self._web3.eth.getLogs(filter_params)
-        if not logs:
-            return None
-
-        pools = {get_event_data(event_abi, log).address for log in logs}
-        return list(pools)
+        """Return the registered pools of datatoken `dt_address`, None if there are none.
+
+        If the pool registry is not loaded, as for the single updates of the API, the
+        pools are read from its index with `find_pools`.
+        """
+        to_block = None if to_block == "latest" else to_block
+        if self._pool_registry is None:
+            pools = find_pools(self._oceandb, dt_address, from_block, to_block)
+        else:
+            pools = self._pool_registry.get_pools(
+                dt_address, from_block=from_block, to_block=to_block
+            )
+        return pools or None
 
     def _get_liquidity_and_price(self, pools, dt_address):
         assert pools, f"pools should not be empty, got {pools}"
         logger.debug(f" Searching {pools} for {dt_address}")
         dt_address_lower = dt_address.lower()
-        pool_to_price = dict()
+        candidates = []
         for _pool in pools:
             try:
-                pool = BPool(_pool)
-                try:
-                    ptokens = {a.lower() for a in pool.getCurrentTokens()}
-                except Exception:
-                    continue
+                ptokens = {a.lower() for a in self._get_pool_tokens(_pool)}
+            except Exception:
+                continue
 
-                if self._OCEAN not in ptokens or dt_address_lower not in ptokens:
-                    logger.debug(
-                        f" ignore pool {_pool}, cannot find {self._OCEAN} and {dt_address_lower} in tokens list {ptokens}"
-                    )
-                    continue
+            if self._OCEAN not in ptokens or dt_address_lower not in ptokens:
+                logger.debug(
+                    f" ignore pool {_pool}, cannot find {self._OCEAN} and {dt_address_lower} in tokens list {ptokens}"
+                )
+                continue
+
+            candidates.append(_pool)
 
+        snapshots = self._get_pools_snapshots(candidates, dt_address)
+        pool_to_price = dict()
+        for _pool, snapshot in snapshots.items():
+            try:
                 price = from_base_18(
-                    pool.getSpotPrice(self._checksum_ocean, dt_address)
+                    calc_spot_price(
+                        snapshot["balances"][self._checksum_ocean],
+                        snapshot["weights"][self._checksum_ocean],
+                        snapshot["balances"][dt_address],
+                        snapshot["weights"][dt_address],
+                        snapshot["swapFee"],
+                    )
                 )
                 if price <= 0.0 or price > self.PRICE_TOO_LARGE:
                     continue
@@ -340,26 +422,46 @@ class MetadataUpdater(BlockProcessingClass):
 
         if pool_to_price:
             _pool = sorted(pool_to_price.items(), key=lambda x: x[1])[0][0]
-            dt_reserve, ocn_reserve, price, _pool = self.get_pool_reserves_and_price(
-                _pool, dt_address
-            )
-            return dt_reserve, ocn_reserve, price, _pool
+            return self._get_reserves_and_price(snapshots[_pool], _pool, dt_address)
 
         # no pool or no pool with price was found
         return 0.0, 0.0, 0.0, pools[0]
 
-    def get_pool_reserves_and_price(self, _pool, dt_address):
-        pool = BPool(_pool)
-        dt_reserve = pool.getBalance(dt_address)
-        ocn_reserve = pool.getBalance(self._checksum_ocean)
-        price_base = pool.calcInGivenOut(
-            ocn_reserve,
-            pool.getDenormalizedWeight(self._checksum_ocean),
-            dt_reserve,
-            pool.getDenormalizedWeight(dt_address),
-            to_base_18(1.0),
-            pool.getSwapFee(),
+    def _get_pools_snapshots(self, pools, dt_address):
+        """Return the OCEAN and datatoken balances and weights and the swap fee of
+        `pools`, see `PoolReserves.get_snapshots`."""
+        if not pools:
+            return dict()
+
+        return self._pool_reserves.get_snapshots(
+            {pool: [self._checksum_ocean, dt_address] for pool in pools}
         )
+
+    def get_pool_reserves_and_price(self, _pool, dt_address):
+        dt_address = self._web3.toChecksumAddress(dt_address)
+        snapshot = self._get_pools_snapshots([_pool], dt_address).get(_pool)
+        if snapshot is None:
+            raise ValueError(f"reading the reserves of pool {_pool} failed.")
+
+        return self._get_reserves_and_price(snapshot, _pool, dt_address)
+
+    def _get_reserves_and_price(self, snapshot, _pool, dt_address):
+        dt_reserve = snapshot["balances"][dt_address]
+        ocn_reserve = snapshot["balances"][self._checksum_ocean]
+        try:
+            price_base = calc_in_given_out(
+                ocn_reserve,
+                snapshot["weights"][self._checksum_ocean],
+                dt_reserve,
+                snapshot["weights"][dt_address],
+                to_base_18(1.0),
+                snapshot["swapFee"],
+            )
+        except ValueError as e:
+            # the pool contract would revert, e.g. with less than 2 datatokens left
+            logger.debug(f"calcInGivenOut of pool {_pool} failed: {e}")
+            price_base = 0
+
         price = from_base_18(price_base)
         ocn_reserve = from_base_18(ocn_reserve)
         dt_reserve = from_base_18(dt_reserve)
@@ -397,29 +499,105 @@ class MetadataUpdater(BlockProcessingClass):
             )
             return None, None
 
+    def get_pools_tokens(self, pools):
+        """Read the tokens of `pools` with `POOL_TOKENS_CONCURRENCY` threads.
+
+        :return: dict of pool address -> list of token addresses, without the pools
+            whose `getCurrentTokens` call failed or was not done within
+            `POOL_TOKENS_TIMEOUT` seconds, for all the pools.
+        """
+        pools_tokens = dict()
+        executor = ThreadPoolExecutor(max_workers=self._pool_tokens_concurrency)
+        try:
+            futures = {
+                executor.submit(lambda p: BPool(p).getCurrentTokens(), pool): pool
+                for pool in pools
+            }
+            done, not_done = wait(futures, timeout=self._pool_tokens_timeout)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                try:
+                    pools_tokens[futures[future]] = future.result()
+                except Exception as e:
+                    logger.debug(
+                        f"reading the tokens of pool {futures[future]} failed: {e}"
+                    )
+        finally:
+            executor.shutdown(wait=False)
+
+        logger.info(f"read the tokens of {len(pools_tokens)}/{len(pools)} pools.")
+        return pools_tokens
+
+    def _get_pool_tokens(self, pool_address):
+        ptokens = None
+        # the registry is not loaded for a single update
+        if self._pool_registry is not None:
+            entry = self._pool_registry.get_pool(pool_address)
+            ptokens = entry["tokens"] if entry else None
+        if ptokens is None:
+            ptokens = BPool(pool_address).getCurrentTokens()
+        return ptokens
+
     def get_all_pools(self):
-        bfactory = BFactory(self._addresses.get(BFactory.CONTRACT_NAME))
-        event_name = "BPoolRegistered"
-        event = getattr(bfactory.events, event_name)
-        latest_block = self._web3.eth.blockNumber
-        _from = self.bfactory_block
-        chunk = 10000
-        pools = []
-        while _from < latest_block:
-            event_filter = EventFilter(
-                event_name, event, None, from_block=_from, to_block=_from + chunk - 1
-            )
-            try:
-                logs = event_filter.get_all_entries(max_tries=10)
-                logs = sorted(logs, key=lambda l: l.blockNumber)
-                pools.extend([log.args.bpoolAddress for log in logs])
-            except ValueError as e:
-                logger.error(
-                    f"get_all_pools BFactory {bfactory.address}, fromBlock {_from}, toBlock{_from+chunk-1}: {e}"
+        """Update the pool registry and return the addresses of all the pools, the
+        known pools if the update fails."""
+        try:
+            return self.pool_registry.update()
+        except Exception as e:
+            logger.error(f"updating the pool registry failed: {e}")
+            return self.pool_registry.pools()
+
+    def get_bulk_liquidity_and_prices(self, dt_to_pools):
+        """Same as `_get_liquidity_and_price` for all the datatokens at once.
+
+        The snapshots of all the pools are read in one batch of calls and priced with
+        `select_pools_prices`.
+
+        :return: dict of datatoken -> (dt_reserve, ocn_reserve, price, pool address),
+            without the datatokens that have no pool with a valid price.
+        """
+        dts = list(dt_to_pools.keys())
+        pools_tokens = {
+            pool: [self._checksum_ocean, self._web3.toChecksumAddress(dt)]
+            for dt in dts
+            for pool in dt_to_pools[dt]
+        }
+        start_time = time.time()
+        snapshots = get_pools_snapshots(self._web3, pools_tokens)
+        rows = []
+        for group, dt in enumerate(dts):
+            for pool in dt_to_pools[dt]:
+                snapshot = snapshots.get(pool)
+                if snapshot is None:
+                    continue
+
+                _dt = pools_tokens[pool][1]
+                rows.append(
+                    (
+                        group,
+                        pool,
+                        from_base_18(snapshot["balances"][self._checksum_ocean]),
+                        snapshot["weights"][self._checksum_ocean],
+                        from_base_18(snapshot["balances"][_dt]),
+                        snapshot["weights"][_dt],
+                        from_base_18(snapshot["swapFee"]),
+                    )
                 )
-            _from += chunk
 
-        return pools
+        if not rows:
+            return dict()
+
+        groups, pools, *values = zip(*rows)
+        selected = select_pools_prices(groups, *values, self.PRICE_TOO_LARGE)
+        logger.info(
+            f"priced {len(rows)} pools of {len(selected)} datatokens in "
+            f"{time.time() - start_time:.1f}s."
+        )
+        return {
+            dts[group]: (dt_reserve, ocn_reserve, price, pools[i])
+            for group, (dt_reserve, ocn_reserve, price, i) in selected.items()
+        }
 
     def _get_price_updates_from_fixed_rate_exchange(
         self, _dt_address, owner=None, exchange_id=None
@@ -470,9 +648,9 @@ class MetadataUpdater(BlockProcessingClass):
 
         return price_dict
 
-    def _get_price_updates_from_liquidity(self, pools, _dt_address):
-        dt_reserve, ocn_reserve, price, pool_address = self._get_liquidity_and_price(
-            pools, _dt_address
+    def _get_price_updates_from_liquidity(self, pools, _dt_address, liquidity=None):
+        dt_reserve, ocn_reserve, price, pool_address = (
+            liquidity or self._get_liquidity_and_price(pools, _dt_address)
         )
 
         is_consumable = str(bool(price is not None and price > 0.0)).lower()
@@ -504,7 +682,7 @@ class MetadataUpdater(BlockProcessingClass):
 
         dt_address = add_0x_prefix(did[prefix_len:])
         _dt_address = self._web3.toChecksumAddress(dt_address)
-        pools = self.get_datatoken_pools(dt_address, from_block=self.bfactory_block)
+        pools = self.get_datatoken_pools(dt_address)
         if pools:
             logger.info(
                 f"Found pools for asset with address={_dt_address}, "
@@ -529,7 +707,7 @@ class MetadataUpdater(BlockProcessingClass):
 
         asset["price"].update(price_dict)
         try:
-            dt_info = get_datatoken_info(_dt_address)
+            dt_info = self._dt_info_cache.get(_dt_address)
         except Exception as e:
             logger.error(
                 f"getting datatoken info failed for datatoken {_dt_address}: {e}"
@@ -541,29 +719,19 @@ class MetadataUpdater(BlockProcessingClass):
         logger.info(
             f"doing single asset update: datatoken {dt_address}, pools {pools}, price-info {price_dict}"
         )
-        self._oceandb.update(asset, did)
+        self._queue_price_update(did, asset)
+        self._bulk_writer.flush()
 
     def do_update(self):
         did_prefix = self.DID_PREFIX
         prefix_len = len(did_prefix)
-        pools = self.get_all_pools()
-        dt_to_pool = dict()
-        for pool_address in pools:
-            pool = BPool(pool_address)
-            try:
-                ptokens = pool.getCurrentTokens()
-            except Exception:
-                continue
-
-            if len(ptokens) != 2 or ptokens[1].lower() != self._OCEAN:
-                continue
-
-            dt = add_0x_prefix(ptokens[0]).lower()
-            if dt not in dt_to_pool:
-                dt_to_pool[dt] = []
-
-            dt_to_pool[dt].append(pool_address)
+        self.get_all_pools()
+        dt_to_pool = self.pool_registry.get_dt_to_pools(base_token=self._OCEAN)
+        dt_to_liquidity = (
+            self.get_bulk_liquidity_and_prices(dt_to_pool) if self._bulk_reprice else {}
+        )
 
+        updates = []
         for asset in self._get_all_assets():
             did = asset.get("id", None)
             if not did:
@@ -602,28 +770,65 @@ class MetadataUpdater(BlockProcessingClass):
                     f"Updating price from LIQUIDITY AND PRICE."
                 )
 
-                price_dict = self._get_price_updates_from_liquidity(pools, _dt_address)
+                liquidity = None
+                if self._bulk_reprice:
+                    liquidity = dt_to_liquidity.get(
+                        dt_address, (0.0, 0.0, 0.0, pools[0])
+                    )
+                price_dict = self._get_price_updates_from_liquidity(
+                    pools, _dt_address, liquidity
+                )
 
             asset["price"].update(price_dict)
-            try:
-                dt_info = get_datatoken_info(_dt_address)
-            except Exception as e:
-                logger.error(
-                    f"getting datatoken info failed for datatoken {_dt_address}: {e}"
-                )
-                dt_info = {}
+            updates.append((did, _dt_address, asset, pools, price_dict))
+            if len(updates) >= self.DT_INFO_BATCH_SIZE:
+                self._save_price_updates(updates)
+                updates = []
+
+        if updates:
+            self._save_price_updates(updates)
 
-            asset["dataTokenInfo"] = dt_info
+    def _save_price_updates(self, updates):
+        dt_infos = self._get_datatokens_info([u[1] for u in updates])
+        for did, _dt_address, asset, pools, price_dict in updates:
+            asset["dataTokenInfo"] = dt_infos.get(_dt_address, {})
 
             logger.info(
-                f"updating price info for datatoken: {dt_address}, pools {pools}, price-info {price_dict}"
+                f"updating price info for datatoken: {_dt_address}, pools {pools}, price-info {price_dict}"
             )
-            self._oceandb.update(asset, did)
+            self._queue_price_update(did, asset)
+        self._bulk_writer.flush()
+
+    def _queue_price_update(self, did, asset):
+        """Queue a partial update of the price and datatoken info of an asset. Only
+        the datatoken info fields that were read are written, the saved values of
+        the others are kept."""
+        dt_info = {
+            field: value
+            for field, value in (asset.get("dataTokenInfo") or {}).items()
+            if value is not None
+        }
+        partial_doc = {"price": asset["price"]}
+        if dt_info:
+            partial_doc["dataTokenInfo"] = dt_info
+        self._bulk_writer.update(did, partial_doc)
+
+    def _get_datatokens_info(self, dt_addresses):
+        try:
+            return self._dt_info_cache.get_many(dt_addresses)
+        except Exception as e:
+            logger.error(
+                f"getting datatoken info failed for {len(dt_addresses)} datatokens: {e}"
+            )
+            return dict()
 
     def update_dt_assets_with_exchange_info(self, dt_address_exid):
         did_prefix = self.DID_PREFIX
         dao = Dao(oceandb=self._oceandb)
         seen_exs = set()
+        dt_infos = self._get_datatokens_info(
+            list({address for address, _ in dt_address_exid if address})
+        )
         for address, exid in dt_address_exid:
             if not address or exid in seen_exs:
                 continue
@@ -652,9 +857,9 @@ class MetadataUpdater(BlockProcessingClass):
                 )
 
                 asset["price"].update(price_dict)
-                asset["dataTokenInfo"] = get_datatoken_info(_dt_address)
+                asset["dataTokenInfo"] = dt_infos.get(_dt_address, {})
 
-                self._oceandb.update(asset, did)
+                self._queue_price_update(did, asset)
                 logger.info(
                     f"updated price info: dt={address}, exchangeAddress={self.ex_contract.address}, "
                     f'exchangeId={exid}, price={asset["price"]}'
@@ -664,6 +869,8 @@ class MetadataUpdater(BlockProcessingClass):
                     f"updating datatoken assets price values from exchange contract: {e}"
                 )
 
+        self._bulk_writer.flush()
+
     def update_dt_assets(self, dt_address_pool_list):
         did_prefix = self.DID_PREFIX
         dao = Dao(oceandb=self._oceandb)
@@ -675,14 +882,28 @@ class MetadataUpdater(BlockProcessingClass):
 
             seen_pools.add(pool_address)
             if not address:
-                address = BPool(pool_address).getCurrentTokens()[0]
+                entry = self.pool_registry.get_pool(pool_address)
+                if entry and entry["datatoken"]:
+                    address = entry["datatoken"]
+                else:
+                    tokens = self._get_pool_tokens(pool_address)
+                    address = next(
+                        (t for t in tokens if t.lower() != self._OCEAN), tokens[0]
+                    )
 
-            _dt_address_pool_list.append((address, pool_address))
+            _dt_address_pool_list.append(
+                (self._web3.toChecksumAddress(address), pool_address)
+            )
 
         dt_to_pools = {a: [] for a, p in _dt_address_pool_list}
         for address, pool_address in _dt_address_pool_list:
             dt_to_pools[address].append(pool_address)
+        for address, pools in dt_to_pools.items():
+            pools.extend(
+                p for p in self.pool_registry.get_pools(address) if p not in pools
+            )
 
+        dt_infos = self._get_datatokens_info(list(dt_to_pools.keys()))
         asset = None
         for address, pools in dt_to_pools.items():
 
@@ -709,15 +930,17 @@ class MetadataUpdater(BlockProcessingClass):
                 )
                 price_dict = self._get_price_updates_from_liquidity(_pools, _dt_address)
                 asset["price"].update(price_dict)
-                asset["dataTokenInfo"] = get_datatoken_info(_dt_address)
+                asset["dataTokenInfo"] = dt_infos.get(_dt_address, {})
 
-                self._oceandb.update(asset, did)
+                self._queue_price_update(did, asset)
                 logger.info(
                     f'updated price info: dt={address}, pool={pool_address}, price={asset["price"]}'
                 )
             except Exception as e:
                 logger.error(f"updating datatoken assets price/liquidity values: {e}")
 
+        self._bulk_writer.flush()
+
     def process_pool_events(self):
         try:
             last_block = self.get_last_processed_block()
@@ -725,29 +948,59 @@ class MetadataUpdater(BlockProcessingClass):
             logger.warning(f"exception thrown reading last_block from db: {e}")
             last_block = 0
 
-        block = self._web3.eth.blockNumber
+        resume_block = self.get_resume_block(last_block)
+        if resume_block < last_block:
+            # the tracked reserves include events of reorged blocks
+            self._pool_reserves.clear()
+        last_block = resume_block
+        block = self.get_confirmed_block()
         if not block or not isinstance(block, int) or block <= last_block:
             return
 
+        try:
+            self.pool_registry.update()
+        except Exception as e:
+            # the events of the missing pools would be skipped
+            logger.error(f"updating the pool registry failed: {e}")
+            return
+
         from_block = last_block
         logger.debug(
             f"Price/Liquidity monitor >>>> from_block:{from_block}, current_block:{block} <<<<"
         )
-        ok = False
-        try:
-            dt_address_pool_list = self.get_dt_addresses_from_pool_logs(
-                from_block=from_block, to_block=block
-            )
-            self.update_dt_assets(dt_address_pool_list)
-            dt_address_exchange = self.get_dt_addresses_from_exchange_logs(
-                from_block=from_block, to_block=block
-            )
-            self.update_dt_assets_with_exchange_info(dt_address_exchange)
-            ok = True
+        chunker = self._blocks_chunker
+        while from_block <= block:
+            start_block, end_block = chunker.next_range(from_block, block)
+            start_time = time.time()
+            try:
+                try:
+                    pool_logs = self.get_pool_logs(start_block, end_block)
+                except (ValueError, requests.exceptions.RequestException):
+                    if chunker.shrink():
+                        continue
+                    raise
+
+                chunker.adjust(time.time() - start_time, len(pool_logs))
+                if self._own_dt_info_cache:
+                    self._dt_info_cache.process_transfer_logs(start_block, end_block)
+                self._pool_reserves.apply_logs(pool_logs, end_block)
+                dt_address_pool_list = self.get_dt_addresses_from_pool_logs(
+                    start_block, end_block, logs=pool_logs
+                )
+                self.update_dt_assets(dt_address_pool_list)
+                dt_address_exchange = self.get_dt_addresses_from_exchange_logs(
+                    from_block=start_block, to_block=end_block
+                )
+                self.update_dt_assets_with_exchange_info(dt_address_exchange)
 
-        except Exception as e:
-            logging.error(f"process_pool_events: {e}")
+            except Exception as e:
+                logging.error(f"process_pool_events: {e}")
+                return
 
-        finally:
-            if ok and isinstance(block, int):
-                self.store_last_processed_block(block)
+            self.store_last_processed_block(end_block, self.get_block_hash(end_block))
+            from_block = end_block + 1
+
+        try:
+            self._pool_reserves.reconcile()
+        except Exception as e:
+            logger.error(f"reconciling the pool reserves failed: {e}")
@@ -0,0 +1,293 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+import time
+
+import requests
+from elasticsearch.helpers import scan
+from ocean_lib.models.bfactory import BFactory
+from ocean_lib.web3_internal.event_filter import EventFilter
+
+from aquarius.app.util import get_int_env_value
+from aquarius.block_utils import BlockProcessingClass, BlockRangeChunker
+from aquarius.events.bulk_writer import BulkWriter
+
+logger = logging.getLogger(__name__)
+
+
+class PoolRegistryError(Exception):
+    pass
+
+
+def find_pools(oceandb, dt_address, from_block=0, to_block=None):
+    """Return the addresses of the saved pools of datatoken `dt_address`, in
+    registration order, optionally only those registered in the block range.
+
+    Unlike a `PoolRegistry`, only the pools of the datatoken are read from the
+    index and the registry checkpoint is left untouched.
+    """
+    pools = [
+        hit["_source"]
+        for hit in scan(
+            oceandb.driver.es,
+            index=f"{oceandb.driver.db_index}_pools",
+            query={"query": {"match": {"datatoken": dt_address.lower()}}},
+        )
+    ]
+    return [
+        p["pool"]
+        for p in sorted(pools, key=lambda p: p["block"])
+        if p["datatoken"] == dt_address.lower()
+        and p["block"] >= (from_block or 0)
+        and (to_block is None or p["block"] <= to_block)
+    ]
+
+
+class PoolRegistry(BlockProcessingClass):
+    """Persistent registry of the pools created by the BFactory.
+
+    Each pool is saved in the `<index>_pools` Elasticsearch index with its address,
+    tokens, datatoken, base token and registration block, and all pools are kept in
+    memory. `update` reads the `BPoolRegistered` events from its own checkpoint
+    (`pool_registry_last_block`) to the latest confirmed block, the pools registered
+    in reorged blocks are dropped. A new pool has no tokens yet, its tokens are read
+    again by the next updates, at growing intervals, until they are bound. The
+    datatoken and base token are only set for the pools of two tokens, the base
+    token is OCEAN if it is one of them.
+    """
+
+    TOKENS_RETRY_DELAY = 60
+    TOKENS_MAX_RETRY_DELAY = 3600
+
+    def __init__(
+        self,
+        oceandb,
+        other_db_index,
+        web3,
+        bfactory_address,
+        read_tokens,
+        ocean_address=None,
+    ):
+        """
+        :param read_tokens: function taking a list of pool addresses and returning
+            the dict of pool address -> list of token addresses.
+        """
+        self._oceandb = oceandb
+        self._other_db_index = other_db_index
+        self._web3 = web3
+        self._bfactory_address = bfactory_address
+        self._read_tokens = read_tokens
+        self._ocean_address = ocean_address.lower() if ocean_address else None
+        # pool address -> (time of the next read of its tokens, retry delay)
+        self._tokens_retries = dict()
+        self._index = f"{oceandb.driver.db_index}_pools"
+        es = oceandb.driver.es
+        es.indices.create(index=self._index, ignore=400)
+        self._bulk_writer = BulkWriter(es, self._index, refresh=False)
+        self._blocks_chunker = BlockRangeChunker(
+            10000,
+            max_size=get_int_env_value(
+                "EVENTS_MAX_BLOCKS_CHUNK_SIZE", 100000, min_value=1
+            ),
+        )
+        self._pools = dict()
+        self._load(es)
+        self.get_or_set_last_block()
+
+    @property
+    def block_envvar(self):
+        return "BFACTORY_BLOCK"
+
+    @property
+    def checkpoint_id(self):
+        return "pool_registry_last_block"
+
+    def __len__(self):
+        return len(self._pools)
+
+    def get_pool(self, pool_address):
+        return self._pools.get(pool_address.lower())
+
+    def pools(self):
+        """Return the addresses of all the pools, in registration order."""
+        return [p["pool"] for p in self._pools.values()]
+
+    def pools_tokens(self):
+        """Return the dict of pool address -> list of token addresses."""
+        return {p["pool"]: p["tokens"] for p in self._pools.values() if p["tokens"]}
+
+    def get_pools(self, dt_address, from_block=0, to_block=None):
+        """Return the addresses of the pools of datatoken `dt_address`, optionally
+        only those registered in the block range."""
+        dt_address = dt_address.lower()
+        return [
+            p["pool"]
+            for p in self._pools.values()
+            if p["datatoken"] == dt_address
+            and p["block"] >= (from_block or 0)
+            and (to_block is None or p["block"] <= to_block)
+        ]
+
+    def get_dt_to_pools(self, base_token=None):
+        """Return the dict of datatoken -> pool addresses, optionally only for the
+        pools of `base_token`."""
+        dt_to_pools = dict()
+        for pool in self._pools.values():
+            if not pool["datatoken"]:
+                continue
+            if base_token and pool["baseToken"] != base_token.lower():
+                continue
+            dt_to_pools.setdefault(pool["datatoken"], []).append(pool["pool"])
+
+        return dt_to_pools
+
+    def update(self):
+        """Add the pools registered since the last update and read the tokens of
+        the pools that do not have them yet.
+
+        :raise PoolRegistryError: if the pools registered up to the latest confirmed
+            block could not all be added.
+        """
+        try:
+            last_block = self.get_last_processed_block()
+        except Exception as e:
+            logger.warning(f"reading the pool registry checkpoint failed: {e}")
+            last_block = self.get_or_set_last_block()
+
+        resume_block = self.get_resume_block(last_block)
+        if resume_block < last_block:
+            self._drop_pools_after(resume_block)
+        last_block = resume_block
+        to_block = self.get_confirmed_block()
+        added = True
+        if isinstance(to_block, int) and to_block > last_block:
+            added = self._add_registered_pools(last_block + 1, to_block)
+
+        self._resolve_tokens()
+        if not added:
+            raise PoolRegistryError(
+                f"the pools registered in blocks {last_block + 1}-{to_block} could "
+                f"not all be added."
+            )
+
+        return self.pools()
+
+    def _add_registered_pools(self, from_block, to_block):
+        """Return False if the registered pools could not all be added."""
+        bfactory = BFactory(self._bfactory_address)
+        event_name = "BPoolRegistered"
+        event = getattr(bfactory.events, event_name)
+        chunker = self._blocks_chunker
+        while from_block <= to_block:
+            start_block, end_block = chunker.next_range(from_block, to_block)
+            start_time = time.time()
+            event_filter = EventFilter(
+                event_name, event, None, from_block=start_block, to_block=end_block
+            )
+            try:
+                logs = event_filter.get_all_entries(max_tries=10)
+            except (ValueError, requests.exceptions.RequestException) as e:
+                if chunker.shrink():
+                    continue
+
+                logger.error(
+                    f"reading the pools registered in blocks {start_block}-{end_block} "
+                    f"failed: {e}"
+                )
+                return False
+
+            chunker.adjust(time.time() - start_time, len(logs))
+            for log in sorted(logs, key=lambda l: (l.blockNumber, l.logIndex)):
+                pool_address = log.args.bpoolAddress.lower()
+                self._pools[pool_address] = {
+                    "pool": log.args.bpoolAddress,
+                    "tokens": None,
+                    "datatoken": None,
+                    "baseToken": None,
+                    "block": log.blockNumber,
+                }
+                self._bulk_writer.index(pool_address, self._pools[pool_address])
+
+            if not self._bulk_writer.flush():
+                return False
+
+            self.store_last_processed_block(end_block, self.get_block_hash(end_block))
+            logger.info(
+                f"{len(logs)} pools registered in blocks {start_block}-{end_block}."
+            )
+            from_block = end_block + 1
+
+        return True
+
+    def _drop_pools_after(self, block):
+        """Drop the pools registered after `block`, they are added again if their
+        registration is still in the chain."""
+        dropped = [a for a, p in self._pools.items() if p["block"] > block]
+        for pool_address in dropped:
+            del self._pools[pool_address]
+            self._tokens_retries.pop(pool_address, None)
+            self._bulk_writer.delete(pool_address)
+
+        if dropped:
+            logger.warning(
+                f"dropped {len(dropped)} pools registered in reorged blocks after "
+                f"block {block}."
+            )
+            self._bulk_writer.flush()
+
+    def _resolve_tokens(self):
+        now = time.time()
+        pending = [
+            p["pool"]
+            for address, p in self._pools.items()
+            if not p["tokens"] and self._tokens_retries.get(address, (0,))[0] <= now
+        ]
+        if not pending:
+            return
+
+        read = self._read_tokens(pending)
+        for pool_address in pending:
+            address = pool_address.lower()
+            tokens = read.get(pool_address)
+            if not tokens:
+                # not bound yet or the call failed, read again later
+                delay = self._tokens_retries.get(address, (0, 0))[1]
+                delay = min(
+                    delay * 2 if delay else self.TOKENS_RETRY_DELAY,
+                    self.TOKENS_MAX_RETRY_DELAY,
+                )
+                self._tokens_retries[address] = (now + delay, delay)
+                continue
+
+            self._tokens_retries.pop(address, None)
+            pool = self._pools[address]
+            pool["tokens"] = list(tokens)
+            if len(tokens) == 2:
+                pool["datatoken"], pool["baseToken"] = self._split_tokens(tokens)
+            self._bulk_writer.index(address, pool)
+
+        self._bulk_writer.flush()
+
+    def _split_tokens(self, tokens):
+        """Return the datatoken and base token of a pool of two tokens."""
+        tokens = [t.lower() for t in tokens]
+        if tokens[0] == self._ocean_address:
+            return tokens[1], tokens[0]
+
+        return tokens[0], tokens[1]
+
+    def _load(self, es):
+        try:
+            for hit in scan(es, index=self._index, query={"query": {"match_all": {}}}):
+                self._pools[hit["_id"]] = hit["_source"]
+        except Exception as e:
+            logger.warning(f"loading the pool registry failed: {e}")
+
+        # keep the pools in registration order
+        self._pools = dict(
+            sorted(self._pools.items(), key=lambda item: item[1]["block"])
+        )
+
+        logger.info(f"loaded {len(self._pools)} pools from the pool registry.")
@@ -0,0 +1,207 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+import time
+from threading import Lock
+
+from web3 import Web3
+
+from aquarius.events.util import get_pools_snapshots
+
+logger = logging.getLogger(__name__)
+
+# token amount arguments of the pool events and their sign
+POOL_EVENT_AMOUNTS = {
+    "LOG_JOIN": (("tokenIn", "tokenAmountIn", 1),),
+    "LOG_EXIT": (("tokenOut", "tokenAmountOut", -1),),
+    "LOG_SWAP": (("tokenIn", "tokenAmountIn", 1), ("tokenOut", "tokenAmountOut", -1)),
+}
+
+
+class PoolReserves:
+    """Balances, weights and swap fee of the pools, kept current from their events.
+
+    A pool is added with a snapshot read at the last applied block, see
+    `get_snapshots`. Then the token amounts of its `LOG_JOIN`, `LOG_EXIT` and
+    `LOG_SWAP` events are applied to its balances, without any call. The balances
+    can still drift, e.g. after a `gulp` or a weight or fee change, so all the pools
+    are read again every `reconcile_interval` seconds, see `reconcile`. The pools
+    are only read at the last `state_blocks` blocks, whose state is kept by a
+    non-archive node, or at any block if `state_blocks` is 0.
+    """
+
+    def __init__(self, web3, reconcile_interval=3600, state_blocks=128):
+        self._web3 = web3
+        self._reconcile_interval = reconcile_interval
+        self._state_blocks = state_blocks
+        self._lock = Lock()
+        self._pools = dict()
+        self._last_reconcile_time = time.time()
+        # last block whose events are applied, None until `apply_logs` is called
+        self.block = None
+
+    def __len__(self):
+        return len(self._pools)
+
+    def clear(self):
+        """Drop all the pools, e.g. after a chain reorg."""
+        with self._lock:
+            self._pools = dict()
+            self.block = None
+
+    def apply_logs(self, logs, to_block):
+        """Apply the pool events `logs` of the blocks up to `to_block`, in chain order."""
+        with self._lock:
+            for log in logs:
+                self._apply_log(log)
+            self.block = to_block
+
+    def _apply_log(self, log):
+        if self.block is not None and log.blockNumber <= self.block:
+            # already applied, the block ranges may overlap
+            return
+
+        address = Web3.toChecksumAddress(log.address)
+        pool = self._pools.get(address)
+        if pool is None or log.blockNumber <= pool["block"]:
+            return
+
+        for token_arg, amount_arg, sign in POOL_EVENT_AMOUNTS.get(log.event, ()):
+            token = Web3.toChecksumAddress(log.args[token_arg])
+            if token not in pool["balances"]:
+                continue
+
+            balance = pool["balances"][token] + sign * log.args[amount_arg]
+            if balance < 0:
+                logger.warning(
+                    f"pool {address} reserves drifted, balance of {token} is "
+                    f"{balance} after block {log.blockNumber}."
+                )
+                del self._pools[address]
+                return
+
+            pool["balances"][token] = balance
+
+    def get_snapshots(self, pools_tokens):
+        """Return the snapshots of the pools, see `get_pools_snapshots`. The pools
+        that are not known yet are read at the last applied block and added. Those
+        that cannot be read at this block, e.g. during a catch-up, are read at the
+        latest block and added by a later call.
+
+        :param pools_tokens: dict of pool address -> list of token addresses
+        """
+        pools_tokens = {
+            Web3.toChecksumAddress(pool): [Web3.toChecksumAddress(t) for t in tokens]
+            for pool, tokens in pools_tokens.items()
+        }
+        with self._lock:
+            missing = {
+                pool: tokens
+                for pool, tokens in pools_tokens.items()
+                if pool not in self._pools
+                or any(t not in self._pools[pool]["balances"] for t in tokens)
+            }
+            block = self.block
+
+        fetched = dict()
+        if missing:
+            if block is not None and self._has_state(block):
+                try:
+                    fetched = get_pools_snapshots(self._web3, missing, block)
+                except Exception as e:
+                    logger.warning(
+                        f"reading {len(missing)} pools at block {block} failed: {e}"
+                    )
+            with self._lock:
+                # the snapshots are only valid if no block was applied meanwhile
+                if block is not None and block == self.block:
+                    for pool, snapshot in fetched.items():
+                        self._pools[pool] = dict(snapshot, block=block)
+
+            untracked = {p: t for p, t in missing.items() if p not in fetched}
+            if untracked:
+                fetched.update(get_pools_snapshots(self._web3, untracked, "latest"))
+
+        with self._lock:
+            snapshots = {
+                pool: _copy_snapshot(self._pools[pool])
+                for pool in pools_tokens
+                if pool in self._pools
+            }
+        for pool in missing:
+            if pool not in snapshots and pool in fetched:
+                snapshots[pool] = _copy_snapshot(fetched[pool])
+
+        return snapshots
+
+    def reconcile(self, force=False):
+        """Read all the pools again at the last applied block, every
+        `reconcile_interval` seconds or now if `force` is set.
+
+        :return: the addresses of the pools whose balances had drifted
+        """
+        if self.block is None or not self._pools:
+            return []
+        if (
+            not force
+            and time.time() - self._last_reconcile_time < self._reconcile_interval
+        ):
+            return []
+        if not self._has_state(self.block):
+            logger.debug(f"the state of block {self.block} is not available yet.")
+            return []
+
+        with self._lock:
+            block = self.block
+            pools_tokens = {
+                pool: list(state["balances"].keys())
+                for pool, state in self._pools.items()
+            }
+
+        fetched = get_pools_snapshots(self._web3, pools_tokens, block)
+        drifted = []
+        with self._lock:
+            if block != self.block:
+                return []
+
+            for pool, snapshot in fetched.items():
+                state = self._pools.get(pool)
+                if state is not None and (
+                    state["balances"] != snapshot["balances"]
+                    or state["weights"] != snapshot["weights"]
+                    or state["swapFee"] != snapshot["swapFee"]
+                ):
+                    logger.warning(
+                        f"pool {pool} reserves drifted: tracked {state['balances']}, "
+                        f"on chain {snapshot['balances']} at block {block}."
+                    )
+                    drifted.append(pool)
+                self._pools[pool] = dict(snapshot, block=block)
+
+        self._last_reconcile_time = time.time()
+        logger.info(
+            f"reconciled the reserves of {len(fetched)} pools at block {block}, "
+            f"{len(drifted)} had drifted."
+        )
+        return drifted
+
+    def _has_state(self, block):
+        """Whether the state of `block` is kept by a non-archive node."""
+        if not self._state_blocks:
+            return True
+
+        try:
+            return self._web3.eth.blockNumber - block <= self._state_blocks
+        except Exception as e:
+            logger.warning(f"reading the latest block number failed: {e}")
+            return False
+
+
+def _copy_snapshot(snapshot):
+    return {
+        "balances": dict(snapshot["balances"]),
+        "weights": dict(snapshot["weights"]),
+        "swapFee": snapshot["swapFee"],
+    }
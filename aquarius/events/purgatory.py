@@ -0,0 +1,234 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+import logging
+import os
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PURGATORY_LIST_URL = "https://raw.githubusercontent.com/oceanprotocol/list-purgatory/main/list-assets.json"
+
+# normalise `isInPurgatory` to a "true"/"false" string and drop the legacy
+# `purgatoryData`, documents that are already normalised are left untouched
+NORMALIZE_SCRIPT = """
+boolean changed = false;
+def flag = ctx._source.isInPurgatory;
+if (flag == null || flag instanceof Boolean) {
+    ctx._source.isInPurgatory = flag == true ? 'true' : 'false';
+    changed = true;
+}
+if (ctx._source.containsKey('purgatoryData')) {
+    ctx._source.remove('purgatoryData');
+    changed = true;
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+"""
+
+SET_FLAG_SCRIPT = """
+ctx._source.isInPurgatory = params.flag;
+ctx._source.remove('purgatoryData');
+"""
+
+
+class Purgatory:
+    """Apply the purgatory list to the assets of an Elasticsearch index.
+
+    Changes are applied with `update_by_query` requests, the queries only match
+    the documents whose `isInPurgatory` flag actually changes.
+    """
+
+    def __init__(self, es, index, batch_size=1000):
+        self._es = es
+        self._index = index
+        self._batch_size = batch_size
+
+    def normalize_assets(self):
+        """Make `isInPurgatory` a string in all assets and remove `purgatoryData`."""
+        return self._update_by_query(
+            {
+                "bool": {
+                    "should": [
+                        {"exists": {"field": "purgatoryData"}},
+                        {"bool": {"must_not": {"exists": {"field": "isInPurgatory"}}}},
+                        {"match": {"isInPurgatory": "true"}},
+                    ],
+                    "minimum_should_match": 1,
+                }
+            },
+            {"source": NORMALIZE_SCRIPT, "lang": "painless"},
+        )
+
+    def add(self, dids):
+        """Put the assets `dids` in purgatory, return the number of updated assets."""
+        updated = 0
+        for batch in self._batches(dids):
+            updated += self._set_flag(
+                {
+                    "bool": {
+                        "filter": {"ids": {"values": batch}},
+                        "must_not": {"match": {"isInPurgatory": "true"}},
+                    }
+                },
+                "true",
+            )
+        return updated
+
+    def remove(self, dids):
+        """Release the assets `dids` from purgatory, return the number of updated
+        assets."""
+        updated = 0
+        for batch in self._batches(dids):
+            updated += self._set_flag(
+                {
+                    "bool": {
+                        "filter": [
+                            {"ids": {"values": batch}},
+                            {"match": {"isInPurgatory": "true"}},
+                        ]
+                    }
+                },
+                "false",
+            )
+        return updated
+
+    def remove_all_except(self, dids):
+        """Release all the assets in purgatory that are not in `dids`."""
+        return self._set_flag(
+            {
+                "bool": {
+                    "filter": {"match": {"isInPurgatory": "true"}},
+                    "must_not": {"ids": {"values": list(dids)}},
+                }
+            },
+            "false",
+        )
+
+    def _batches(self, dids):
+        dids = sorted(dids)
+        for i in range(0, len(dids), self._batch_size):
+            yield dids[i : i + self._batch_size]
+
+    def _set_flag(self, query, flag):
+        return self._update_by_query(
+            query,
+            {"source": SET_FLAG_SCRIPT, "lang": "painless", "params": {"flag": flag}},
+        )
+
+    def _update_by_query(self, query, script):
+        result = self._es.update_by_query(
+            index=self._index,
+            body={"query": query, "script": script},
+            conflicts="proceed",
+            refresh=True,
+        )
+        if result.get("failures"):
+            logger.error(
+                f"purgatory update of {self._index} failed: {result['failures']}"
+            )
+
+        return result.get("updated", 0)
+
+
+class PurgatoryListFetcher:
+    """Download the reference purgatory list with conditional requests.
+
+    The `ETag` and `Last-Modified` headers of the last good response are sent back
+    with each request. The last good list is kept in `cache_file` (if set), so
+    a restart only downloads the list again if it changed.
+    """
+
+    def __init__(self, url=PURGATORY_LIST_URL, cache_file=None, timeout=30):
+        self._url = url
+        self._cache_file = cache_file
+        self._timeout = timeout
+        self._etag = None
+        self._last_modified = None
+        self._assets = None
+        self._returned = False
+        self._load_cache()
+
+    def fetch(self):
+        """Return the set of (did, reason) of the purgatory list, or None if the
+        list did not change since the last call or could not be downloaded."""
+        headers = dict()
+        if self._assets is not None:
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+
+        try:
+            response = requests.get(self._url, headers=headers, timeout=self._timeout)
+            if response.status_code == requests.codes.not_modified:
+                return self._result()
+
+            if response.status_code != requests.codes.ok:
+                logger.warning(
+                    f"fetching the purgatory list failed: status {response.status_code}"
+                )
+                return self._result()
+
+            assets = [
+                [a["did"], a["reason"]] for a in response.json() if a and "did" in a
+            ]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logger.warning(f"fetching the purgatory list failed: {e}")
+            return self._result()
+
+        self._etag = response.headers.get("ETag")
+        self._last_modified = response.headers.get("Last-Modified")
+        self._assets = assets
+        self._returned = False
+        self._save_cache()
+        return self._result()
+
+    def rearm(self):
+        """Return the last list again on the next `fetch`, e.g. after it could not
+        be applied."""
+        self._returned = False
+
+    def _result(self):
+        # the cached list is returned once, e.g. after a restart
+        if self._returned or self._assets is None:
+            return None
+
+        self._returned = True
+        return {(did, reason) for did, reason in self._assets}
+
+    def _load_cache(self):
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return
+
+        try:
+            with open(self._cache_file) as f:
+                cache = json.load(f)
+            self._assets = cache["assets"]
+            self._etag = cache.get("etag")
+            self._last_modified = cache.get("last_modified")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"reading purgatory cache {self._cache_file} failed: {e}")
+
+    def _save_cache(self):
+        if not self._cache_file:
+            return
+
+        try:
+            tmp_file = f"{self._cache_file}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(
+                    {
+                        "etag": self._etag,
+                        "last_modified": self._last_modified,
+                        "assets": self._assets,
+                    },
+                    f,
+                )
+            os.replace(tmp_file, self._cache_file)
+        except OSError as e:
+            logger.error(f"writing purgatory cache {self._cache_file} failed: {e}")
@@ -0,0 +1,91 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import json
+import logging
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class NewBlocksSubscription:
+    """Subscribe to the `newHeads` of a node over a websocket connection.
+
+    `on_new_block` is called with the number of each new block, in a worker thread
+    so the websocket keeps being served while it runs. `run` returns
+    when `is_running()` becomes False or `stop` is called, and raises when the
+    subscription drops, including when no block arrives for `timeout` seconds.
+    """
+
+    def __init__(self, ws_url, on_new_block, is_running, timeout=120):
+        self._ws_url = ws_url
+        self._on_new_block = on_new_block
+        self._is_running = is_running
+        self._timeout = timeout
+        self._loop = None
+        self._task = None
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        self._task = loop.create_task(self._listen())
+        if not self._is_running():
+            # stopped before the task could be cancelled by `stop`
+            self._task.cancel()
+        try:
+            loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            logger.info(f"unsubscribed from new blocks on {self._ws_url}.")
+        finally:
+            self._loop = None
+            loop.close()
+
+    def stop(self):
+        """Make `run` return now, from another thread, by cancelling the pending
+        receive."""
+        loop, task = self._loop, self._task
+        if loop is None or task is None:
+            return
+
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # the loop is already closed
+            pass
+
+    async def _listen(self):
+        ws = await websockets.connect(self._ws_url)
+        try:
+            await ws.send(
+                json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "id": 1,
+                        "method": "eth_subscribe",
+                        "params": ["newHeads"],
+                    }
+                )
+            )
+            response = json.loads(await asyncio.wait_for(ws.recv(), self._timeout))
+            if "error" in response:
+                raise ValueError(f"eth_subscribe failed: {response['error']}")
+
+            subscription_id = response["result"]
+            logger.info(f"subscribed to new blocks on {self._ws_url}.")
+            while self._is_running():
+                message = json.loads(await asyncio.wait_for(ws.recv(), self._timeout))
+                params = message.get("params", {})
+                if (
+                    message.get("method") != "eth_subscription"
+                    or params.get("subscription") != subscription_id
+                ):
+                    continue
+
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._on_new_block, int(params["result"]["number"], 16)
+                )
+        finally:
+            await ws.close()
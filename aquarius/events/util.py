@@ -3,22 +3,37 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 import json
+import logging
 import os
 import time
 from pathlib import Path
 
+from eth_abi import decode_single, encode_single
+from eth_utils import add_0x_prefix, function_signature_to_4byte_selector
 from ocean_lib.config import Config
 from ocean_lib.config_provider import ConfigProvider
 from ocean_lib.web3_internal.contract_handler import ContractHandler
 from ocean_lib.web3_internal.web3_provider import Web3Provider
-from ocean_lib.models.data_token import DataToken
 from ocean_lib.models.fixed_rate_exchange import FixedRateExchange
 from ocean_lib.models.metadata import MetadataContract
 from ocean_lib.ocean.util import get_contracts_addresses, from_base_18
 from ocean_lib.web3_internal.web3helper import Web3Helper
-from web3 import Web3
+from web3 import HTTPProvider, Web3
 
 from aquarius.app.util import get_bool_env_value
+from aquarius.events.http_provider import CustomHTTPProvider
+
+logger = logging.getLogger(__name__)
+
+# field, function signature and output type of the datatoken info calls
+DATATOKEN_INFO_CALLS = (
+    ("name", "name()", "string"),
+    ("symbol", "symbol()", "string"),
+    ("decimals", "decimals()", "uint8"),
+    ("totalSupply", "totalSupply()", "uint256"),
+    ("cap", "cap()", "uint256"),
+    ("minter", "minter()", "address"),
+)
 
 
 def get_network_name():
@@ -141,21 +156,188 @@ def get_exchange_contract(web3):
     return web3.eth.contract(address=contract_address, abi=abi_json["abi"])
 
 
-def get_datatoken_info(token_address):
-    token_address = Web3.toChecksumAddress(token_address)
-    dt = DataToken(token_address)
-    contract = dt.contract_concise
-    minter = contract.minter()
-    return {
-        "address": token_address,
-        "name": contract.name(),
-        "symbol": contract.symbol(),
-        "decimals": contract.decimals(),
-        "totalSupply": from_base_18(contract.totalSupply()),
-        "cap": from_base_18(contract.cap()),
-        "minter": minter,
-        "minterBalance": dt.token_balance(minter),
-    }
+def make_batch_rpc_request(web3, calls):
+    """Send a list of `(method, params)` JSON-RPC calls, as batch requests when
+    the provider supports it.
+
+    The responses (dicts with either `result` or `error`) are returned in the same
+    order as `calls`. Batched calls do not go through the web3 middlewares, so
+    their results are not formatted, e.g. quantities are hex strings.
+    """
+    provider = web3.providers[0]
+    if hasattr(provider, "make_batch_request"):
+        return provider.make_batch_request(calls)
+
+    responses = []
+    for method, params in calls:
+        try:
+            responses.append({"result": web3.manager.request_blocking(method, params)})
+        except Exception as e:
+            responses.append({"error": {"message": str(e)}})
+
+    return responses
+
+
+def eth_call_request(contract_address, signature, encoded_args=b"", block="latest"):
+    """Return the `(method, params)` of an `eth_call` of `signature` on `block`
+    (the latest one by default), e.g. for `make_batch_rpc_request`."""
+    data = function_signature_to_4byte_selector(signature) + encoded_args
+    return "eth_call", [
+        {"to": contract_address, "data": add_0x_prefix(data.hex())},
+        hex(block) if isinstance(block, int) else block,
+    ]
+
+
+def decode_eth_call_response(response, output_type):
+    """Return the decoded result of a batched `eth_call`, raise `ValueError` if the
+    call failed."""
+    result = response.get("result")
+    if isinstance(result, str):
+        result = bytes.fromhex(result[2:] if result.startswith("0x") else result)
+    if "error" in response or not result:
+        raise ValueError(f"eth_call failed: {response.get('error')}")
+
+    return decode_single(output_type, bytes(result))
+
+
+def get_datatokens_info(web3, token_addresses, fields=None):
+    """Read the address, name, symbol, decimals, totalSupply, cap, minter and
+    minterBalance of many datatokens.
+
+    All the calls are sent with `make_batch_rpc_request`, the minter balances in a
+    second batch. A field whose call fails is set to None without affecting the
+    other fields or tokens. `fields` optionally restricts the fields that are read.
+
+    :return: dict of checksum token address -> datatoken info
+    """
+    read_balance = fields is None or "minterBalance" in fields
+    calls = [
+        call
+        for call in DATATOKEN_INFO_CALLS
+        if fields is None or call[0] in fields or (call[0] == "minter" and read_balance)
+    ]
+    addresses = [Web3.toChecksumAddress(a) for a in token_addresses]
+    responses = make_batch_rpc_request(
+        web3,
+        [
+            eth_call_request(address, signature)
+            for address in addresses
+            for _, signature, _ in calls
+        ],
+    )
+    infos = dict()
+    for i, address in enumerate(addresses):
+        info = {"address": address}
+        for j, (field, _, output_type) in enumerate(calls):
+            try:
+                info[field] = decode_eth_call_response(
+                    responses[i * len(calls) + j], output_type
+                )
+            except Exception as e:
+                logger.warning(f"reading {field} of datatoken {address} failed: {e}")
+                info[field] = None
+
+        for field in ("totalSupply", "cap"):
+            if info.get(field) is not None:
+                info[field] = from_base_18(info[field])
+        if info.get("minter") is not None:
+            info["minter"] = Web3.toChecksumAddress(info["minter"])
+        if read_balance:
+            info["minterBalance"] = None
+        infos[address] = info
+
+    with_minter = [info for info in infos.values() if read_balance and info["minter"]]
+    responses = make_batch_rpc_request(
+        web3,
+        [
+            eth_call_request(
+                info["address"],
+                "balanceOf(address)",
+                encode_single("address", info["minter"]),
+            )
+            for info in with_minter
+        ],
+    )
+    for info, response in zip(with_minter, responses):
+        try:
+            info["minterBalance"] = from_base_18(
+                decode_eth_call_response(response, "uint256")
+            )
+        except Exception as e:
+            logger.warning(
+                f"reading the minter balance of datatoken {info['address']} failed: {e}"
+            )
+
+    return infos
+
+
+def get_pools_snapshots(web3, pools_tokens, block="latest"):
+    """Read the balances and weights of some tokens and the swap fee of many pools
+    at `block` in one batch of `eth_call`s.
+
+    :param pools_tokens: dict of pool address -> list of token addresses
+    :return: dict of pool address -> {"balances": {token: int}, "weights":
+        {token: int}, "swapFee": int}, the values in base 18, without the pools for
+        which a call failed.
+    """
+    calls = []
+    for pool, tokens in pools_tokens.items():
+        for token in tokens:
+            encoded_token = encode_single("address", Web3.toChecksumAddress(token))
+            calls.append(
+                eth_call_request(pool, "getBalance(address)", encoded_token, block)
+            )
+            calls.append(
+                eth_call_request(
+                    pool, "getDenormalizedWeight(address)", encoded_token, block
+                )
+            )
+        calls.append(eth_call_request(pool, "getSwapFee()", b"", block))
+
+    responses = iter(make_batch_rpc_request(web3, calls))
+    snapshots = dict()
+    for pool, tokens in pools_tokens.items():
+        snapshot = {"balances": dict(), "weights": dict()}
+        failed = False
+        for token in tokens:
+            for key in ("balances", "weights"):
+                try:
+                    snapshot[key][token] = decode_eth_call_response(
+                        next(responses), "uint256"
+                    )
+                except Exception as e:
+                    logger.warning(f"reading {key} of pool {pool} failed: {e}")
+                    failed = True
+        try:
+            snapshot["swapFee"] = decode_eth_call_response(next(responses), "uint256")
+        except Exception as e:
+            logger.warning(f"reading the swap fee of pool {pool} failed: {e}")
+            failed = True
+
+        if not failed:
+            snapshots[pool] = snapshot
+
+    return snapshots
+
+
+def get_blocks_timestamps(web3, block_numbers):
+    """Return a dict of block number -> block timestamp, reading all the block
+    headers in one batch."""
+    block_numbers = list(block_numbers)
+    responses = make_batch_rpc_request(
+        web3, [("eth_getBlockByNumber", [hex(block), False]) for block in block_numbers]
+    )
+    timestamps = dict()
+    for block, response in zip(block_numbers, responses):
+        if response.get("result"):
+            timestamp = response["result"]["timestamp"]
+            timestamps[block] = (
+                int(timestamp, 16) if isinstance(timestamp, str) else timestamp
+            )
+        else:
+            timestamps[block] = web3.eth.getBlock(block)["timestamp"]
+
+    return timestamps
 
 
 def setup_web3(config_file, _logger=None):
@@ -169,7 +351,11 @@ def setup_web3(config_file, _logger=None):
             f"EventsMonitor: starting with the following values: rpc={network_rpc}"
         )
 
-    Web3Provider.init_web3(provider=get_web3_connection_provider(network_rpc))
+    provider = get_web3_connection_provider(network_rpc)
+    if isinstance(provider, HTTPProvider):
+        provider = CustomHTTPProvider(provider.endpoint_uri)
+
+    Web3Provider.init_web3(provider=provider)
     ContractHandler.set_artifacts_path(get_artifacts_path())
     if (
         get_bool_env_value("USE_POA_MIDDLEWARE", 0)
@@ -0,0 +1,48 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+import os
+import time
+
+from aquarius.app.util import get_bool_env_value, get_int_env_value
+from aquarius.events.backfill import Backfill
+from aquarius.events.events_monitor import EventsMonitor
+from aquarius.events.util import setup_web3
+from aquarius.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def run_backfill():
+    setup_logging()
+    logger.info("Backfill: preparing")
+    required_env_vars = ["EVENTS_RPC", "CONFIG_FILE"]
+    for envvar in required_env_vars:
+        if not os.getenv(envvar):
+            raise AssertionError(
+                f"env var {envvar} is missing, make sure to set the following "
+                f"environment variables before starting the backfill: {required_env_vars}"
+            )
+
+    config_file = os.getenv("CONFIG_FILE", "config.ini")
+    monitor = EventsMonitor(setup_web3(config_file, logger), config_file)
+    Backfill(
+        monitor,
+        config_file,
+        workers=get_int_env_value("BACKFILL_WORKERS", os.cpu_count() or 1, min_value=1),
+        shard_size=get_int_env_value("BACKFILL_SHARD_SIZE", 100000, min_value=1),
+    ).run()
+
+    if get_bool_env_value("BACKFILL_ONLY", 0):
+        return
+
+    monitor.start_events_monitor()
+    logger.info("EventsMonitor: started")
+    while True:
+        time.sleep(5)
+
+
+if __name__ == "__main__":
+    run_backfill()
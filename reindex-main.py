@@ -0,0 +1,42 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import logging
+import os
+
+from aquarius.app.util import get_int_env_value
+from aquarius.events.events_monitor import EventsMonitor
+from aquarius.events.journal import EventJournal, replay_journal
+from aquarius.events.util import setup_web3
+from aquarius.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def run_reindex():
+    setup_logging()
+    logger.info("Reindex: preparing")
+    required_env_vars = ["EVENTS_JOURNAL_DIR", "CONFIG_FILE"]
+    for envvar in required_env_vars:
+        if not os.getenv(envvar):
+            raise AssertionError(
+                f"env var {envvar} is missing, make sure to set the following "
+                f"environment variables before starting the reindex: {required_env_vars}"
+            )
+
+    config_file = os.getenv("CONFIG_FILE", "config.ini")
+    journal = EventJournal(os.getenv("EVENTS_JOURNAL_DIR"))
+    # the journal is only read, not written again while replaying it
+    os.environ.pop("EVENTS_JOURNAL_DIR")
+    monitor = EventsMonitor(setup_web3(config_file, logger), config_file)
+    from_block = get_int_env_value("REINDEX_FROM_BLOCK", 0)
+    # a full replay rebuilds the index, a partial one is applied on top of it
+    last_block = replay_journal(
+        monitor, journal, from_block=from_block, recreate_index=from_block == 0
+    )
+    logger.info(f"Reindex: done up to block {last_block}")
+
+
+if __name__ == "__main__":
+    run_reindex()
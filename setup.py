@@ -6,6 +6,7 @@
 #
 
 """The setup script."""
+
 #  Copyright 2018 Ocean Protocol Foundation
 #  SPDX-License-Identifier: Apache-2.0
 
@@ -34,6 +35,9 @@ install_requirements = [
     "plecos==1.1.0",
     "ocean-lib==0.5.12",
     "eciespy",
+    "lru-dict>=1.1.6,<2.0.0",
+    "numpy>=1.19.0,<2",
+    "websockets>=6.0.0,<7.0.0",
     "gevent",
 ]
 
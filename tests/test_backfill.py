@@ -0,0 +1,213 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from aquarius.events import backfill, bulk_writer
+from aquarius.events.backfill import Backfill, BackfillError, split_block_range
+from aquarius.events.bulk_writer import BulkWriter
+from aquarius.events.constants import EVENT_METADATA_CREATED, EVENT_METADATA_UPDATED
+from aquarius.events.events_monitor import EventsMonitor
+
+
+def test_split_block_range():
+    assert split_block_range(0, 9, 5) == [(0, 4), (5, 9)]
+    assert split_block_range(10, 22, 5) == [(10, 14), (15, 19), (20, 22)]
+    assert split_block_range(7, 7, 100) == [(7, 7)]
+
+
+def _event(name, dt, block):
+    return AttributeDict(
+        {
+            "event": name,
+            "blockNumber": block,
+            "logIndex": 0,
+            "transactionHash": HexBytes(bytes([block]) * 32),
+            "args": AttributeDict({"dataToken": dt}),
+        }
+    )
+
+
+CHAIN = [
+    _event(EVENT_METADATA_CREATED, "0xa", 1),
+    _event(EVENT_METADATA_UPDATED, "0xa", 5),
+    _event(EVENT_METADATA_CREATED, "0xb", 12),
+    _event(EVENT_METADATA_UPDATED, "0xa", 15),
+    _event(EVENT_METADATA_UPDATED, "0xa", 22),
+    _event(EVENT_METADATA_UPDATED, "0xb", 25),
+]
+
+
+def fake_fetch_shard(from_block, to_block, contract_address, event_abis, decode_args):
+    events = [e for e in CHAIN if from_block <= e.blockNumber <= to_block]
+    decoded = {
+        (e.blockNumber, e.logIndex): (
+            {"id": e.args.dataToken, "block": e.blockNumber},
+            None,
+        )
+        for e in events
+    }
+    return events, decoded, {e.blockNumber: 1000 + e.blockNumber for e in events}
+
+
+class InlineExecutor:
+    """Run the submitted shards in the test process."""
+
+    def __init__(self, max_workers, initializer, initargs):
+        self.submitted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[:2])
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class FakeIndices:
+    def __init__(self):
+        self.settings = []
+
+    def get_settings(self, index):
+        return {index: {"settings": {"index": {"refresh_interval": "1s"}}}}
+
+    def put_settings(self, index, body):
+        self.settings.append(body["index"]["refresh_interval"])
+
+    def refresh(self, index):
+        pass
+
+
+class RecordingJournal:
+    def __init__(self):
+        self.appended = []
+
+    def append(self, events, timestamps, from_block=None):
+        self.appended.append((from_block, [e.blockNumber for e in events]))
+
+
+class DtInfoCache:
+    def __init__(self):
+        self.batches = []
+
+    def get_many(self, addresses):
+        self.batches.append(sorted(addresses))
+
+
+class Monitor:
+    process_block_range_events = EventsMonitor.process_block_range_events
+    prefetch_datatokens_info = EventsMonitor.prefetch_datatokens_info
+    _append_to_journal = EventsMonitor._append_to_journal
+    coalesce_updates = staticmethod(EventsMonitor.coalesce_updates)
+    apply_latest_update = EventsMonitor.apply_latest_update
+
+    def __init__(self):
+        es = SimpleNamespace(indices=FakeIndices())
+        self._oceandb = SimpleNamespace(
+            driver=SimpleNamespace(es=es, db_index="aquarius")
+        )
+        self._bulk_writer = BulkWriter(es, "aquarius")
+        self._block_timestamps = dict()
+        self._only_encrypted_ddo = False
+        self._max_ddo_size = 1000
+        self._ecies_private_key = ""
+        self._contract_address = "0x0"
+        self._event_abis = dict()
+        self._journal = RecordingJournal()
+        self._dt_info_cache = DtInfoCache()
+        self.checkpoints = []
+
+    def get_checkpoint(self):
+        return {"last_block": 0, "cursors": {}}
+
+    def get_confirmed_block(self):
+        return 29
+
+    def get_block_hash(self, block):
+        return hex(block)
+
+    def is_publisher_allowed(self, publisher_address):
+        return True
+
+    def store_last_processed_block(self, block, block_hash, cursors):
+        self.checkpoints.append((block, dict(cursors)))
+
+    def processNewDDO(self, event, decoded=None):
+        self._bulk_writer.index(event.args.dataToken, decoded[0])
+        return True
+
+    processUpdateDDO = processNewDDO
+
+
+def _fake_bulk(saved, fail=False):
+    def streaming_bulk(es, actions, **kwargs):
+        for action in actions:
+            if fail:
+                yield False, {"index": {"_id": action["_id"], "status": 503}}
+                continue
+            saved[action["_id"]] = action["_source"]
+            yield True, {"index": {"_id": action["_id"], "status": 201}}
+
+    return streaming_bulk
+
+
+def test_backfill_run(monkeypatch):
+    executors = []
+
+    def executor(**kwargs):
+        executors.append(InlineExecutor(**kwargs))
+        return executors[-1]
+
+    saved = dict()
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", executor)
+    monkeypatch.setattr(backfill, "fetch_shard", fake_fetch_shard)
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", _fake_bulk(saved))
+
+    monitor = Monitor()
+    monitor_writer = monitor._bulk_writer
+    assert Backfill(monitor, "config.ini", workers=1, shard_size=10).run() == 29
+    assert executors[0].submitted == [(0, 9), (10, 19), (20, 29)]
+
+    # the shards are applied in order, the last event of each did wins
+    assert saved == {
+        "0xa": {"id": "0xa", "block": 22},
+        "0xb": {"id": "0xb", "block": 25},
+    }
+    # checkpointed after each shard, with the cursors of its last events
+    assert monitor.checkpoints == [
+        (9, {EVENT_METADATA_CREATED: [1, 0], EVENT_METADATA_UPDATED: [5, 0]}),
+        (19, {EVENT_METADATA_CREATED: [12, 0], EVENT_METADATA_UPDATED: [15, 0]}),
+        (29, {EVENT_METADATA_CREATED: [12, 0], EVENT_METADATA_UPDATED: [25, 0]}),
+    ]
+    assert monitor._block_timestamps[22] == 1022
+    # the datatoken info is read in one batch per shard
+    assert monitor._dt_info_cache.batches == [["0xa"], ["0xa", "0xb"], ["0xa", "0xb"]]
+    # the applied events are journaled, so the catalog can be reindexed
+    assert monitor._journal.appended == [(0, [1, 5]), (10, [12, 15]), (20, [22, 25])]
+    assert monitor._bulk_writer is monitor_writer
+    assert monitor._oceandb.driver.es.indices.settings == ["-1", "1s"]
+
+
+def test_backfill_failed_flush(monkeypatch):
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr(backfill, "fetch_shard", fake_fetch_shard)
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", _fake_bulk(dict(), fail=True))
+    monkeypatch.setattr(bulk_writer.time, "sleep", lambda seconds: None)
+
+    monitor = Monitor()
+    with pytest.raises(BackfillError):
+        Backfill(monitor, "config.ini", workers=1, shard_size=10).run()
+
+    assert monitor.checkpoints == []
+    assert monitor._oceandb.driver.es.indices.settings == ["-1", "1s"]
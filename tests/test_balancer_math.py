@@ -0,0 +1,88 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+import os
+import random
+
+import pytest
+
+from aquarius.events.balancer_math import BONE, calc_in_given_out, calc_spot_price
+from aquarius.events.util import deploy_contract, get_artifacts_path
+from tests.helpers import get_web3, test_account1
+
+
+def _random_cases(n):
+    rng = random.Random(7)
+    cases = []
+    for _ in range(n):
+        ocn_balance = rng.randint(BONE, 10**6 * BONE)
+        dt_balance = rng.randint(3 * BONE, 10**4 * BONE)
+        ocn_weight = rng.randint(BONE, 9 * BONE)
+        dt_weight = rng.randint(BONE, 9 * BONE)
+        swap_fee = rng.randint(BONE // 10**6, BONE // 10)
+        cases.append((ocn_balance, ocn_weight, dt_balance, dt_weight, swap_fee))
+
+    return cases
+
+
+def test_balancer_math():
+    ocn_balance, ocn_weight, dt_balance, dt_weight = 1000, 7, 100, 3
+    swap_fee = 0.001
+    spot_price = calc_spot_price(
+        ocn_balance * BONE,
+        ocn_weight * BONE,
+        dt_balance * BONE,
+        dt_weight * BONE,
+        int(swap_fee * BONE),
+    )
+    expected = (ocn_balance / ocn_weight) / (dt_balance / dt_weight) / (1 - swap_fee)
+    assert abs(spot_price / BONE - expected) < 1e-12
+
+    amount_in = calc_in_given_out(
+        ocn_balance * BONE,
+        ocn_weight * BONE,
+        dt_balance * BONE,
+        dt_weight * BONE,
+        BONE,
+        int(swap_fee * BONE),
+    )
+    expected = (
+        ocn_balance
+        * ((dt_balance / (dt_balance - 1)) ** (dt_weight / ocn_weight) - 1)
+        / (1 - swap_fee)
+    )
+    assert abs(amount_in / BONE - expected) < 1e-9
+
+    # the pool contract reverts in these cases
+    with pytest.raises(ValueError):
+        calc_in_given_out(BONE, BONE, BONE // 2, BONE, BONE, 0)
+    with pytest.raises(ValueError):
+        calc_in_given_out(BONE, BONE, 3 * BONE // 2, BONE, BONE, 0)
+    with pytest.raises(ValueError):
+        calc_spot_price(BONE, BONE, 0, BONE, 0)
+
+
+def test_balancer_math_matches_pool_contract(events_object):
+    web3 = get_web3()
+    with open(os.path.join(get_artifacts_path(), "BPool.json")) as f:
+        bpool_json = json.load(f)
+    address = deploy_contract(web3, bpool_json, test_account1.privateKey)
+    bpool = web3.eth.contract(address=address, abi=bpool_json["abi"])
+
+    for ocn_balance, ocn_weight, dt_balance, dt_weight, swap_fee in _random_cases(20):
+        assert (
+            calc_spot_price(ocn_balance, ocn_weight, dt_balance, dt_weight, swap_fee)
+            == bpool.functions.calcSpotPrice(
+                ocn_balance, ocn_weight, dt_balance, dt_weight, swap_fee
+            ).call()
+        )
+        assert (
+            calc_in_given_out(
+                ocn_balance, ocn_weight, dt_balance, dt_weight, BONE, swap_fee
+            )
+            == bpool.functions.calcInGivenOut(
+                ocn_balance, ocn_weight, dt_balance, dt_weight, BONE, swap_fee
+            ).call()
+        )
@@ -0,0 +1,83 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+from types import SimpleNamespace
+
+import elasticsearch
+import pytest
+
+from aquarius.block_utils import BlockProcessingClass
+
+
+class FakeES:
+    def __init__(self):
+        self.docs = dict()
+
+    def get(self, index, id, doc_type):
+        if (index, id) not in self.docs:
+            raise elasticsearch.exceptions.NotFoundError(404, "not found", {})
+        return {"_id": id, "_source": json.loads(self.docs[(index, id)])}
+
+    def index(self, index, id, body, doc_type):
+        self.docs[(index, id)] = json.dumps(body)
+        return {"_id": id}
+
+
+class Processor(BlockProcessingClass):
+    def __init__(self, es):
+        self._oceandb = SimpleNamespace(driver=SimpleNamespace(es=es))
+        self._other_db_index = "aquarius_plus"
+
+    @property
+    def checkpoint_id(self):
+        return "test_last_block"
+
+
+def test_checkpoint_round_trip(monkeypatch):
+    monkeypatch.delenv("CHECKPOINTS_DIR", raising=False)
+    es = FakeES()
+    processor = Processor(es)
+    with pytest.raises(elasticsearch.exceptions.NotFoundError):
+        processor.get_checkpoint()
+
+    cursors = {"MetadataCreated": [10, 2], "MetadataUpdated": [9, 0]}
+    processor.store_last_processed_block(10, "0x0a", cursors)
+    processor.store_last_processed_block(12, "0x0c", cursors)
+
+    # a new processor reads everything back from the index
+    processor = Processor(es)
+    checkpoint = processor.get_checkpoint()
+    assert checkpoint["last_block"] == 12
+    assert checkpoint["block_hash"] == "0x0c"
+    assert checkpoint["cursors"] == cursors
+    assert processor._recent_hashes == [[10, "0x0a"], [12, "0x0c"]]
+    assert processor.get_last_processed_block() == 12
+
+    # going back drops the hashes of the newer blocks
+    processor.store_last_processed_block(11)
+    checkpoint = Processor(es).get_checkpoint()
+    assert checkpoint["last_block"] == 11
+    assert checkpoint["cursors"] == {}
+    assert checkpoint["recent_hashes"] == [[10, "0x0a"]]
+
+
+def test_checkpoint_file(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHECKPOINTS_DIR", str(tmp_path))
+    es = FakeES()
+    processor = Processor(es)
+    processor.store_last_processed_block(20, "0x14", {"MetadataCreated": [20, 1]})
+    checkpoint_file = tmp_path / "aquarius_plus.test_last_block.json"
+    assert json.loads(checkpoint_file.read_text())["last_block"] == 20
+
+    # the newest of the file and the index checkpoints is used
+    es.index("aquarius_plus", "test_last_block", {"last_block": 15}, "_doc")
+    assert Processor(es).get_checkpoint()["cursors"] == {"MetadataCreated": [20, 1]}
+    es.index("aquarius_plus", "test_last_block", {"last_block": 25}, "_doc")
+    assert Processor(es).get_last_processed_block() == 25
+
+    # either one is enough
+    assert Processor(FakeES()).get_last_processed_block() == 20
+    checkpoint_file.write_text("{not json")
+    assert Processor(es).get_last_processed_block() == 25
@@ -0,0 +1,86 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import random
+
+from aquarius.events.balancer_math import BONE, calc_in_given_out, calc_spot_price
+from aquarius.events.bulk_pricing import select_pools_prices
+
+PRICE_TOO_LARGE = 1000000000
+
+
+def _exact_prices(pools):
+    """Cheapest pool of each datatoken and its price, with the pool contract math."""
+    selected = dict()
+    for i, (group, ocn_balance, ocn_weight, dt_balance, dt_weight, fee) in enumerate(
+        pools
+    ):
+        try:
+            spot_price = (
+                calc_spot_price(ocn_balance, ocn_weight, dt_balance, dt_weight, fee)
+                / BONE
+            )
+        except ValueError:
+            continue
+        if spot_price <= 0 or spot_price > PRICE_TOO_LARGE:
+            continue
+        if group in selected and selected[group][0] <= spot_price:
+            continue
+
+        try:
+            price = (
+                calc_in_given_out(
+                    ocn_balance, ocn_weight, dt_balance, dt_weight, BONE, fee
+                )
+                / BONE
+            )
+        except ValueError:
+            price = 0.0
+        if dt_balance <= BONE or price > PRICE_TOO_LARGE:
+            price = 0.0
+        selected[group] = (spot_price, i, price)
+
+    return selected
+
+
+def test_select_pools_prices():
+    rng = random.Random(3)
+    pools = [
+        (
+            rng.randrange(30),
+            rng.randint(BONE, 10**6 * BONE),
+            rng.randint(BONE, 9 * BONE),
+            rng.randint(BONE // 2, 10**4 * BONE),
+            rng.randint(BONE, 9 * BONE),
+            rng.randint(BONE // 10**6, BONE // 10),
+        )
+        for _ in range(200)
+    ]
+    # a pool without datatokens and a pool too expensive are never selected
+    pools.append((30, BONE, BONE, 0, BONE, 0))
+    pools.append((30, 10**10 * BONE, BONE, BONE, BONE, 0))
+
+    groups, *values = zip(*pools)
+    selected = select_pools_prices(
+        groups, *[[v / BONE for v in column] for column in values], PRICE_TOO_LARGE
+    )
+    expected = _exact_prices(pools)
+    assert set(selected.keys()) == set(expected.keys()) == set(range(30))
+    for group, (_, i, price) in expected.items():
+        dt_reserve, ocn_reserve, selected_price, selected_i = selected[group]
+        assert selected_i == i
+        assert dt_reserve == pools[i][3] / BONE
+        assert ocn_reserve == pools[i][1] / BONE
+        assert abs(selected_price - price) <= 1e-9 * max(price, 1.0)
+
+
+def test_select_pools_prices_rules():
+    # two identical pools: the first one wins, one pool with 1 datatoken left
+    selected = select_pools_prices(
+        [0, 0, 1], [100, 100, 100], [1, 1, 1], [50, 50, 1], [1, 1, 1], [0, 0, 0], 1e9
+    )
+    assert selected[0][3] == 0
+    assert selected[0][2] > 0
+    assert selected[1] == (1.0, 100.0, 0.0, 2)
+    assert select_pools_prices([], [], [], [], [], [], 1e9) == {}
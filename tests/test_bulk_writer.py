@@ -0,0 +1,125 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from aquarius.events import bulk_writer
+from aquarius.events.bulk_writer import BulkWriter
+
+
+def test_bulk_writer_partial_updates():
+    writer = BulkWriter(None, "aquarius")
+    writer.update("did:op:1", {"price": {"value": 1.0}})
+    writer.update("did:op:1", {"dataTokenInfo": {"name": "DT1"}})
+    assert len(writer) == 1
+    action = writer._actions["did:op:1"]
+    assert action["_op_type"] == "update"
+    assert action["doc"] == {"price": {"value": 1.0}, "dataTokenInfo": {"name": "DT1"}}
+    # partial updates are not readable as documents
+    assert writer.get("did:op:1") is None
+
+    # a partial update of a pending document is merged in it
+    writer.index("did:op:2", {"id": "did:op:2", "price": {}})
+    writer.update("did:op:2", {"price": {"value": 2.0}})
+    assert writer.get("did:op:2") == {"id": "did:op:2", "price": {"value": 2.0}}
+
+    # like in Elasticsearch, objects are merged field by field
+    writer.update("did:op:1", {"dataTokenInfo": {"cap": 1000}})
+    assert writer._actions["did:op:1"]["doc"]["dataTokenInfo"] == {
+        "name": "DT1",
+        "cap": 1000,
+    }
+    writer.index("did:op:3", {"id": "did:op:3", "dataTokenInfo": {"name": "DT3"}})
+    writer.update("did:op:3", {"dataTokenInfo": {"totalSupply": 5}})
+    assert writer.get("did:op:3")["dataTokenInfo"] == {
+        "name": "DT3",
+        "totalSupply": 5,
+    }
+
+
+class FakeBulk:
+    """Replace `streaming_bulk`, fail each document with the statuses of
+    `statuses[doc_id]` in turn and succeed once they are used up."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+
+    def __call__(self, es, actions, **kwargs):
+        actions = list(actions)
+        self.requests.append([action["_id"] for action in actions])
+        for action in actions:
+            doc_id = action["_id"]
+            status = self.statuses.get(doc_id, [])
+            if not status:
+                yield True, {action["_op_type"]: {"_id": doc_id, "status": 200}}
+                continue
+
+            status = status.pop(0)
+            if isinstance(status, Exception):
+                raise status
+            yield False, {
+                action["_op_type"]: {
+                    "_id": doc_id,
+                    "status": status,
+                    "error": {"type": "error"},
+                }
+            }
+
+
+def test_bulk_writer_retries(monkeypatch):
+    fake_bulk = FakeBulk({"did:op:1": [429, 503], "did:op:2": [400]})
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", fake_bulk)
+    monkeypatch.setattr(bulk_writer.time, "sleep", lambda seconds: None)
+
+    writer = BulkWriter(None, "aquarius", max_retries=3)
+    for i in range(3):
+        writer.index(f"did:op:{i}", {"id": f"did:op:{i}"})
+
+    # the rejected document is dropped, the throttled one is sent until it is saved
+    assert writer.flush()
+    assert fake_bulk.requests == [
+        ["did:op:0", "did:op:1", "did:op:2"],
+        ["did:op:1"],
+        ["did:op:1"],
+    ]
+    assert len(writer) == 0
+
+
+def test_bulk_writer_delete(monkeypatch):
+    fake_bulk = FakeBulk({})
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", fake_bulk)
+
+    writer = BulkWriter(None, "aquarius")
+    writer.index("did:op:1", {"id": "did:op:1"})
+    # only the last operation of a document is sent
+    writer.delete("did:op:1")
+    assert writer.get("did:op:1") is None
+    assert writer._actions["did:op:1"]["_op_type"] == "delete"
+    # an update of a deleted document does not replace the delete
+    writer.update("did:op:1", {"price": {"value": 1.0}})
+    assert writer._actions["did:op:1"]["_op_type"] == "delete"
+    assert writer.flush()
+    assert fake_bulk.requests == [["did:op:1"]]
+
+
+def test_bulk_writer_failed_flush(monkeypatch):
+    fake_bulk = FakeBulk(
+        {"did:op:1": [500, 502, 504, 503], "did:op:2": [ConnectionError("down")]}
+    )
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", fake_bulk)
+    monkeypatch.setattr(bulk_writer.time, "sleep", lambda seconds: None)
+
+    writer = BulkWriter(None, "aquarius", max_retries=3)
+    writer.index("did:op:1", {"id": "did:op:1"})
+    writer.index("did:op:2", {"id": "did:op:2"})
+
+    # a request that raised is sent again in full
+    assert not writer.flush()
+    assert fake_bulk.requests[:2] == [["did:op:1", "did:op:2"]] * 2
+    assert len(fake_bulk.requests) == 4
+    # the documents that failed are kept for the next flush, and still readable
+    assert len(writer) == 1
+    assert writer.get("did:op:1") == {"id": "did:op:1"}
+
+    assert writer.flush()
+    assert len(writer) == 0
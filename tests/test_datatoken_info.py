@@ -0,0 +1,141 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from eth_abi import encode_single
+from eth_utils import function_signature_to_4byte_selector
+
+from aquarius.events.datatoken_info import TRANSFER_TOPIC, DatatokenInfoCache
+from aquarius.events.util import get_datatokens_info
+
+TOKEN_1 = "0x" + "11" * 20
+TOKEN_2 = "0x" + "22" * 20
+MINTER = "0x" + "33" * 20
+
+RESULTS = {
+    "name()": ("string", "DataToken"),
+    "symbol()": ("string", "DT"),
+    "decimals()": ("uint8", 18),
+    "totalSupply()": ("uint256", 5 * 10**18),
+    "cap()": ("uint256", 1000 * 10**18),
+    "minter()": ("address", MINTER),
+    "balanceOf(address)": ("uint256", 2 * 10**18),
+}
+SELECTORS = {
+    "0x" + function_signature_to_4byte_selector(signature).hex(): signature
+    for signature in RESULTS
+}
+
+
+class BatchProvider:
+    """Answer the batched `eth_call`s, the `(signature, token)` calls of `failing`
+    fail, by default the `cap()` call of TOKEN_2."""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = {("cap()", TOKEN_2)}
+
+    def make_batch_request(self, calls):
+        self.batches.append(calls)
+        responses = []
+        for method, params in calls:
+            assert method == "eth_call"
+            signature = SELECTORS[params[0]["data"][:10]]
+            if (signature, params[0]["to"].lower()) in self.failing:
+                responses.append({"error": {"message": "execution reverted"}})
+                continue
+
+            output_type, value = RESULTS[signature]
+            responses.append({"result": "0x" + encode_single(output_type, value).hex()})
+        return responses
+
+
+class FakeEth:
+    def __init__(self):
+        self.transfers = []
+
+    def getLogs(self, _filter):
+        assert _filter["topics"] == [TRANSFER_TOPIC]
+        return [{"address": a} for a in self.transfers if a in _filter["address"]]
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.providers = [BatchProvider()]
+        self.eth = FakeEth()
+
+
+def test_get_datatokens_info():
+    web3 = FakeWeb3()
+    infos = get_datatokens_info(web3, [TOKEN_1, TOKEN_2])
+
+    # one batch for the token fields and one for the minter balances
+    assert len(web3.providers[0].batches) == 2
+    assert len(infos) == 2
+    info_1, info_2 = infos.values()
+    assert info_1["name"] == "DataToken"
+    assert info_1["symbol"] == "DT"
+    assert info_1["decimals"] == 18
+    assert info_1["totalSupply"] == 5
+    assert info_1["cap"] == 1000
+    assert info_1["minter"].lower() == MINTER
+    assert info_1["minterBalance"] == 2
+
+    # a failed call only affects its own field
+    assert info_2["cap"] is None
+    assert info_2["totalSupply"] == 5
+    assert info_2["minterBalance"] == 2
+
+
+def test_datatoken_info_cache():
+    web3 = FakeWeb3()
+    batches = web3.providers[0].batches
+    cache = DatatokenInfoCache(web3)
+    info = cache.get(TOKEN_1)
+    assert info["name"] == "DataToken"
+    assert info["minterBalance"] == 2
+    assert len(batches) == 2
+
+    # cached
+    assert cache.get_many([TOKEN_1])[info["address"]] == info
+    assert len(batches) == 2
+
+    # a transfer only drops the mutable fields, which are read again
+    web3.eth.transfers = [info["address"]]
+    assert cache.process_transfer_logs(10, 20) == [info["address"]]
+    assert cache.get(TOKEN_1) == info
+    assert len(batches) == 4
+    assert len(batches[2]) == 2  # totalSupply and minter
+
+    # the fields that could not be read again keep their cached value
+    web3.providers[0].failing = {("totalSupply()", TOKEN_1)}
+    cache.invalidate([TOKEN_1])
+    assert cache.get(TOKEN_1) == info
+
+
+class LockCheckingWriter:
+    """Record the saved entries and check the cache is not locked while flushing."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.saved = {}
+        self.flushes = 0
+
+    def index(self, doc_id, doc):
+        self.saved[doc_id] = doc
+
+    def flush(self):
+        assert not self.cache._lock.locked()
+        self.flushes += 1
+        return True
+
+
+def test_datatoken_info_cache_save():
+    cache = DatatokenInfoCache(FakeWeb3())
+    cache._bulk_writer = LockCheckingWriter(cache)
+    info = cache.get(TOKEN_1)
+    assert cache._bulk_writer.saved[info["address"]]["stale"] is False
+
+    cache.invalidate([TOKEN_1])
+    assert cache._bulk_writer.saved[info["address"]]["stale"] is True
+    assert cache._bulk_writer.flushes == 2
@@ -0,0 +1,54 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from aquarius.events.did_index import DidIndex, did_to_key
+
+DT1 = "0x2Fa6e2F8c2b1D8e5E7f3A0b4e7C1a1cB5D4e3f20"
+DT2 = "0xe2DD09d719Da89e5a3D0F2549c7E24566e947260"
+DT3 = "0xBE5449a6A97aD46c8558A3356267Ee5D2731ab5e"
+
+
+def test_did_to_key():
+    key = did_to_key(f"did:op:{DT1[2:]}")
+    assert key == bytes.fromhex(DT1[2:])
+    assert did_to_key(DT1) == key
+    assert did_to_key(DT1.lower()) == key
+    assert did_to_key("did:op:1234") is None
+    assert did_to_key("did:op:not-an-address") is None
+
+
+def test_did_index():
+    index = DidIndex([f"did:op:{DT1[2:]}", "bad did"], merge_size=2)
+    assert len(index) == 1
+    assert f"did:op:{DT1[2:]}" in index
+    assert f"did:op:{DT1[2:].lower()}" in index
+    assert f"did:op:{DT2[2:]}" not in index
+
+    index.add(f"did:op:{DT2[2:]}")
+    assert f"did:op:{DT2[2:]}" in index
+    index.add(f"did:op:{DT3[2:]}")
+    index.add(f"did:op:{DT3[2:]}")
+    assert len(index) == 3
+    for dt in (DT1, DT2, DT3):
+        assert f"did:op:{dt[2:]}" in index
+    assert "did:op:0x0" not in index
+
+
+def test_did_index_remove():
+    index = DidIndex([f"did:op:{DT1[2:]}", f"did:op:{DT2[2:]}"], merge_size=10)
+    index.add(f"did:op:{DT3[2:]}")
+
+    # from the merged keys and from the recent ones
+    index.remove(f"did:op:{DT1[2:].lower()}")
+    index.remove(f"did:op:{DT3[2:]}")
+    assert len(index) == 1
+    assert f"did:op:{DT1[2:]}" not in index
+    assert f"did:op:{DT3[2:]}" not in index
+    assert f"did:op:{DT2[2:]}" in index
+
+    index.remove(f"did:op:{DT1[2:]}")
+    index.remove("bad did")
+    assert len(index) == 1
+    index.add(f"did:op:{DT1[2:]}")
+    assert f"did:op:{DT1[2:]}" in index
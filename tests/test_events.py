@@ -2,19 +2,39 @@
 # Copyright 2021 Ocean Protocol Foundation
 # SPDX-License-Identifier: Apache-2.0
 #
+import copy
 import json
 import lzma
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 import ecies
+import pytest
+import requests
+from eth_abi import encode_abi, encode_single
+from eth_utils import add_0x_prefix, event_abi_to_log_topic
+from hexbytes import HexBytes
 from web3 import Web3
+from web3.datastructures import AttributeDict
 
 import eth_keys
 
 from aquarius.events.constants import EVENT_METADATA_CREATED, EVENT_METADATA_UPDATED
+from aquarius.events.events_monitor import (
+    EventsMonitor,
+    decode_and_validate_ddo,
+    decode_and_validate_ddo_in_worker,
+    decode_ddo,
+    get_metadata_event_logs,
+    init_decode_worker,
+    lzma_decompress,
+)
+from aquarius.events.util import get_blocks_timestamps
 from tests.helpers import (
     get_web3,
     new_ddo,
     test_account1,
+    test_account2,
     test_account3,
     send_create_update_tx,
     ecies_account,
@@ -103,3 +123,593 @@ def test_publish_unallowed_address(client, base_ddo_url, events_object):
     events_object.process_current_blocks()
     published_ddo = get_ddo(client, base_ddo_url, did)
     assert published_ddo is None
+
+
+def test_failed_flush_keeps_checkpoint(client, base_ddo_url, events_object):
+    events_object.process_current_blocks()
+    _ddo = new_ddo(test_account1, get_web3(), "dt.0")
+    did = _ddo.id
+    data = Web3.toBytes(text=json.dumps(dict(_ddo)))
+    send_create_update_tx("create", did, bytes([0]), data, test_account1)
+
+    checkpoint = events_object.get_last_processed_block()
+    flush = events_object._bulk_writer.flush
+    events_object._bulk_writer.flush = lambda: False
+    try:
+        events_object.process_current_blocks()
+    finally:
+        events_object._bulk_writer.flush = flush
+
+    assert events_object.get_last_processed_block() == checkpoint
+    # the pending ddo is read through the bulk writer
+    assert events_object.read_asset(did)["id"] == did
+    assert get_ddo(client, base_ddo_url, did) is None
+
+    events_object.process_current_blocks()
+    assert events_object.get_last_processed_block() > checkpoint
+    assert get_ddo(client, base_ddo_url, did)["id"] == did
+
+
+def test_failed_transfers_keep_checkpoint(events_object, monkeypatch):
+    events_object.process_current_blocks()
+    checkpoint = events_object.get_last_processed_block()
+    _ddo = new_ddo(test_account1, get_web3(), "dt.transfers")
+    data = Web3.toBytes(text=json.dumps(dict(_ddo)))
+    send_create_update_tx("create", _ddo.id, bytes([0]), data, test_account1)
+
+    def process_transfer_logs(from_block, to_block):
+        raise requests.exceptions.Timeout()
+
+    cache = events_object._dt_info_cache
+    monkeypatch.setattr(cache, "process_transfer_logs", process_transfer_logs)
+    events_object.process_current_blocks()
+    # the invalidations of the range would be lost
+    assert events_object.get_last_processed_block() == checkpoint
+
+    monkeypatch.undo()
+    events_object.process_current_blocks()
+    assert events_object.get_last_processed_block() > checkpoint
+
+
+def test_rebuild_reorged_assets(client, base_ddo_url, events_object):
+    web3 = get_web3()
+    block = web3.eth.blockNumber
+    ddo_a = new_ddo(test_account1, web3, f"dt.a.{block}")
+    data = Web3.toBytes(text=json.dumps(dict(ddo_a)))
+    send_create_update_tx("create", ddo_a.id, bytes([0]), data, test_account1)
+    get_event(EVENT_METADATA_CREATED, block, ddo_a.id)
+    resume_block = web3.eth.blockNumber
+
+    ddo_b = new_ddo(test_account1, web3, f"dt.b.{block}")
+    data = Web3.toBytes(text=json.dumps(dict(ddo_b)))
+    send_create_update_tx("create", ddo_b.id, bytes([0]), data, test_account1)
+    get_event(EVENT_METADATA_CREATED, block, ddo_b.id)
+    ddo_a["service"][0]["attributes"]["main"]["name"] = "Updated in a reorged block"
+    data = Web3.toBytes(text=json.dumps(dict(ddo_a)))
+    send_create_update_tx("update", ddo_a.id, bytes([0]), data, test_account1)
+    get_event(EVENT_METADATA_UPDATED, block, ddo_a.id)
+    events_object.process_current_blocks()
+    last_block = events_object.get_last_processed_block()
+    assert get_ddo(client, base_ddo_url, ddo_b.id)["id"] == ddo_b.id
+
+    # the blocks after resume_block are reorged away
+    events_object._rebuild_reorged_assets(resume_block, last_block)
+    assert ddo_b.id not in events_object._did_index
+    assert get_ddo(client, base_ddo_url, ddo_b.id) is None
+    asset = get_ddo(client, base_ddo_url, ddo_a.id)
+    assert asset["event"]["blockNo"] <= resume_block
+    assert (
+        asset["service"][0]["attributes"]["main"]["name"]
+        != "Updated in a reorged block"
+    )
+
+    # the events of the new chain are applied again
+    events_object.store_last_processed_block(resume_block)
+    events_object.process_current_blocks()
+    assert get_ddo(client, base_ddo_url, ddo_b.id)["id"] == ddo_b.id
+    asset = get_ddo(client, base_ddo_url, ddo_a.id)
+    assert (
+        asset["service"][0]["attributes"]["main"]["name"]
+        == "Updated in a reorged block"
+    )
+
+
+def test_decode_ddo_max_size():
+    data = json.dumps({"id": "did:op:0", "padding": "0" * 10000}).encode()
+    compressed = lzma.compress(data)
+
+    assert decode_ddo(compressed, [1], max_ddo_size=len(data))["id"] == "did:op:0"
+    # the compressed payload is small, the decompressed ddo is not
+    assert len(compressed) < 1000
+    assert decode_ddo(compressed, [1], max_ddo_size=1000) is None
+    assert decode_ddo(data, [0], max_ddo_size=1000) is None
+
+
+def test_lzma_decompress_truncated():
+    data = json.dumps({"id": "did:op:0", "padding": "0" * 10000}).encode()
+    compressed = lzma.compress(data)
+    assert lzma_decompress(compressed, len(data)) == data
+
+    with pytest.raises(lzma.LZMAError):
+        lzma_decompress(compressed[:-20], len(data))
+    assert decode_ddo(compressed[:-20], [1], max_ddo_size=len(data)) is None
+
+
+def _encrypted_ddo(ddo):
+    key = eth_keys.KeyAPI.PrivateKey(ecies_account.privateKey)
+    data = lzma.compress(Web3.toBytes(text=json.dumps(dict(ddo))))
+    return ecies.encrypt(key.public_key.to_hex(), data)
+
+
+def _metadata_event(event_name, ddo, block, account):
+    sender = "createdBy" if event_name == EVENT_METADATA_CREATED else "updatedBy"
+    return AttributeDict(
+        {
+            "event": event_name,
+            "address": "0x" + "00" * 20,
+            "blockNumber": block,
+            "logIndex": 0,
+            "transactionHash": HexBytes(os.urandom(32)),
+            "args": AttributeDict(
+                {
+                    "dataToken": ddo.dataToken,
+                    sender: account.address,
+                    "flags": bytes([3]),
+                    "data": _encrypted_ddo(ddo),
+                }
+            ),
+        }
+    )
+
+
+def test_process_ddos_decoded_in_worker(events_object):
+    web3 = get_web3()
+    create_block = web3.eth.blockNumber
+    _ddo = new_ddo(test_account1, web3, f"dt.{create_block}")
+    did = _ddo.id
+    update_block = web3.eth.blockNumber
+    assert update_block > create_block
+
+    created = _metadata_event(EVENT_METADATA_CREATED, _ddo, create_block, test_account1)
+    _ddo["service"][0]["attributes"]["main"]["name"] = "Updated in a worker"
+    updated = _metadata_event(EVENT_METADATA_UPDATED, _ddo, update_block, test_account1)
+
+    with ProcessPoolExecutor(
+        max_workers=1,
+        initializer=init_decode_worker,
+        initargs=(os.environ.get("EVENTS_ECIES_PRIVATE_KEY"),),
+    ) as pool:
+        decoded = [
+            pool.submit(
+                decode_and_validate_ddo_in_worker,
+                event.args.data,
+                event.args.flags,
+                events_object.get_block_timestamp(event.blockNumber),
+                f"event {event.event}",
+            ).result()
+            for event in (created, updated)
+        ]
+
+    assert [error for _, error in decoded] == [None, None]
+    assert decoded[0][0]["id"] == did
+
+    assert events_object.processNewDDO(created, decoded[0]) is True
+    asset = events_object.read_asset(did)
+    assert asset["event"]["blockNo"] == create_block
+    assert asset["service"][0]["attributes"]["main"]["name"] != "Updated in a worker"
+
+    # a ddo that failed to decode in the worker is not saved
+    assert not events_object.processUpdateDDO(updated, (None, "invalid ddo"))
+    assert events_object.read_asset(did)["event"]["blockNo"] == create_block
+
+    assert events_object.processUpdateDDO(updated, decoded[1]) is True
+    asset = events_object.read_asset(did)
+    assert asset["event"]["blockNo"] == update_block
+    assert asset["service"][0]["attributes"]["main"]["name"] == "Updated in a worker"
+    assert events_object._bulk_writer.flush()
+
+
+def test_process_ddo_results(events_object):
+    web3 = get_web3()
+    create_block = web3.eth.blockNumber
+    _ddo = new_ddo(test_account1, web3, f"dt.{create_block}")
+    update_block = web3.eth.blockNumber
+
+    def _decoded(event):
+        return decode_and_validate_ddo(
+            event.args.data,
+            event.args.flags,
+            events_object.get_block_timestamp(event.blockNumber),
+            f"event {event.event}",
+            events_object._ecies_key,
+        )
+
+    # an update of an unknown did is saved as a new asset
+    first = _metadata_event(EVENT_METADATA_UPDATED, _ddo, create_block, test_account1)
+    assert events_object.processUpdateDDO(first, _decoded(first)) is True
+    assert events_object.read_asset(_ddo.id)["event"]["blockNo"] == create_block
+    # already applied
+    assert events_object.processUpdateDDO(first, _decoded(first)) is True
+    assert events_object.processNewDDO(first, _decoded(first)) is True
+
+    # rejected
+    other_sender = _metadata_event(
+        EVENT_METADATA_UPDATED, _ddo, update_block, test_account3
+    )
+    assert events_object.processUpdateDDO(other_sender, _decoded(other_sender)) is False
+    update = _metadata_event(EVENT_METADATA_UPDATED, _ddo, update_block, test_account1)
+    assert events_object.processUpdateDDO(update, (None, "invalid ddo")) is False
+
+    assert events_object.processUpdateDDO(update, _decoded(update)) is True
+    assert events_object.read_asset(_ddo.id)["event"]["blockNo"] == update_block
+    # an older update is not applied, the asset is already up to date
+    older = _metadata_event(EVENT_METADATA_UPDATED, _ddo, create_block, test_account1)
+    assert events_object.processUpdateDDO(older, _decoded(older)) is True
+    assert events_object.read_asset(_ddo.id)["event"]["blockNo"] == update_block
+    assert events_object._bulk_writer.flush()
+
+
+def test_coalesce_updates():
+    def _event(name, dt, block):
+        return AttributeDict(
+            {
+                "event": name,
+                "blockNumber": block,
+                "logIndex": 0,
+                "args": {"dataToken": dt},
+            }
+        )
+
+    created = _event(EVENT_METADATA_CREATED, "0x1", 1)
+    updates = [_event(EVENT_METADATA_UPDATED, "0x1", block) for block in (2, 3, 4)]
+    other = _event(EVENT_METADATA_UPDATED, "0x2", 3)
+
+    events, earlier_updates = EventsMonitor.coalesce_updates(
+        [created, updates[0], updates[1], other, updates[2]]
+    )
+    assert events == [created, other, updates[2]]
+    assert earlier_updates == {"0x1": [updates[1], updates[0]]}
+
+
+def test_ownership_transfer_in_one_chunk(events_object):
+    web3 = get_web3()
+    create_block = web3.eth.blockNumber
+    _ddo = new_ddo(test_account1, web3, f"dt.{create_block}")
+    transfer_block = web3.eth.blockNumber
+    new_ddo(test_account1, web3, f"dt.{transfer_block}")
+    update_block = web3.eth.blockNumber
+
+    # test_account1 hands the asset over to test_account2, which then updates it
+    transferred = AttributeDict(copy.deepcopy(dict(_ddo)))
+    transferred["publicKey"][0]["owner"] = test_account2.address
+    updated = AttributeDict(copy.deepcopy(dict(transferred)))
+    updated["service"][0]["attributes"]["main"]["name"] = "Updated by the new owner"
+    events = [
+        _metadata_event(EVENT_METADATA_CREATED, _ddo, create_block, test_account1),
+        _metadata_event(
+            EVENT_METADATA_UPDATED, transferred, transfer_block, test_account1
+        ),
+        _metadata_event(EVENT_METADATA_UPDATED, updated, update_block, test_account2),
+    ]
+    events_object.process_block_range_events(events)
+    assert events_object._bulk_writer.flush()
+
+    # as if the updates were applied one by one
+    asset = events_object.read_asset(_ddo.id)
+    assert asset["event"]["blockNo"] == update_block
+    assert asset["publicKey"][0]["owner"] == test_account2.address
+    assert (
+        asset["service"][0]["attributes"]["main"]["name"] == "Updated by the new owner"
+    )
+
+
+def test_apply_latest_update():
+    class Monitor:
+        apply_latest_update = EventsMonitor.apply_latest_update
+
+        def __init__(self):
+            self.applied = []
+
+        def processUpdateDDO(self, event, decoded=None):
+            self.applied.append(event.blockNumber)
+            return True
+
+    def _event(block, sender):
+        return AttributeDict(
+            {
+                "event": EVENT_METADATA_UPDATED,
+                "blockNumber": block,
+                "logIndex": 0,
+                "transactionHash": HexBytes(bytes([block]) * 32),
+                "args": {"dataToken": "0x1", "updatedBy": sender},
+            }
+        )
+
+    owner, other = test_account1.address, test_account2.address
+    updates = [_event(block, owner) for block in (1, 2, 3)]
+    decoded = {
+        (e.blockNumber, 0): ({"publicKey": [{"owner": owner}]}, None) for e in updates
+    }
+
+    # the owner is kept, only the latest update is applied
+    monitor = Monitor()
+    monitor.apply_latest_update(updates[2], decoded, [updates[1], updates[0]])
+    assert monitor.applied == [3]
+
+    # the owner changes, the updates are applied in order
+    decoded[(2, 0)] = ({"publicKey": [{"owner": other}]}, None)
+    monitor = Monitor()
+    monitor.apply_latest_update(updates[2], decoded, [updates[1], updates[0]])
+    assert monitor.applied == [1, 2, 3]
+
+    # not decoded yet
+    monitor = Monitor()
+    monitor.apply_latest_update(updates[2], dict(), [updates[1]])
+    assert monitor.applied == [2, 3]
+
+
+def test_get_metadata_event_logs():
+    abi_file = os.path.join(
+        os.path.dirname(__file__), "..", "aquarius", "artifacts", "Metadata.json"
+    )
+    with open(abi_file) as f:
+        abis = {e["name"]: e for e in json.load(f)["abi"] if e.get("type") == "event"}
+    event_abis = {
+        add_0x_prefix(event_abi_to_log_topic(abi).hex()): abi for abi in abis.values()
+    }
+    contract_address = "0x" + "aa" * 20
+    sender = Web3.toChecksumAddress("0x" + "bb" * 20)
+
+    def _raw_log(event_name, block, log_index, dt):
+        return AttributeDict(
+            {
+                "topics": [
+                    HexBytes(event_abi_to_log_topic(abis[event_name])),
+                    HexBytes(encode_single("address", dt)),
+                    HexBytes(encode_single("address", sender)),
+                ],
+                "data": add_0x_prefix(
+                    encode_abi(["bytes", "bytes"], [b"\x00", dt.encode()]).hex()
+                ),
+                "blockNumber": block,
+                "logIndex": log_index,
+                "transactionIndex": 0,
+                "transactionHash": HexBytes(b"\x01" * 32),
+                "blockHash": HexBytes(b"\x02" * 32),
+                "address": contract_address,
+            }
+        )
+
+    dts = [Web3.toChecksumAddress("0x" + f"{i:02x}" * 20) for i in range(1, 5)]
+    raw_logs = [
+        _raw_log(EVENT_METADATA_UPDATED, 12, 0, dts[3]),
+        _raw_log(EVENT_METADATA_CREATED, 10, 5, dts[1]),
+        _raw_log(EVENT_METADATA_UPDATED, 11, 2, dts[2]),
+        _raw_log(EVENT_METADATA_CREATED, 10, 1, dts[0]),
+    ]
+    filters = []
+
+    class FakeEth:
+        def getLogs(self, _filter):
+            filters.append(_filter)
+            return raw_logs
+
+    class FakeWeb3:
+        eth = FakeEth()
+
+    events = get_metadata_event_logs(FakeWeb3(), contract_address, event_abis, 10, 12)
+    # one request for both events
+    assert len(filters) == 1
+    assert filters[0]["address"] == contract_address
+    assert sorted(filters[0]["topics"][0]) == sorted(event_abis.keys())
+    # decoded with the abi of their topic and in chain order
+    assert [(e.blockNumber, e.logIndex) for e in events] == [
+        (10, 1),
+        (10, 5),
+        (11, 2),
+        (12, 0),
+    ]
+    assert [e.event for e in events] == [
+        EVENT_METADATA_CREATED,
+        EVENT_METADATA_CREATED,
+        EVENT_METADATA_UPDATED,
+        EVENT_METADATA_UPDATED,
+    ]
+    assert [e.args.dataToken for e in events] == dts
+    assert events[0].args.createdBy == sender
+    assert events[3].args.updatedBy == sender
+    assert events[2].args.data == dts[2].encode()
+
+
+class BlocksBatchProvider:
+    """Answer the batched `eth_getBlockByNumber` calls, without block 13."""
+
+    def __init__(self):
+        self.batches = []
+
+    def make_batch_request(self, calls):
+        self.batches.append(calls)
+        responses = []
+        for method, params in calls:
+            assert method == "eth_getBlockByNumber" and params[1] is False
+            block = int(params[0], 16)
+            if block == 13:
+                responses.append({"error": {"message": "unknown block"}})
+            else:
+                responses.append({"result": {"timestamp": hex(1000 + block)}})
+        return responses
+
+
+class BlocksWeb3:
+    def __init__(self):
+        self.providers = [BlocksBatchProvider()]
+        self.blocks_read = []
+        self.eth = self
+
+    def getBlock(self, block):
+        self.blocks_read.append(block)
+        return {"timestamp": 1000 + block}
+
+
+def test_prefetch_block_timestamps():
+    web3 = BlocksWeb3()
+    assert get_blocks_timestamps(web3, [11, 12, 13]) == {
+        11: 1011,
+        12: 1012,
+        13: 1013,
+    }
+    # one batch, the failed header is read on its own
+    assert len(web3.providers[0].batches) == 1
+    assert web3.blocks_read == [13]
+
+    class Monitor:
+        _web3 = web3
+        _block_timestamps = {12: 1012}
+
+    monitor = Monitor()
+    EventsMonitor.prefetch_block_timestamps(monitor, {10, 12, 14})
+    assert monitor._block_timestamps == {10: 1010, 12: 1012, 14: 1014}
+    assert [int(p[0], 16) for _, p in web3.providers[0].batches[-1]] == [10, 14]
+    batches = len(web3.providers[0].batches)
+    # the known blocks are not read again
+    EventsMonitor.prefetch_block_timestamps(monitor, {10, 14})
+    assert len(web3.providers[0].batches) == batches
+    assert EventsMonitor.get_block_timestamp(monitor, 14) == 1014
+
+
+def test_mid_chunk_checkpoint():
+    class Writer:
+        _max_actions = 2
+
+        def __init__(self):
+            self.pending = []
+            self.saved = []
+
+        def __len__(self):
+            return len(self.pending)
+
+        def index(self, doc_id, doc):
+            self.pending.append(doc_id)
+
+        def flush(self):
+            self.saved.extend(self.pending)
+            self.pending = []
+            return True
+
+    class Monitor:
+        process_block_range_events = EventsMonitor.process_block_range_events
+        coalesce_updates = staticmethod(EventsMonitor.coalesce_updates)
+
+        def __init__(self, cursors):
+            self._cursors = cursors
+            self._bulk_writer = Writer()
+            self.checkpoints = []
+
+        def decode_events(self, events):
+            return dict()
+
+        def is_publisher_allowed(self, publisher_address):
+            return True
+
+        def prefetch_datatokens_info(self, dt_addresses):
+            pass
+
+        def processNewDDO(self, event, decoded=None):
+            self._bulk_writer.index(event.args.dataToken, {})
+
+        def get_block_hash(self, block):
+            return hex(block)
+
+        def store_last_processed_block(self, block, block_hash, cursors):
+            self.checkpoints.append((block, block_hash, dict(cursors)))
+
+    events = [
+        AttributeDict(
+            {
+                "event": EVENT_METADATA_CREATED,
+                "blockNumber": block,
+                "logIndex": 0,
+                "args": {"dataToken": f"0x{block}"},
+            }
+        )
+        for block in range(11, 16)
+    ]
+    monitor = Monitor(dict())
+    monitor.process_block_range_events(events, checkpoint_block=10)
+    # checkpointed after each full bulk request, at the last complete block
+    assert monitor.checkpoints == [
+        (10, "0xa", {EVENT_METADATA_CREATED: [12, 0]}),
+        (10, "0xa", {EVENT_METADATA_CREATED: [14, 0]}),
+    ]
+    assert monitor._bulk_writer.saved == ["0x11", "0x12", "0x13", "0x14"]
+
+    # resuming from the last checkpoint skips the events already applied
+    resumed = Monitor(monitor.checkpoints[-1][2])
+    resumed.process_block_range_events(events, checkpoint_block=10)
+    assert resumed._bulk_writer.pending == ["0x15"]
+    assert resumed.checkpoints == []
+
+
+def test_update_purgatory_list():
+    class Fetcher:
+        def __init__(self, lists):
+            self.lists = lists
+            self.rearmed = 0
+
+        def fetch(self):
+            return self.lists.pop(0) if self.lists else None
+
+        def rearm(self):
+            self.rearmed += 1
+            self.lists.insert(0, last_list)
+
+    class FakePurgatory:
+        def __init__(self):
+            self.calls = []
+            self.fail = True
+
+        def add(self, dids):
+            if self.fail:
+                self.fail = False
+                raise ConnectionError("es down")
+            self.calls.append(("add", dids))
+            return len(dids)
+
+        def remove_all_except(self, dids):
+            self.calls.append(("remove_all_except", dids))
+            return 0
+
+        def remove(self, dids):
+            self.calls.append(("remove", dids))
+            return len(dids)
+
+    class Monitor:
+        _update_purgatory_list = EventsMonitor._update_purgatory_list
+
+    # an empty first list still releases the assets flagged in the database
+    last_list = set()
+    monitor = Monitor()
+    monitor._purgatory_update_time = None
+    monitor._purgatory_list = None
+    monitor._purgatory_fetcher = Fetcher([set()])
+    monitor._purgatory = FakePurgatory()
+
+    monitor._update_purgatory_list()
+    # the failed update is retried with the same list on the next call
+    assert monitor._purgatory_fetcher.rearmed == 1
+    assert monitor._purgatory_list is None
+    monitor._update_purgatory_list()
+    assert monitor._purgatory.calls == [
+        ("add", set()),
+        ("remove_all_except", set()),
+    ]
+    assert monitor._purgatory_list == set()
+
+    # an emptied list releases the assets of the previous one
+    monitor._purgatory_list = {("did:op:01", "bad")}
+    monitor._purgatory_dids = {"did:op:01"}
+    monitor._purgatory_update_time = None
+    monitor._purgatory_fetcher = Fetcher([set()])
+    monitor._update_purgatory_list()
+    assert monitor._purgatory.calls[-1] == ("remove", {"did:op:01"})
+    assert monitor._purgatory_dids == set()
@@ -0,0 +1,81 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+from aquarius.events.http_provider import CustomHTTPProvider
+
+
+class JsonRpcHandler(BaseHTTPRequestHandler):
+    reject_batches = False
+    requests_count = 0
+
+    def do_POST(self):
+        JsonRpcHandler.requests_count += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(request, list):
+            if self.reject_batches:
+                self.send_response(400)
+                self.end_headers()
+                return
+            # reply in reverse order, responses are matched by id
+            response = [self._result(r) for r in reversed(request)]
+        else:
+            response = self._result(request)
+
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _result(request):
+        return {"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = HTTPServer(("127.0.0.1", 0), JsonRpcHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_make_batch_request():
+    server = _start_server()
+    try:
+        JsonRpcHandler.requests_count = 0
+        provider = CustomHTTPProvider(
+            f"http://127.0.0.1:{server.server_port}", batch_size=3
+        )
+        calls = [("eth_getBlockByNumber", [hex(i), False]) for i in range(7)]
+        responses = provider.make_batch_request(calls)
+
+        assert [r["result"] for r in responses] == [hex(i) for i in range(7)]
+        assert JsonRpcHandler.requests_count == 3
+    finally:
+        server.shutdown()
+
+
+def test_make_batch_request_falls_back_to_single_requests():
+    server = _start_server()
+    try:
+        JsonRpcHandler.requests_count = 0
+        JsonRpcHandler.reject_batches = True
+        provider = CustomHTTPProvider(
+            f"http://127.0.0.1:{server.server_port}", batch_size=5
+        )
+        calls = [("eth_getBlockByNumber", [hex(i), False]) for i in range(4)]
+        responses = provider.make_batch_request(calls)
+
+        assert [r["result"] for r in responses] == [hex(i) for i in range(4)]
+        assert JsonRpcHandler.requests_count == 5
+    finally:
+        JsonRpcHandler.reject_batches = False
+        server.shutdown()
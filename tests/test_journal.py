@@ -0,0 +1,136 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from types import SimpleNamespace
+
+import pytest
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from aquarius.events.constants import EVENT_METADATA_CREATED
+from aquarius.events.did_index import DidIndex
+from aquarius.events.journal import EventJournal, record_to_event, replay_journal
+
+
+def _event(block, log_index):
+    return AttributeDict(
+        {
+            "event": EVENT_METADATA_CREATED,
+            "blockNumber": block,
+            "blockHash": HexBytes(f"0x{block:064x}"),
+            "logIndex": log_index,
+            "transactionHash": HexBytes(f"0x{block * 100 + log_index:064x}"),
+            "address": "0x" + "ab" * 20,
+            "args": AttributeDict(
+                {
+                    "dataToken": "0x" + f"{block:040x}",
+                    "createdBy": "0x" + "cd" * 20,
+                    "flags": b"\x01",
+                    "data": b"ddo %d" % block,
+                }
+            ),
+        }
+    )
+
+
+def test_event_journal(tmpdir):
+    journal = EventJournal(str(tmpdir), max_segment_size=1)
+    events = [_event(block, 0) for block in range(10, 15)]
+    assert journal.append(events[:3], {10: 1000}) == 3
+    # already journaled events are skipped
+    assert journal.append(events, {}) == 2
+    assert journal.last_position == (14, 0)
+
+    # the segments are rotated and listed in the index
+    reopened = EventJournal(str(tmpdir), max_segment_size=1)
+    assert len(reopened._segments) == 2
+    records = list(reopened.read())
+    assert [r["blockNumber"] for r in records] == [10, 11, 12, 13, 14]
+    assert records[0]["timestamp"] == 1000
+    assert [r["blockNumber"] for r in reopened.read(from_block=13)] == [13, 14]
+
+    event = record_to_event(records[0])
+    assert event.args.data == b"ddo 10"
+    assert event.args.flags == b"\x01"
+    assert event.transactionHash == events[0].transactionHash
+
+    reopened.truncate(11)
+    assert [r["blockNumber"] for r in reopened.read()] == [10, 11]
+    assert reopened.last_position == (11, 0)
+    assert reopened.append(events, {}) == 3
+
+
+class ReplayMonitor:
+    block_envvar = "METADATA_CONTRACT_BLOCK"
+
+    def __init__(self, checkpoint_block):
+        self.indices = SimpleNamespace(
+            calls=[],
+            delete=lambda index, ignore: self.indices.calls.append(("delete", index)),
+            create=lambda index, body: self.indices.calls.append(("create", index)),
+        )
+        self._oceandb = SimpleNamespace(
+            driver=SimpleNamespace(
+                es=SimpleNamespace(indices=self.indices), db_index="aquarius"
+            )
+        )
+        self._bulk_writer = SimpleNamespace(flush=lambda: True)
+        self._block_timestamps = dict()
+        self._did_index = DidIndex(["did:op:" + "ef" * 20])
+        self.checkpoint_block = checkpoint_block
+        self.applied = []
+        self.checkpoints = []
+
+    def process_block_range_events(self, events):
+        self.applied.extend(e.blockNumber for e in events)
+
+    def get_last_processed_block(self):
+        return self.checkpoint_block
+
+    def store_last_processed_block(self, block, block_hash, cursors):
+        self.checkpoints.append(block)
+
+
+def test_replay_journal(tmpdir, monkeypatch):
+    monkeypatch.setenv("METADATA_CONTRACT_BLOCK", "5")
+    journal = EventJournal(str(tmpdir))
+    journal.append([], {}, from_block=5)
+    journal.append([_event(block, 0) for block in range(10, 15)], {}, from_block=6)
+    assert EventJournal(str(tmpdir)).start_block == 5
+
+    # a full replay recreates the index and moves the checkpoint forward
+    monitor = ReplayMonitor(12)
+    assert replay_journal(monitor, journal, batch_size=2, recreate_index=True) == 14
+    assert monitor.indices.calls == [("delete", "aquarius"), ("create", "aquarius")]
+    assert len(monitor._did_index) == 0
+    assert monitor.applied == [10, 11, 12, 13, 14]
+    assert monitor.checkpoints == [14]
+
+    # a partial replay is applied on top, the checkpoint is not moved back
+    monitor = ReplayMonitor(20)
+    assert replay_journal(monitor, journal, from_block=13) == 14
+    assert monitor.indices.calls == []
+    assert len(monitor._did_index) == 1
+    assert monitor.applied == [13, 14]
+    assert monitor.checkpoints == []
+
+
+def test_replay_incomplete_journal(tmpdir, monkeypatch):
+    monkeypatch.setenv("METADATA_CONTRACT_BLOCK", "5")
+    # e.g. a journal enabled on a running node
+    journal = EventJournal(str(tmpdir))
+    journal.append([_event(block, 0) for block in range(10, 15)], {}, from_block=8)
+    assert journal.start_block == 8
+
+    monitor = ReplayMonitor(12)
+    with pytest.raises(AssertionError):
+        replay_journal(monitor, journal, recreate_index=True)
+    # the index is left untouched
+    assert monitor.indices.calls == []
+    assert len(monitor._did_index) == 1
+    assert monitor.applied == [] and monitor.checkpoints == []
+
+    # it can still be replayed on top of the index
+    assert replay_journal(monitor, journal, from_block=13) == 14
+    assert monitor.applied == [13, 14]
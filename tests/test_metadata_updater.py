@@ -0,0 +1,297 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import time
+
+import requests
+
+from aquarius.block_utils import BlockRangeChunker
+from aquarius.events import metadata_updater
+from aquarius.events.bulk_writer import BulkWriter
+from aquarius.events.metadata_updater import MetadataUpdater
+from aquarius.events.pool_registry import PoolRegistryError
+
+POOLS = ["0x" + f"{i:02x}" * 20 for i in range(1, 6)]
+
+
+class RecordingEth:
+    def __init__(self):
+        self.filters = []
+
+    def getLogs(self, _filter):
+        self.filters.append(_filter)
+        return []
+
+
+class RecordingWeb3:
+    def __init__(self, web3):
+        self.eth = RecordingEth()
+        self.sha3 = web3.sha3
+
+
+class Registry:
+    def pools(self):
+        return POOLS
+
+
+def test_get_pool_logs_filters(events_object, monkeypatch):
+    updater = events_object._pool_monitor
+    web3 = RecordingWeb3(updater._web3)
+    monkeypatch.setattr(updater, "_web3", web3)
+    monkeypatch.setattr(updater, "_pool_registry", Registry())
+    monkeypatch.setattr(updater, "_pool_logs_addresses_per_query", 2)
+
+    assert updater.get_pool_logs(10, 20) == []
+    assert [f["address"] for f in web3.eth.filters] == [
+        POOLS[0:2],
+        POOLS[2:4],
+        POOLS[4:],
+    ]
+    for _filter in web3.eth.filters:
+        assert _filter["fromBlock"] == 10 and _filter["toBlock"] == 20
+        # one request for the three pool events
+        assert len(_filter["topics"]) == 1 and len(_filter["topics"][0]) == 3
+
+
+class SlowBPool:
+    """Return the tokens of the first two pools, the others take 2 seconds."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def getCurrentTokens(self):
+        if self.address not in POOLS[:2]:
+            time.sleep(2)
+        return [self.address]
+
+
+class TokensReader:
+    _pool_tokens_concurrency = 8
+    _pool_tokens_timeout = 1
+
+
+def test_get_pools_tokens_timeout(monkeypatch):
+    monkeypatch.setattr(metadata_updater, "BPool", SlowBPool)
+
+    start = time.time()
+    pools_tokens = MetadataUpdater.get_pools_tokens(TokensReader(), POOLS)
+    # the timeout is for all the pools, not for each of them
+    assert time.time() - start < 2
+    assert pools_tokens == {pool: [pool] for pool in POOLS[:2]}
+
+
+class RecordingWriter(BulkWriter):
+    """Record the ids of the documents sent by each flush."""
+
+    def __init__(self):
+        super().__init__(None, "aquarius")
+        self.flushed = []
+
+    def flush(self):
+        self.flushed.append({doc_id: a["doc"] for doc_id, a in self._actions.items()})
+        self._actions.clear()
+        return True
+
+
+class DtInfoCache:
+    def get(self, address):
+        return self.get_many([address])[address]
+
+    def get_many(self, addresses):
+        return {a: {"address": a, "name": "DT", "cap": None} for a in addresses}
+
+
+class FakeWeb3:
+    @staticmethod
+    def toChecksumAddress(address):
+        return address
+
+    @staticmethod
+    def isAddress(address):
+        return True
+
+
+class PoolRegistryStub:
+    def update(self):
+        return []
+
+    def get_dt_to_pools(self, base_token=None):
+        return {}
+
+    def get_pools(self, dt_address):
+        return []
+
+
+class ExchangeStub:
+    address = "0x" + "ee" * 20
+
+
+class FakeDao:
+    assets = dict()
+
+    def __init__(self, oceandb):
+        pass
+
+    def get(self, did):
+        return FakeDao.assets[did]
+
+
+def _updater(monkeypatch):
+    """A MetadataUpdater without chain access, the prices are fixed."""
+    updater = MetadataUpdater.__new__(MetadataUpdater)
+    updater._oceandb = None
+    updater._web3 = FakeWeb3()
+    updater._bulk_writer = RecordingWriter()
+    updater._dt_info_cache = DtInfoCache()
+    updater._own_dt_info_cache = False
+    updater._bulk_reprice = False
+    updater._OCEAN = "0x" + "0c" * 20
+    updater._pool_registry = PoolRegistryStub()
+    updater.ex_contract = ExchangeStub()
+    monkeypatch.setattr(metadata_updater, "Dao", FakeDao)
+    monkeypatch.setattr(
+        updater,
+        "_get_price_updates_from_fixed_rate_exchange",
+        lambda dt_address, owner=None, exchange_id=None: {"type": "exchange"},
+    )
+    monkeypatch.setattr(
+        updater,
+        "_get_price_updates_from_liquidity",
+        lambda pools, dt_address, liquidity=None: {"type": "pool", "pools": pools},
+    )
+    return updater
+
+
+def _asset(i):
+    return {
+        "id": f"did:op:{i:040x}",
+        "proof": {"creator": "0x" + "aa" * 20},
+        "price": {"value": 0.0},
+    }
+
+
+def test_queue_price_update(monkeypatch):
+    updater = _updater(monkeypatch)
+    asset = _asset(1)
+    asset["dataTokenInfo"] = {"name": "DT", "cap": None}
+    updater._queue_price_update(asset["id"], asset)
+    # the fields that could not be read are not written
+    assert updater._bulk_writer._actions[asset["id"]]["doc"] == {
+        "price": {"value": 0.0},
+        "dataTokenInfo": {"name": "DT"},
+    }
+
+    asset = _asset(2)
+    asset["dataTokenInfo"] = {}
+    updater._queue_price_update(asset["id"], asset)
+    assert updater._bulk_writer._actions[asset["id"]]["doc"] == {
+        "price": {"value": 0.0}
+    }
+
+
+def test_price_updates_flushes(monkeypatch):
+    updater = _updater(monkeypatch)
+    writer = updater._bulk_writer
+
+    # the full update is saved by batches of DT_INFO_BATCH_SIZE assets
+    assets = [_asset(i) for i in range(250)]
+    monkeypatch.setattr(updater, "get_all_pools", lambda: [])
+    monkeypatch.setattr(updater, "_get_all_assets", lambda: iter(assets))
+    updater.do_update()
+    assert [len(docs) for docs in writer.flushed] == [100, 100, 50]
+    doc = writer.flushed[0][assets[0]["id"]]
+    assert doc["price"] == {"value": 0.0, "type": "exchange"}
+    assert doc["dataTokenInfo"] == {"address": "0x" + "00" * 20, "name": "DT"}
+
+    # the updates of a block range are sent together
+    writer.flushed.clear()
+    FakeDao.assets = {a["id"]: a for a in assets[:3]}
+    updater.update_dt_assets([("0x" + f"{i:040x}", POOLS[i]) for i in range(3)])
+    assert len(writer.flushed) == 1
+    assert sorted(writer.flushed[0]) == sorted(FakeDao.assets)
+
+    # the assets priced from pools are skipped
+    writer.flushed.clear()
+    FakeDao.assets.update({a["id"]: a for a in assets[3:6]})
+    updater.update_dt_assets_with_exchange_info(
+        [("0x" + f"{i:040x}", f"exchange-{i}") for i in range(6)]
+    )
+    assert len(writer.flushed) == 1
+    assert sorted(writer.flushed[0]) == [a["id"] for a in assets[3:6]]
+
+    # a single update is sent immediately
+    writer.flushed.clear()
+    monkeypatch.setattr(updater, "get_datatoken_pools", lambda address: [])
+    updater.do_single_update(assets[0])
+    assert [list(docs) for docs in writer.flushed] == [[assets[0]["id"]]]
+
+
+class FailingRegistry(PoolRegistryStub):
+    def update(self):
+        raise PoolRegistryError("the pools could not all be added.")
+
+
+class ReservesStub:
+    def apply_logs(self, logs, to_block):
+        pass
+
+    def reconcile(self):
+        pass
+
+
+def test_process_pool_events(monkeypatch):
+    updater = _updater(monkeypatch)
+    updater._pool_reserves = ReservesStub()
+    updater._blocks_chunker = BlockRangeChunker(100)
+    checkpoints = []
+    monkeypatch.setattr(updater, "get_last_processed_block", lambda: 100)
+    monkeypatch.setattr(updater, "get_resume_block", lambda block: block)
+    monkeypatch.setattr(updater, "get_confirmed_block", lambda: 200)
+    monkeypatch.setattr(updater, "get_block_hash", lambda block: hex(block))
+    monkeypatch.setattr(
+        updater,
+        "store_last_processed_block",
+        lambda block, block_hash: checkpoints.append(block),
+    )
+    monkeypatch.setattr(
+        updater, "get_dt_addresses_from_exchange_logs", lambda **kwargs: []
+    )
+
+    # the pool events are not processed without all the pools
+    updater._pool_registry = FailingRegistry()
+    updater.process_pool_events()
+    assert checkpoints == []
+
+    # a timed out request is sent again for a smaller block range
+    requested = []
+
+    def get_pool_logs(from_block, to_block):
+        requested.append((from_block, to_block))
+        if len(requested) == 1:
+            raise requests.exceptions.Timeout()
+        return []
+
+    updater._pool_registry = PoolRegistryStub()
+    monkeypatch.setattr(updater, "get_pool_logs", get_pool_logs)
+    updater.process_pool_events()
+    assert requested[:2] == [(100, 199), (100, 149)]
+    assert checkpoints[-1] == 200
+
+
+def test_single_update_without_registry(monkeypatch):
+    updater = _updater(monkeypatch)
+    updater._pool_registry = None
+    found = []
+
+    def find_pools(oceandb, dt_address, from_block=0, to_block=None):
+        found.append(dt_address)
+        return ["0xpool"]
+
+    monkeypatch.setattr(metadata_updater, "find_pools", find_pools)
+    asset = {"id": "did:op:" + "d1" * 20, "price": {}, "proof": {}}
+    updater.do_single_update(asset)
+    # only the pools of the datatoken are read, the registry is not loaded
+    assert found == ["0x" + "d1" * 20]
+    assert updater._pool_registry is None
+    assert asset["price"] == {"type": "pool", "pools": ["0xpool"]}
@@ -0,0 +1,87 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from aquarius.events import pool_registry
+from aquarius.events.pool_registry import PoolRegistry, find_pools
+
+OCEAN = "0x" + "0c" * 20
+DT_1 = "0x" + "d1" * 20
+DT_2 = "0x" + "d2" * 20
+POOLS = ["0x" + f"{i:02x}" * 20 for i in range(1, 5)]
+
+
+def test_pool_registry(events_object, monkeypatch):
+    oceandb = events_object._oceandb
+    other_index = events_object._other_db_index
+    es = oceandb.driver.es
+    es.indices.delete(index=f"{oceandb.driver.db_index}_pools", ignore=404)
+
+    registry = PoolRegistry(oceandb, other_index, None, None, None, OCEAN)
+    for i, pool in enumerate(POOLS):
+        registry._pools[pool.lower()] = {
+            "pool": pool,
+            "tokens": None,
+            "datatoken": None,
+            "baseToken": None,
+            "block": 10 * i,
+        }
+
+    read = []
+    tokens = {
+        POOLS[0]: [DT_1, OCEAN],
+        POOLS[1]: [OCEAN, DT_1],
+        POOLS[2]: [DT_2, DT_1],
+    }
+    now = 1000
+    monkeypatch.setattr(pool_registry.time, "time", lambda: now)
+
+    def read_tokens(pools):
+        read.append(sorted(pools))
+        return {pool: tokens[pool] for pool in pools if pool in tokens}
+
+    registry._read_tokens = read_tokens
+    registry._resolve_tokens()
+    registry._resolve_tokens()
+    # the tokens of the last pool are not bound yet, it is read again later
+    assert read == [sorted(POOLS)]
+    now += PoolRegistry.TOKENS_RETRY_DELAY
+    registry._resolve_tokens()
+    assert read == [sorted(POOLS), [POOLS[3]]]
+    # at a growing interval
+    now += PoolRegistry.TOKENS_RETRY_DELAY
+    registry._resolve_tokens()
+    assert len(read) == 2
+    now += PoolRegistry.TOKENS_RETRY_DELAY
+    registry._resolve_tokens()
+    assert len(read) == 3
+
+    # the registry is loaded back from its index
+    registry = PoolRegistry(oceandb, other_index, None, None, None)
+    es.indices.refresh(index=registry._index)
+    registry._pools = dict()
+    registry._load(es)
+    assert len(registry) == 4
+    assert registry.get_pools(DT_1.upper()) == POOLS[:2]
+    assert registry.get_pools(DT_1, from_block=5) == [POOLS[1]]
+    assert registry.get_pools(DT_1, to_block=5) == [POOLS[0]]
+    assert registry.get_dt_to_pools(base_token=OCEAN) == {DT_1.lower(): POOLS[:2]}
+    assert registry.get_dt_to_pools() == {
+        DT_1.lower(): POOLS[:2],
+        DT_2.lower(): [POOLS[2]],
+    }
+    assert registry.pools_tokens() == tokens
+    assert registry.get_pool(POOLS[3].upper())["tokens"] is None
+    # the pools of a datatoken are read without loading the registry
+    assert find_pools(oceandb, DT_1.upper()) == POOLS[:2]
+    assert find_pools(oceandb, DT_1, from_block=5) == [POOLS[1]]
+
+    # the pools registered in reorged blocks are dropped
+    registry._drop_pools_after(15)
+    assert registry.pools() == POOLS[:2]
+    es.indices.refresh(index=registry._index)
+    registry._pools = dict()
+    registry._load(es)
+    assert registry.pools() == POOLS[:2]
+
+    es.indices.delete(index=registry._index, ignore=404)
@@ -0,0 +1,139 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from aquarius.events import pool_reserves
+from aquarius.events.pool_reserves import PoolReserves
+
+POOL = Web3.toChecksumAddress("0x" + "01" * 20)
+OCEAN = Web3.toChecksumAddress("0x" + "0c" * 20)
+DT = Web3.toChecksumAddress("0x" + "d1" * 20)
+
+
+def _log(event, block, log_index, **args):
+    return AttributeDict(
+        {
+            "event": event,
+            "address": POOL,
+            "blockNumber": block,
+            "logIndex": log_index,
+            "args": AttributeDict(args),
+        }
+    )
+
+
+def test_pool_reserves(monkeypatch):
+    chain = {
+        "balances": {OCEAN: 1000, DT: 100},
+        "weights": {OCEAN: 7, DT: 3},
+        "swapFee": 1,
+    }
+    reads = []
+
+    def get_pools_snapshots(web3, pools_tokens, block="latest"):
+        reads.append((sorted(pools_tokens.keys()), block))
+        return {
+            pool: {
+                "balances": dict(chain["balances"]),
+                "weights": dict(chain["weights"]),
+                "swapFee": chain["swapFee"],
+            }
+            for pool in pools_tokens
+        }
+
+    monkeypatch.setattr(pool_reserves, "get_pools_snapshots", get_pools_snapshots)
+    reserves = PoolReserves(None, reconcile_interval=3600, state_blocks=0)
+    reserves.apply_logs([], 10)
+    assert reserves.get_snapshots({POOL: [OCEAN, DT]})[POOL]["balances"] == {
+        OCEAN: 1000,
+        DT: 100,
+    }
+    assert reads == [([POOL], 10)]
+
+    logs = [
+        _log("LOG_JOIN", 10, 0, tokenIn=OCEAN, tokenAmountIn=500),
+        _log(
+            "LOG_SWAP",
+            11,
+            0,
+            tokenIn=OCEAN,
+            tokenOut=DT,
+            tokenAmountIn=50,
+            tokenAmountOut=5,
+        ),
+        _log("LOG_EXIT", 12, 3, tokenOut=DT, tokenAmountOut=10),
+    ]
+    reserves.apply_logs(logs, 12)
+    # the events of the snapshot block are already included in the snapshot
+    assert reserves.get_snapshots({POOL: [OCEAN, DT]})[POOL]["balances"] == {
+        OCEAN: 1050,
+        DT: 85,
+    }
+    # applying an overlapping range again does not change the balances
+    reserves.apply_logs(logs, 12)
+    assert reserves.get_snapshots({POOL: [OCEAN, DT]})[POOL]["balances"][DT] == 85
+    assert len(reads) == 1
+
+    chain["balances"] = {OCEAN: 1050, DT: 85}
+    assert reserves.reconcile() == []
+    assert reserves.reconcile(force=True) == []
+    chain["balances"] = {OCEAN: 1060, DT: 85}
+    assert reserves.reconcile(force=True) == [POOL]
+    assert reads[-1] == ([POOL], 12)
+    assert reserves.get_snapshots({POOL: [OCEAN]})[POOL]["balances"][OCEAN] == 1060
+
+    # a pool whose balance would be negative is read again
+    reserves.apply_logs([_log("LOG_EXIT", 13, 0, tokenOut=DT, tokenAmountOut=100)], 13)
+    assert len(reserves) == 0
+    reserves.get_snapshots({POOL: [OCEAN, DT]})
+    assert reads[-1] == ([POOL], 13)
+
+    reserves.clear()
+    assert reserves.block is None and len(reserves) == 0
+
+
+class FakeEth:
+    blockNumber = 1000
+
+
+class FakeWeb3:
+    eth = FakeEth()
+
+
+def test_pool_reserves_catch_up(monkeypatch):
+    reads = []
+
+    def get_pools_snapshots(web3, pools_tokens, block="latest"):
+        reads.append(block)
+        if block != "latest" and FakeEth.blockNumber - block > 128:
+            raise ValueError("missing trie node")
+        return {
+            pool: {"balances": {DT: 100}, "weights": {DT: 3}, "swapFee": 1}
+            for pool in pools_tokens
+        }
+
+    monkeypatch.setattr(pool_reserves, "get_pools_snapshots", get_pools_snapshots)
+    reserves = PoolReserves(FakeWeb3(), reconcile_interval=0)
+
+    # a pool that was not tracked yet is read at the latest block during a catch-up
+    reserves.apply_logs([], 10)
+    assert reserves.get_snapshots({POOL: [DT]})[POOL]["balances"] == {DT: 100}
+    assert reads == ["latest"]
+    assert len(reserves) == 0
+    assert reserves.reconcile() == []
+
+    # and at the applied block once it is recent
+    reserves.apply_logs([], 900)
+    assert reserves.get_snapshots({POOL: [DT]})[POOL]["balances"] == {DT: 100}
+    assert reads == ["latest", 900]
+    assert len(reserves) == 1
+
+    # a failed read at the applied block falls back to the latest block
+    reserves = PoolReserves(FakeWeb3(), state_blocks=0)
+    reserves.apply_logs([], 10)
+    assert reserves.get_snapshots({POOL: [DT]})[POOL]["balances"] == {DT: 100}
+    assert reads[-2:] == [10, "latest"]
+    assert len(reserves) == 0
@@ -0,0 +1,72 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+from aquarius.events.purgatory import Purgatory
+
+
+def _flags(es, index, dids):
+    return {
+        did: es.get(index=index, doc_type="_doc", id=did)["_source"]["isInPurgatory"]
+        for did in dids
+    }
+
+
+def test_purgatory_reconciliation(events_object):
+    es = events_object._oceandb.driver.es
+    index = events_object._oceandb.driver.db_index
+    dids = [f"did:op:{i:040x}" for i in range(1, 5)]
+    es.index(
+        index=index,
+        doc_type="_doc",
+        id=dids[0],
+        body={"id": dids[0], "isInPurgatory": True},
+    )
+    es.index(
+        index=index,
+        doc_type="_doc",
+        id=dids[1],
+        body={"id": dids[1], "isInPurgatory": "false", "purgatoryData": {}},
+    )
+    es.index(
+        index=index,
+        doc_type="_doc",
+        id=dids[2],
+        body={"id": dids[2], "isInPurgatory": "true"},
+    )
+    es.index(
+        index=index,
+        doc_type="_doc",
+        id=dids[3],
+        body={"id": dids[3], "isInPurgatory": "false"},
+        refresh=True,
+    )
+
+    purgatory = Purgatory(es, index, batch_size=2)
+    purgatory.normalize_assets()
+    assert _flags(es, index, dids) == {
+        dids[0]: "true",
+        dids[1]: "false",
+        dids[2]: "true",
+        dids[3]: "false",
+    }
+    assert (
+        "purgatoryData"
+        not in es.get(index=index, doc_type="_doc", id=dids[1])["_source"]
+    )
+
+    # only the flags that change are updated
+    assert purgatory.add({dids[0], dids[1], dids[3]}) == 2
+    assert purgatory.remove_all_except({dids[0], dids[1], dids[3]}) >= 1
+    assert _flags(es, index, dids) == {
+        dids[0]: "true",
+        dids[1]: "true",
+        dids[2]: "false",
+        dids[3]: "true",
+    }
+
+    assert purgatory.remove({dids[1], dids[2]}) == 1
+    assert _flags(es, index, dids)[dids[1]] == "false"
+
+    for did in dids:
+        es.delete(index=index, doc_type="_doc", id=did, refresh=True)
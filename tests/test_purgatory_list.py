@@ -0,0 +1,70 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from aquarius.events.purgatory import PurgatoryListFetcher
+
+LIST_ASSETS = [
+    {"did": "did:op:01", "reason": "bad"},
+    {"did": "did:op:02", "reason": "worse"},
+]
+
+
+class PurgatoryListHandler(BaseHTTPRequestHandler):
+    """Serve the purgatory list with an ETag, answer 304 when it matches."""
+
+    requests_headers = []
+
+    def do_GET(self):
+        PurgatoryListHandler.requests_headers.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps(LIST_ASSETS).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_purgatory_list_fetcher(tmpdir):
+    server = HTTPServer(("127.0.0.1", 0), PurgatoryListHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/list-assets.json"
+    cache_file = str(tmpdir.join("purgatory.json"))
+    expected = {("did:op:01", "bad"), ("did:op:02", "worse")}
+
+    try:
+        fetcher = PurgatoryListFetcher(url, cache_file)
+        assert fetcher.fetch() == expected
+        # not modified
+        assert fetcher.fetch() is None
+        assert PurgatoryListHandler.requests_headers[-1]["If-None-Match"] == '"v1"'
+
+        # after a restart the cached copy is returned once, without downloading it
+        restarted = PurgatoryListFetcher(url, cache_file)
+        assert restarted.fetch() == expected
+        assert restarted.fetch() is None
+        assert len(PurgatoryListHandler.requests_headers) == 4
+
+        # a list that could not be applied is returned again
+        restarted.rearm()
+        assert restarted.fetch() == expected
+        assert restarted.fetch() is None
+        assert len(PurgatoryListHandler.requests_headers) == 6
+        assert all(
+            h.get("If-None-Match") == '"v1"'
+            for h in PurgatoryListHandler.requests_headers[1:]
+        )
+    finally:
+        server.shutdown()
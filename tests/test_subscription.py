@@ -0,0 +1,111 @@
+#
+# Copyright 2021 Ocean Protocol Foundation
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import websockets
+
+from aquarius.events.subscription import NewBlocksSubscription
+
+
+def _run_node(blocks, ready, port_holder, close=True):
+    """Local stand-in for a node answering `eth_subscribe` with a few `newHeads`
+    and then closing the connection, or keeping it idle if `close` is False."""
+
+    async def handler(ws, path=None):
+        request = json.loads(await ws.recv())
+        assert request["method"] == "eth_subscribe"
+        await ws.send(
+            json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": "0xab"})
+        )
+        # a notification of another subscription is ignored
+        await ws.send(
+            json.dumps(
+                {
+                    "jsonrpc": "2.0",
+                    "method": "eth_subscription",
+                    "params": {"subscription": "0xcd", "result": {"number": "0x1"}},
+                }
+            )
+        )
+        for block in blocks:
+            await ws.send(
+                json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "eth_subscription",
+                        "params": {
+                            "subscription": "0xab",
+                            "result": {"number": hex(block)},
+                        },
+                    }
+                )
+            )
+        if close:
+            await ws.close()
+        else:
+            await asyncio.sleep(60)
+
+    async def serve():
+        server = await websockets.serve(handler, "127.0.0.1", 0)
+        port_holder.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.new_event_loop().run_until_complete(serve())
+
+
+def _start_node(blocks, close=True):
+    ready = threading.Event()
+    port_holder = []
+    thread = threading.Thread(
+        target=_run_node, args=(blocks, ready, port_holder, close), daemon=True
+    )
+    thread.start()
+    ready.wait(5)
+    return f"ws://127.0.0.1:{port_holder[0]}"
+
+
+def test_new_blocks_subscription():
+    received = []
+    threads = set()
+
+    def on_new_block(block):
+        received.append(block)
+        threads.add(threading.current_thread())
+
+    subscription = NewBlocksSubscription(
+        _start_node([10, 11, 12]), on_new_block, lambda: True, timeout=5
+    )
+    # the node closes the connection after the last block
+    with pytest.raises(Exception):
+        subscription.run()
+
+    assert received == [10, 11, 12]
+    # the blocks are not processed in the event loop
+    assert threading.current_thread() not in threads
+
+
+def test_new_blocks_subscription_stop():
+    received = []
+    subscription = NewBlocksSubscription(
+        _start_node([10], close=False), received.append, lambda: True, timeout=60
+    )
+    thread = threading.Thread(target=subscription.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while not received and time.time() < deadline:
+        time.sleep(0.01)
+
+    # the pending receive is cancelled, run returns without waiting for a block
+    start = time.time()
+    subscription.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert time.time() - start < 5
+    assert received == [10]
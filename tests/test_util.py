@@ -7,7 +7,7 @@ import os
 import pytest
 
 from aquarius.app.util import get_bool_env_value
-from aquarius.block_utils import BlockProcessingClass
+from aquarius.block_utils import BlockProcessingClass, BlockRangeChunker
 
 
 def test_get_bool_env_value():
@@ -61,3 +61,50 @@ def test_get_set_last_block_without_ignore(monkeypatch):
     mu = MetadataUpdaterTestClass()
 
     assert mu.get_or_set_last_block() == 100
+
+
+def test_block_range_chunker():
+    chunker = BlockRangeChunker(100, min_size=10, max_size=400)
+
+    assert chunker.next_range(0, 1000) == (0, 99)
+    assert chunker.next_range(950, 1000) == (950, 1000)
+
+    chunker.adjust(elapsed=0.5, num_results=10)
+    assert chunker.size == 200
+    chunker.adjust(elapsed=0.5, num_results=10)
+    chunker.adjust(elapsed=0.5, num_results=10)
+    assert chunker.size == 400
+
+    chunker.adjust(elapsed=10, num_results=10)
+    assert chunker.size == 400
+    chunker.adjust(elapsed=0.5, num_results=chunker.max_results)
+    assert chunker.size == 200
+
+    while chunker.shrink():
+        pass
+    assert chunker.size == 10
+    assert chunker.shrink() is False
+
+
+class ReorgTestClass(BlockProcessingClass):
+    def __init__(self, chain_hashes, recent_hashes):
+        self._chain_hashes = chain_hashes
+        self._recent_hashes = recent_hashes
+
+    def get_block_hash(self, block):
+        return self._chain_hashes.get(block)
+
+
+def test_get_resume_block():
+    recent_hashes = [[10, "0x10"], [20, "0x20"], [30, "0x30"]]
+
+    canonical = ReorgTestClass({10: "0x10", 20: "0x20", 30: "0x30"}, recent_hashes)
+    assert canonical.get_resume_block(30) == 30
+
+    reorged = ReorgTestClass({10: "0x10", 20: "0x20", 30: "0xbad"}, recent_hashes)
+    assert reorged.get_resume_block(30) == 20
+    assert reorged._recent_hashes == [[10, "0x10"], [20, "0x20"]]
+
+    deep_reorg = ReorgTestClass({10: "0xa", 20: "0xb", 30: "0xc"}, recent_hashes)
+    assert deep_reorg.get_resume_block(30) == 9
+    assert deep_reorg._recent_hashes == []